@@ -0,0 +1,18 @@
+"""
+Offline benchmarks for pyrostep; they need no network or telegram account.
+
+Run one of them from repository root::
+
+    python -m benchmarks.suite      # dispatcher scenarios over users and stores
+    python -m benchmarks.listen     # listener hit/miss overhead
+    python -m benchmarks.wait_for   # wait_for timeouts at scale
+    python -m benchmarks.fsm        # fsm.Machine against register_next_step
+    python -m benchmarks.sqlite_store
+    python -m benchmarks.shared     # SharedStore workers: rolling deploy, races, round-trips
+    python -m benchmarks.threads    # ThreadSafeStore stress across threads and throughput
+    python -m benchmarks.pool       # step handlers inline against StepPool, with slow users
+    python -m benchmarks.snapshot   # RootStore snapshot and restore of many steps
+    python -m benchmarks.scheduler  # SendScheduler against a fake rate-limited Telegram
+    python -m benchmarks.connection # instrument() and Backoff on a fake flaky network
+    python -m benchmarks.keyboard   # keyboard templates against keyboard()/inlinekeyboard()
+"""
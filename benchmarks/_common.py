@@ -0,0 +1,78 @@
+import asyncio
+import time
+import typing
+
+from pyrogram import ContinuePropagation, enums, types
+
+
+class FakeClient:
+    """
+    Stands in for `pyrogram.Client`; only records added handlers.
+    """
+
+    def __init__(self) -> None:
+        self.handlers: typing.List[typing.Tuple[typing.Any, int]] = []
+
+    def add_handler(self, handler, group: int = 0):
+        self.handlers.append((handler, group))
+        return handler, group
+
+    @property
+    def callback(self) -> typing.Callable:
+        return self.handlers[-1][0].callback
+
+
+def message(user_id: int, chat_id: typing.Optional[int] = None, text: str = "hello") -> types.Message:
+    """
+    Returns a synthetic private (or group, if `chat_id` is given) text message.
+    """
+    chat_type = enums.ChatType.PRIVATE if chat_id is None else enums.ChatType.GROUP
+    return types.Message(
+        id=1,
+        from_user=types.User(id=user_id),
+        chat=types.Chat(id=user_id if chat_id is None else chat_id, type=chat_type),
+        text=text,
+    )
+
+
+def callback_query(user_id: int, data: str = "data") -> types.CallbackQuery:
+    """
+    Returns a synthetic callback query.
+    """
+    return types.CallbackQuery(id="1", from_user=types.User(id=user_id), chat_instance="1", data=data)
+
+
+async def feed(callback: typing.Callable, client, update) -> bool:
+    """
+    Feeds update to handler callback; returns False if it was propagated.
+    """
+    try:
+        await callback(client, update)
+    except ContinuePropagation:
+        return False
+
+    return True
+
+
+def percentile(sorted_values: typing.Sequence[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def report(name: str, count: int, elapsed: float) -> None:
+    print("%-40s %10.0f ops/s %10.2f us/op" % (name, count / elapsed, elapsed / count * 1e6))
+
+
+def timed(fn: typing.Callable[[], typing.Awaitable[int]]) -> typing.Tuple[int, float]:
+    """
+    Runs `fn` in a new event loop; returns (ops, seconds).
+    """
+
+    async def _run():
+        start = time.perf_counter()
+        count = await fn()
+        return count, time.perf_counter() - start
+
+    return asyncio.run(_run())
@@ -0,0 +1,129 @@
+"""
+`connection.instrument()` on a fake flaky network: a transport which is down for a
+while, and API calls which fail at random; compares pyrogram's fixed delays against
+`connection.Backoff`, and prints what `ConnectionStats` recorded.
+
+Usage::
+
+    python -m benchmarks.connection [error rate]
+"""
+import asyncio
+import random
+import sys
+import time
+import typing
+
+from pyrogram import raw
+from pyrogram.errors import InternalServerError
+
+import pyrogram.connection.connection
+import pyrogram.session.session
+
+from pyrostep import connection
+
+CALLS = 300
+OUTAGES = (0.3, 1.0, 3.0)
+
+
+class FlakyTransport:
+    """
+    Stands in for TCPAbridged; refuses connections until `up_at`.
+    """
+
+    up_at = 0.0
+
+    def __init__(self, ipv6: bool, proxy: typing.Any) -> None:
+        pass
+
+    async def connect(self, address: typing.Any) -> None:
+        await asyncio.sleep(0.01)
+        if time.monotonic() < FlakyTransport.up_at:
+            raise ConnectionRefusedError("network is down")
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeSession:
+    """
+    Has what `Session.invoke` uses; `send` fails at random.
+    """
+
+    WAIT_TIMEOUT = 15
+    SLEEP_THRESHOLD = 10
+
+    def __init__(self, error_rate: float) -> None:
+        self.error_rate = error_rate
+        self.is_started = asyncio.Event()
+        self.is_started.set()
+        self.client = type("FakeClient", (), {"name": "fake"})()
+
+    async def send(self, query: typing.Any, timeout: float) -> typing.Any:
+        await asyncio.sleep(0.005)
+        if random.random() < self.error_rate:
+            raise InternalServerError("fake")
+
+        return True
+
+
+async def outage(seconds: float) -> float:
+    conn = pyrogram.connection.connection.Connection(2, False, False, None)
+
+    FlakyTransport.up_at = time.monotonic() + seconds
+    start = time.monotonic()
+    await conn.connect()
+    return time.monotonic() - start
+
+
+async def calls(error_rate: float) -> typing.List[float]:
+    session = FakeSession(error_rate)
+    invoke = pyrogram.session.session.Session.invoke
+
+    async def call() -> float:
+        start = time.monotonic()
+        await invoke(session, raw.functions.Ping(ping_id=0), 20)
+        return time.monotonic() - start
+
+    return sorted(await asyncio.gather(*(call() for _ in range(CALLS))))
+
+
+def main() -> None:
+    error_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+
+    cases = [
+        ("fixed (pyrogram)", None),
+        ("Backoff(base=0.1, cap=5)", connection.Backoff(base=0.1, cap=5, max_attempts=None)),
+    ]
+
+    print("outages of %s seconds, then %d calls with %.0f%% errors" % (OUTAGES, CALLS, error_rate * 100))
+    for name, backoff in cases:
+        stats = connection.instrument(backoff=backoff, transport=FlakyTransport)
+        if backoff is None:
+            # pyrogram gives up after 3 attempts; keep trying like Session.start does
+            pyrogram.connection.connection.Connection.MAX_CONNECTION_ATTEMPTS = 1000
+
+        try:
+            reconnects = [asyncio.run(outage(down)) for down in OUTAGES]
+            latencies = asyncio.run(calls(error_rate))
+        finally:
+            connection.uninstrument()
+
+        print(
+            "%-26s reconnect %s (%3d attempts)  call p50 %6.1fms p99 %6.1fms  retries %4d  waited %6.1fs"
+            % (
+                name,
+                " ".join("%5.2fs" % s for s in reconnects),
+                stats.connects + stats.connect_failures,
+                latencies[len(latencies) // 2] * 1e3,
+                latencies[int(len(latencies) * 0.99)] * 1e3,
+                stats.retries,
+                stats.retry_wait_seconds,
+            )
+        )
+
+    print()
+    print(stats.prometheus())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Three-step sign-in flow with `pyrostep.fsm.Machine` against the equivalent
+`register_next_step` chain: per-step latency and memory per pending conversation.
+"""
+import asyncio
+import time
+import tracemalloc
+
+from pyrostep import steps
+from pyrostep.fsm import END, Machine
+
+from ._common import FakeClient, feed, message, report
+
+USERS = 50_000
+
+
+async def run_steps(users: int):
+    store = steps.RootStore()
+    client = FakeClient()
+    steps.listen(client, store)
+    callback = client.callback
+
+    async def get_username(_c, _u):
+        await steps.register_next_step(_u.from_user.id, get_password, store, kwargs={"username": _u.text})
+
+    async def get_password(_c, _u, username=None):
+        await steps.register_next_step(
+            _u.from_user.id, get_code, store, kwargs={"username": username, "password": _u.text}
+        )
+
+    async def get_code(_c, _u, username=None, password=None):
+        pass
+
+    tracemalloc.start()
+    await steps.register_next_step(range(users), get_username, store)
+    for i in range(users):
+        await feed(callback, client, message(i, text="user"))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    updates = [message(i, text=text) for text in ("password", "code") for i in range(users)]
+
+    start = time.perf_counter()
+    for update in updates:
+        await feed(callback, client, update)
+
+    return memory, time.perf_counter() - start
+
+
+async def run_machine(users: int):
+    machine = Machine()
+    client = FakeClient()
+    machine.listen(client)
+    callback = client.callback
+
+    @machine.on("username")
+    async def get_username(_c, _u, ctx):
+        ctx["username"] = _u.text
+        return "password"
+
+    @machine.on("password")
+    async def get_password(_c, _u, ctx):
+        ctx["password"] = _u.text
+        return "code"
+
+    @machine.on("code")
+    async def get_code(_c, _u, ctx):
+        return END
+
+    tracemalloc.start()
+    for i in range(users):
+        machine.start(i, "username", {})
+    for i in range(users):
+        await feed(callback, client, message(i, text="user"))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    updates = [message(i, text=text) for text in ("password", "code") for i in range(users)]
+
+    start = time.perf_counter()
+    for update in updates:
+        await feed(callback, client, update)
+
+    return memory, time.perf_counter() - start
+
+
+def main() -> None:
+    for name, fn in (("register_next_step", run_steps), ("fsm.Machine", run_machine)):
+        memory, elapsed = asyncio.run(fn(USERS))
+        report("step (%s)" % name, USERS * 2, elapsed)
+        print("%-40s %10.0f bytes/conversation" % ("memory (%s)" % name, memory / USERS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+`shortcuts.inlinekeyboard`/`keyboard` against prebuilt keyboard templates.
+"""
+import sys
+import time
+
+from pyrostep import shortcuts
+
+from ._common import report
+
+CALLS = 100_000
+
+MENU = [
+    [["Profile", "profile"], ["Settings", "settings"]],
+    [["Orders", "orders"], ["Cart", "cart"], ["Wishlist", "wishlist"]],
+    [["Support", "https://t.me/support", "url"]],
+]
+
+SLOTTED = [
+    [["Profile", "profile"], ["Settings", "settings"]],
+    [["Orders", "orders"], ["Cart", shortcuts.Slot("user", "cart:{}")], ["Wishlist", "wishlist"]],
+    [["Support", "https://t.me/support", "url"]],
+]
+
+REPLY = [
+    [["Profile"], ["Settings"]],
+    [["Orders"], ["Cart"], ["Wishlist"]],
+    [["Share contact", True, "request_contact"]],
+]
+
+
+def bench(name: str, fn, calls: int) -> None:
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+
+    report(name, calls, time.perf_counter() - start)
+
+
+def main() -> None:
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else CALLS
+
+    slotted = [
+        [["Profile", "profile"], ["Settings", "settings"]],
+        [["Orders", "orders"], ["Cart", ""], ["Wishlist", "wishlist"]],
+        [["Support", "https://t.me/support", "url"]],
+    ]
+
+    def build_slotted(i):
+        slotted[1][1][1] = "cart:%d" % i
+        return shortcuts.inlinekeyboard(slotted)
+
+    bench("inlinekeyboard (static)", lambda i: shortcuts.inlinekeyboard(MENU), calls)
+
+    template = shortcuts.inlinekeyboard_template(MENU)
+    bench("template (static)", lambda i: template(), calls)
+    bench("inlinekeyboard_template(lst)() (static)", lambda i: shortcuts.inlinekeyboard_template(MENU)(), calls)
+
+    bench("inlinekeyboard (per-user payload)", build_slotted, calls)
+
+    template = shortcuts.inlinekeyboard_template(SLOTTED)
+    bench("template (per-user payload)", lambda i: template(user=i), calls)
+
+    bench("keyboard (static)", lambda i: shortcuts.keyboard(REPLY, resize_keyboard=True), calls)
+
+    template = shortcuts.keyboard_template(REPLY, resize_keyboard=True)
+    bench("keyboard_template (static)", lambda i: template(), calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Per-update overhead of `pyrostep.listen` wrapper for hits and misses.
+"""
+import asyncio
+
+from pyrostep import steps
+
+from ._common import FakeClient, feed, message, report, timed
+
+UPDATES = 100_000
+
+
+class SlowStore(steps.MetaStore):
+    """
+    Dict-backed store which sleeps on every call, like a remote store.
+    """
+
+    # only written from this process
+    local_index = True
+
+    def __init__(self, latency: float = 0.0001) -> None:
+        self.latency = latency
+        self.data = {}
+
+    async def set_item(self, key, value):
+        await asyncio.sleep(self.latency)
+        self.data[key] = value
+
+    async def pop_item(self, key):
+        await asyncio.sleep(self.latency)
+        return self.data.pop(key)
+
+    async def clear(self):
+        await asyncio.sleep(self.latency)
+        while self.data:
+            yield self.data.popitem()[1]
+
+
+def bench_miss(store: steps.MetaStore, updates: int) -> None:
+    client = FakeClient()
+    steps.listen(client, store)
+    callback = client.callback
+    msgs = [message(i) for i in range(1000)]
+
+    async def run():
+        for i in range(updates):
+            await feed(callback, client, msgs[i % 1000])
+        return updates
+
+    report("miss (%s)" % type(store).__name__, *timed(run))
+
+
+def bench_hit(store: steps.MetaStore, updates: int) -> None:
+    client = FakeClient()
+    steps.listen(client, store)
+    callback = client.callback
+    msgs = [message(i) for i in range(1000)]
+
+    async def step(_c, _u):
+        pass
+
+    async def run():
+        for i in range(updates):
+            await steps.register_next_step(i % 1000, step, store)
+            await feed(callback, client, msgs[i % 1000])
+        return updates
+
+    report("register + hit (%s)" % type(store).__name__, *timed(run))
+
+
+def main() -> None:
+    bench_miss(steps._RootStore(), UPDATES)
+    bench_hit(steps._RootStore(), UPDATES)
+    bench_miss(SlowStore(), UPDATES // 10)
+    bench_hit(SlowStore(), UPDATES // 100)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Step handlers run inline against `StepPool`, behind a simulated pyrogram dispatcher
+(a queue of updates and a few worker tasks).
+
+Some users have slow steps (e.g. an upload); every step registers the next one. Reports
+latency of fast users' steps (from update arrival to handler start), throughput, and
+checks that every update was handled as a step, and each user's steps ran in order of
+their updates.
+
+Usage::
+
+    python -m benchmarks.pool [fast users] [updates per user] [slow users]
+"""
+import asyncio
+import sys
+import time
+import typing
+
+from pyrogram import ContinuePropagation
+
+import pyrostep
+from pyrostep import steps
+
+from ._common import FakeClient, message, percentile
+
+DISPATCHER_WORKERS = 4
+FAST_STEP = 0.001
+SLOW_STEP = 0.5
+
+
+async def run(
+    pool: typing.Optional[pyrostep.StepPool], fast: int, per_user: int, slow: int
+) -> typing.Tuple[float, typing.List[float], int]:
+    store = steps.RootStore()
+    client = FakeClient()
+    steps.listen(client, store, pool=pool)
+    callback = client.callback
+
+    seen: typing.Dict[int, typing.List[int]] = {}
+    latencies: typing.List[float] = []
+    arrived: typing.Dict[int, float] = {}
+
+    async def step(_c, _u):
+        uid = _u.from_user.id
+        if uid >= slow:
+            latencies.append(time.perf_counter() - arrived[_u.id])
+
+        seen.setdefault(uid, []).append(_u.id)
+        await steps.register_next_step(uid, step, store)
+        await asyncio.sleep(SLOW_STEP if uid < slow else FAST_STEP)
+
+    users = range(fast + slow)
+    await steps.register_next_step(users, step, store)
+
+    updates: asyncio.Queue = asyncio.Queue()
+
+    async def dispatcher() -> None:
+        while True:
+            update = await updates.get()
+            try:
+                await callback(client, update)
+            except ContinuePropagation:
+                pass
+            finally:
+                updates.task_done()
+
+    workers = [asyncio.ensure_future(dispatcher()) for _ in range(DISPATCHER_WORKERS)]
+
+    start = time.perf_counter()
+    n = 0
+    for _ in range(per_user):
+        for uid in users:
+            m = message(uid)
+            m.id = n
+            arrived[n] = time.perf_counter()
+            n += 1
+            await updates.put(m)
+
+        # users answer about every 10ms; a step is registered again by the previous one
+        await asyncio.sleep(0.01)
+
+    await updates.join()
+    if pool is not None:
+        await pool.join()
+
+    elapsed = time.perf_counter() - start
+
+    for w in workers:
+        w.cancel()
+
+    await asyncio.gather(*workers, return_exceptions=True)
+    if pool is not None:
+        await pool.stop()
+
+    handled = sum(map(len, seen.values()))
+    assert handled == n, "%d of %d updates were handled" % (handled, n)
+    for ids in seen.values():
+        assert ids == sorted(ids), "steps of a user ran out of order"
+
+    return elapsed, sorted(latencies), handled
+
+
+def main() -> None:
+    fast = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    slow = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    print(
+        "%d fast users (%.0fms steps), %d slow users (%.0fms steps), %d updates each; %d dispatcher workers"
+        % (fast, FAST_STEP * 1e3, slow, SLOW_STEP * 1e3, per_user, DISPATCHER_WORKERS)
+    )
+
+    for name, pool in (("inline", None), ("StepPool(workers=64)", pyrostep.StepPool(workers=64))):
+        elapsed, latencies, handled = asyncio.run(run(pool, fast, per_user, slow))
+        print(
+            "%-22s %6.2fs  %6d steps  fast users' step delay p50 %8.2fms p99 %8.2fms"
+            % (name, elapsed, handled, percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3)
+        )
+
+
+if __name__ == "__main__":
+    main()
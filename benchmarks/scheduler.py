@@ -0,0 +1,111 @@
+"""
+`connection.SendScheduler` against a fake Telegram which raises FloodWait when its global
+or per-chat limits (per one-second window) are exceeded.
+
+Compares sending everything at once with pyrogram-style inline sleeping on FloodWait,
+against the scheduler with right and with overestimated rates. Limits are scaled up (x10)
+so it runs in seconds.
+
+Usage::
+
+    python -m benchmarks.scheduler [messages] [chats]
+"""
+import asyncio
+import collections
+import sys
+import time
+import typing
+
+from pyrogram.errors import FloodWait
+
+from pyrostep.connection import SendScheduler
+
+GLOBAL_LIMIT = 300
+CHAT_LIMIT = 10
+LATENCY = 0.005
+
+
+class FakeTelegram:
+    """
+    Accepts `send_message` calls; raises FloodWait if more than limits were sent in the
+    last second.
+    """
+
+    def __init__(self) -> None:
+        self.sent: typing.List[typing.Tuple[float, int]] = []
+        self.flood_waits = 0
+        self._global: typing.Deque[float] = collections.deque()
+        self._chats: typing.Dict[int, typing.Deque[float]] = collections.defaultdict(collections.deque)
+
+    @staticmethod
+    def _full(window: typing.Deque[float], now: float, limit: int) -> bool:
+        while window and window[0] <= now - 1:
+            window.popleft()
+
+        return len(window) >= limit
+
+    async def send_message(self, chat_id: int, text: str) -> int:
+        await asyncio.sleep(LATENCY)
+
+        now = time.monotonic()
+        chat = self._chats[chat_id]
+        if self._full(self._global, now, GLOBAL_LIMIT) or self._full(chat, now, CHAT_LIMIT):
+            self.flood_waits += 1
+            raise FloodWait(value=1)
+
+        self._global.append(now)
+        chat.append(now)
+        self.sent.append((now, chat_id))
+        return len(self.sent)
+
+
+async def naive(server: FakeTelegram, jobs: typing.List[int]) -> None:
+    async def send(chat_id: int) -> None:
+        while True:
+            try:
+                await server.send_message(chat_id, "hello")
+                return
+            except FloodWait as e:
+                await asyncio.sleep(e.value)  # type: ignore[arg-type]
+
+    await asyncio.gather(*(send(chat_id) for chat_id in jobs))
+
+
+def scheduled(rate: float) -> typing.Callable[[FakeTelegram, typing.List[int]], typing.Awaitable[None]]:
+    async def run(server: FakeTelegram, jobs: typing.List[int]) -> None:
+        # rate + burst may be sent in one second
+        scheduler = SendScheduler(rate=rate * 0.9, chat_rate=CHAT_LIMIT, burst=rate * 0.1, max_retries=100)
+        await asyncio.gather(*(scheduler.call(chat_id, server.send_message, chat_id, "hello") for chat_id in jobs))
+        await scheduler.close()
+        print("    final rate %.1f/s" % scheduler.rate)
+
+    return run
+
+
+def main() -> None:
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+    jobs = [i % chats + 1 for i in range(messages)]
+
+    print("%d messages to %d chats; limits %d/s global, %d/s per chat" % (messages, chats, GLOBAL_LIMIT, CHAT_LIMIT))
+    print("ideal: %.2fs" % (messages / min(GLOBAL_LIMIT, chats * CHAT_LIMIT)))
+
+    cases = [
+        ("naive, sleep inline", naive),
+        ("scheduler, rate=%d" % GLOBAL_LIMIT, scheduled(GLOBAL_LIMIT)),
+        ("scheduler, rate=%d (too high)" % (GLOBAL_LIMIT * 2), scheduled(GLOBAL_LIMIT * 2)),
+    ]
+
+    for name, fn in cases:
+        server = FakeTelegram()
+        start = time.perf_counter()
+        asyncio.run(fn(server, jobs))
+        elapsed = time.perf_counter() - start
+        print(
+            "%-32s %7.2fs %8.0f msg/s %6d flood waits"
+            % (name, elapsed, len(server.sent) / elapsed, server.flood_waits)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+`SharedStore` workers on a `MemoryRedis` with simulated network latency.
+
+Checks that a worker which doesn't know a step's handler yet (a rolling deploy) leaves
+the step for a worker which does, and that two workers racing for one step run it once;
+then reports round-trips and throughput of batched registration and dispatch.
+
+Usage::
+
+    python -m benchmarks.shared [users] [latency ms]
+"""
+import asyncio
+import sys
+import time
+import typing
+
+from pyrostep import steps
+from pyrostep.stores import MemoryRedis, SharedStore
+from pyrostep.stores.shared import MemoryPipeline
+
+from ._common import FakeClient, feed, message
+
+handled: typing.List[int] = []
+
+
+@steps.step_handler(name="benchmarks.shared.step")
+async def step(_c, _u, n: int = 0):
+    handled.append(_u.from_user.id)
+
+
+class LaggyRedis(MemoryRedis):
+    """
+    MemoryRedis which waits `latency` seconds on each command or pipeline, like a network.
+    """
+
+    def __init__(self, latency: float) -> None:
+        super().__init__()
+        self.latency = latency
+        self.trips = 0
+        self._executing = False
+
+    async def trip(self) -> None:
+        if not self._executing:
+            self.trips += 1
+            await asyncio.sleep(self.latency)
+
+    async def get(self, name):
+        await self.trip()
+        return await super().get(name)
+
+    async def mget(self, names):
+        await self.trip()
+        return await super().mget(names)
+
+    async def set(self, name, value, px=None):
+        await self.trip()
+        return await super().set(name, value, px=px)
+
+    async def getdel(self, name):
+        await self.trip()
+        return await super().getdel(name)
+
+    async def delete(self, *names):
+        await self.trip()
+        return await super().delete(*names)
+
+    async def publish(self, channel, message):
+        await self.trip()
+        return await super().publish(channel, message)
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return LaggyPipeline(self)
+
+
+class LaggyPipeline(MemoryPipeline):
+    async def watch(self, *names: str) -> None:
+        await self._redis.trip()
+        await super().watch(*names)
+
+    async def execute(self):
+        await self._redis.trip()
+        self._redis._executing = True
+        try:
+            return await super().execute()
+        finally:
+            self._redis._executing = False
+
+
+async def worker(redis: MemoryRedis) -> typing.Tuple[SharedStore, typing.Callable, FakeClient]:
+    store = SharedStore(redis)
+    await store.start()
+    client = FakeClient()
+    steps.listen(client, store)
+    return store, client.callback, client
+
+
+async def rolling_deploy(latency: float) -> None:
+    redis = LaggyRedis(latency)
+    (old, old_callback, old_client), (new, new_callback, new_client) = [await worker(redis) for _ in range(2)]
+
+    await steps.register_next_step(1, step, new)
+    await asyncio.sleep(latency * 2)  # let pub/sub deliver the key
+
+    # old worker hasn't imported the handler module yet
+    fn = steps._handlers.pop("benchmarks.shared.step")
+    try:
+        assert not await feed(old_callback, old_client, message(1)), "unknown step was handled"
+    finally:
+        steps._handlers["benchmarks.shared.step"] = fn
+
+    assert redis.data, "unknown step was deleted"
+    assert await feed(new_callback, new_client, message(1)) and handled == [1], "kept step wasn't handled"
+    assert not redis.data
+
+    # both workers get an update of the same user at once; only one may take the step
+    handled.clear()
+    await steps.register_next_step(2, step, old)
+    await asyncio.sleep(latency * 2)
+    hits = await asyncio.gather(feed(old_callback, old_client, message(2)), feed(new_callback, new_client, message(2)))
+    assert sorted(hits) == [False, True] and handled == [2], "step was taken twice"
+
+    for store in (old, new):
+        await store.close()
+
+
+async def throughput(users: int, latency: float) -> None:
+    redis = LaggyRedis(latency)
+    store, callback, client = await worker(redis)
+
+    start = time.perf_counter()
+    await steps.register_next_step(range(users), step, store, ttl=60)
+    registered = time.perf_counter() - start
+    register_trips = redis.trips
+
+    redis.trips = 0
+    handled.clear()
+    start = time.perf_counter()
+    await asyncio.gather(*(feed(callback, client, message(i)) for i in range(users)))
+    dispatched = time.perf_counter() - start
+    assert len(handled) == users and not redis.data
+
+    print(
+        "register %6d users: %7.3fs %5d round-trips | dispatch: %7.3fs %6.2f round-trips/update"
+        % (users, registered, register_trips, dispatched, redis.trips / users)
+    )
+    await store.close()
+
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 0.5) / 1e3
+
+    asyncio.run(rolling_deploy(latency))
+    print("rolling deploy and racing workers: ok")
+    asyncio.run(throughput(users, latency))
+
+
+if __name__ == "__main__":
+    main()
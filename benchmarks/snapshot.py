@@ -0,0 +1,56 @@
+"""
+`RootStore.snapshot()` and `restore()` of many steps: time and file size. A tenth of
+steps have arguments and a tenth have a ttl.
+
+Usage::
+
+    python -m benchmarks.snapshot [steps]
+"""
+import functools
+import os
+import sys
+import tempfile
+import time
+
+import pyrostep
+from pyrostep import steps
+
+
+@pyrostep.step_handler
+async def get_name(_c, _u, lang: str = "en"):
+    pass
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    path = os.path.join(tempfile.mkdtemp(), "steps.snap")
+
+    store = steps.RootStore()
+    now = time.monotonic()
+    for i in range(count):
+        if i % 10 == 1:
+            store._set(i, functools.partial(get_name, lang="fa"), now, None)
+        elif i % 10 == 2:
+            store._set(i, get_name, now, 3600)
+        else:
+            store._set(i, get_name, now, None)
+
+    start = time.perf_counter()
+    report = store.snapshot(path)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(path)
+    print(
+        "snapshot %9d steps %6.2fs %9.0f steps/s  %6.1f MB (%.1f bytes/step)"
+        % (report.saved, elapsed, report.saved / elapsed, size / 1e6, size / report.saved)
+    )
+
+    start = time.perf_counter()
+    restored = steps.RootStore().restore(path)
+    elapsed = time.perf_counter() - start
+    print("restore  %9d steps %6.2fs %9.0f steps/s" % (restored.restored, elapsed, restored.restored / elapsed))
+
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Registration and pop throughput of `SQLiteStore` against `RootStore`, and reload time.
+"""
+import os
+import tempfile
+import time
+
+from pyrostep import steps
+from pyrostep.stores import SQLiteStore
+
+from ._common import report, timed
+
+STEPS = 100_000
+
+
+@steps.step_handler(name="bench.step")
+async def step(_c, _u, n=0):
+    pass
+
+
+def bench(name: str, make_store, count: int) -> None:
+    async def register():
+        store = make_store()
+        for i in range(count):
+            await steps.register_next_step(i, step, store, kwargs={"n": i})
+
+        if isinstance(store, SQLiteStore):
+            await store.close()
+
+        return count
+
+    report("register (%s)" % name, *timed(register))
+
+    async def pop():
+        store = make_store()
+        for i in range(count):
+            await steps.register_next_step(i, step, store, kwargs={"n": i})
+            await store.pop_item(i)
+
+        if isinstance(store, SQLiteStore):
+            await store.close()
+
+        return count
+
+    report("register + pop (%s)" % name, *timed(pop))
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "steps.db")
+
+        bench("RootStore", steps.RootStore, STEPS)
+        bench("SQLiteStore", lambda: SQLiteStore(path), STEPS)
+
+        # leave STEPS pending steps and measure how long a restart takes
+        async def fill():
+            store = SQLiteStore(path)
+            await steps.register_next_step(range(STEPS), step, store)
+            await store.close()
+            return STEPS
+
+        timed(fill)
+
+        start = time.perf_counter()
+        store = SQLiteStore(path)
+        report("reload (SQLiteStore)", len(store._data), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Step dispatcher benchmark suite: scenarios swept over number of concurrent users and
+store backends, fed with synthetic updates through `listen()` wrapper or
+`listening_handler`.
+
+Usage::
+
+    python -m benchmarks.suite [--users 100 1000 10000] [--stores root sqlite shared]
+                               [--scenarios miss chain wait clear]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+from pyrostep import steps
+from pyrostep.stores import MemoryRedis, SharedStore, SQLiteStore
+
+from ._common import FakeClient, callback_query, feed, message, percentile
+
+
+class Result(typing.NamedTuple):
+    updates: int
+    seconds: float
+    latencies: typing.List[float]
+    memory: float = 0.0
+
+
+@steps.step_handler(name="benchmarks.suite.step")
+async def step(_c, _u, n: int = 0):
+    pass
+
+
+@steps.step_handler(name="benchmarks.suite.chain")
+async def chain(_c, _u, n: int = 0):
+    if n:
+        await steps.register_next_step(_u.from_user.id, chain, _c.store, kwargs={"n": n - 1})
+
+
+class Context:
+    """
+    Store and client of one run; stores which need setup or cleanup are handled here.
+    """
+
+    def __init__(self, backend: str, tmp: str, entry: str) -> None:
+        self.backend = backend
+        self.tmp = tmp
+        self.entry = entry
+        self.client = FakeClient()
+
+    async def __aenter__(self) -> "Context":
+        if self.backend == "root":
+            self.store: steps.MetaStore = steps.RootStore()
+        elif self.backend == "sqlite":
+            path = os.path.join(self.tmp, "steps-%d.db" % time.perf_counter_ns())
+            self.store = SQLiteStore(path)
+        else:
+            self.store = SharedStore(MemoryRedis())
+            await self.store.start()
+
+        # chain handler finds the store through client
+        self.client.store = self.store  # type: ignore[attr-defined]
+
+        if self.entry == "listen":
+            steps.listen(self.client, self.store)
+            self.callback = self.client.callback
+        else:
+            store = self.store
+
+            async def callback(_c, _u):
+                await steps.listening_handler(_c, _u, store)
+
+            self.callback = callback
+
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await steps.clear(self.store)
+
+        if isinstance(self.store, (SQLiteStore, SharedStore)):
+            await self.store.close()
+
+    async def feed_all(self, updates: typing.Sequence) -> typing.Tuple[float, typing.List[float]]:
+        latencies = []
+        callback, client = self.callback, self.client
+        perf_counter = time.perf_counter
+
+        start = perf_counter()
+        for u in updates:
+            t = perf_counter()
+            await feed(callback, client, u)
+            latencies.append(perf_counter() - t)
+
+        return perf_counter() - start, latencies
+
+
+def _native_memory(store: steps.MetaStore) -> int:
+    # RootStore's cache lives outside python heap; tracemalloc doesn't see it
+    return sys.getsizeof(store.cache) if isinstance(store, steps.RootStore) else 0
+
+
+async def scenario_miss(ctx: Context, users: int) -> Result:
+    """
+    99% of updates have no pending step; one user in a hundred has one.
+    """
+    hits = range(0, users, 100)
+    await steps.register_next_step(hits, step, ctx.store)
+
+    updates = [message(i) if i % 2 else callback_query(i) for i in range(users)] * max(1, 20_000 // users)
+    seconds, latencies = await ctx.feed_all(updates)
+    return Result(len(updates), seconds, latencies)
+
+
+async def scenario_chain(ctx: Context, users: int) -> Result:
+    """
+    Every user goes through a chain of five register_next_step handlers.
+    """
+    tracemalloc.start()
+    await steps.register_next_step(range(users), chain, ctx.store, kwargs={"n": 4})
+    memory = (tracemalloc.get_traced_memory()[0] + _native_memory(ctx.store)) / users
+    tracemalloc.stop()
+
+    updates = [message(i) for _ in range(5) for i in range(users)]
+    seconds, latencies = await ctx.feed_all(updates)
+    return Result(len(updates), seconds, latencies, memory)
+
+
+async def scenario_wait(ctx: Context, users: int) -> Result:
+    """
+    Every user has a pending wait_for which is answered at once.
+    """
+    tasks = [asyncio.ensure_future(steps.wait_for(i, 60, ctx.store)) for i in range(users)]
+    await asyncio.sleep(0)
+
+    updates = [message(i) for i in range(users)]
+    seconds, latencies = await ctx.feed_all(updates)
+    await asyncio.gather(*tasks)
+    return Result(len(updates), seconds, latencies)
+
+
+async def scenario_clear(ctx: Context, users: int) -> Result:
+    """
+    clear() on a store with one pending step per user.
+    """
+    tracemalloc.start()
+    await steps.register_next_step(range(users), step, ctx.store)
+    memory = (tracemalloc.get_traced_memory()[0] + _native_memory(ctx.store)) / users
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    await steps.clear(ctx.store)
+    seconds = time.perf_counter() - start
+    return Result(users, seconds, [seconds], memory)
+
+
+SCENARIOS = {
+    "miss": scenario_miss,
+    "chain": scenario_chain,
+    "wait": scenario_wait,
+    "clear": scenario_clear,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--stores", nargs="+", default=["root", "sqlite", "shared"], choices=["root", "sqlite", "shared"])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--entry", default="listen", choices=["listen", "handler"])
+    args = parser.parse_args()
+
+    print(
+        "%-8s %-8s %8s %14s %10s %10s %12s"
+        % ("scenario", "store", "users", "ops/s", "p50 us", "p99 us", "bytes/step")
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.scenarios:
+            for backend in args.stores:
+                for users in args.users:
+
+                    async def run() -> Result:
+                        async with Context(backend, tmp, args.entry) as ctx:
+                            return await SCENARIOS[name](ctx, users)
+
+                    result = asyncio.run(run())
+                    latencies = sorted(result.latencies)
+                    print(
+                        "%-8s %-8s %8d %14.0f %10.2f %10.2f %12s"
+                        % (
+                            name,
+                            backend,
+                            users,
+                            result.updates / result.seconds,
+                            percentile(latencies, 0.5) * 1e6,
+                            percentile(latencies, 0.99) * 1e6,
+                            "%.0f" % result.memory if result.memory else "-",
+                        )
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Stores shared by clients running in many threads, each with its own event loop.
+
+Stress: every thread registers steps (tagged, with a ttl) and `wait_for`s for its own
+users, and updates of those users are fed by the next thread, so every pop and every
+future resolution crosses threads; checks that each step runs exactly once, each waiter
+gets its own update, and the tag index loses no key. Then each thread unregisters the
+next thread's steps by tag.
+
+Throughput: register + hit per user, for `RootStore` and `ThreadSafeStore` in one thread,
+and for `ThreadSafeStore` shared by many threads.
+
+Usage::
+
+    python -m benchmarks.threads [threads] [users per thread]
+"""
+import asyncio
+import sys
+import threading
+import time
+import typing
+
+from pyrostep import steps
+from pyrostep.stores import ThreadSafeStore
+
+from ._common import FakeClient, feed, message, report
+
+WAIT_OFFSET = 10**9
+TAGS = 4
+
+
+def run_threads(count: int, target: typing.Callable[[int], typing.Awaitable[None]]) -> float:
+    errors: typing.List[BaseException] = []
+
+    def main(index: int) -> None:
+        try:
+            asyncio.run(target(index))
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=main, args=(i,)) for i in range(count)]
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+
+    return elapsed
+
+
+def stress(threads: int, users: int) -> None:
+    store = ThreadSafeStore()
+    barrier = threading.Barrier(threads)
+    handled: typing.List[typing.Tuple[int, int]] = []
+    answers: typing.List[typing.Tuple[int, int, bool]] = []
+    dropped = [0] * threads
+
+    async def sync() -> None:
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+    async def worker(index: int) -> None:
+        client = FakeClient()
+        steps.listen(client, store)
+        callback = client.callback
+        loop = asyncio.get_running_loop()
+
+        own = range(index * users, (index + 1) * users)
+        fed = range(((index + 1) % threads) * users, ((index + 1) % threads + 1) * users)
+
+        async def step(_c, _u):
+            handled.append((_u.from_user.id, index))
+
+        # one by one, so threads write the same tags at the same time
+        for i in own:
+            await steps.register_next_step(i, step, store, ttl=60, tag=("shared", i % TAGS))
+
+        await sync()
+
+        if index == 0:
+            tags = store._tags
+            indexed = sorted(k for keys in tags.keys.values() for k in keys)
+            assert indexed == list(range(threads * users)), "tag index lost %d keys" % (threads * users - len(indexed))
+
+        await sync()
+
+        for i in fed:
+            await feed(callback, client, message(i))
+
+        await sync()
+
+        async def wait(i: int) -> None:
+            answer = await steps.wait_for(WAIT_OFFSET + i, 30, store)
+            answers.append((i, answer.from_user.id - WAIT_OFFSET, asyncio.get_running_loop() is loop))
+
+        tasks = [asyncio.ensure_future(wait(i)) for i in own]
+        await asyncio.sleep(0)
+        await sync()
+
+        for i in fed:
+            await feed(callback, client, message(WAIT_OFFSET + i))
+
+        await asyncio.gather(*tasks)
+
+        await steps.register_next_step(own, step, store, tag=("drop", index))
+        await sync()
+
+        following = (index + 1) % threads
+        dropped[index] = await steps.unregister_where(lambda tag: tag == ("drop", following), store)
+
+    elapsed = run_threads(threads, worker)
+
+    total = threads * users
+    assert len(handled) == total, "handled %d of %d steps" % (len(handled), total)
+    assert len({u for u, _ in handled}) == total, "a step ran twice"
+    assert len(answers) == total, "resolved %d of %d waiters" % (len(answers), total)
+    assert all(i == got and own_loop for i, got, own_loop in answers), "waiter got a wrong update"
+    left = sum(store.has_item(i) or store.has_item(WAIT_OFFSET + i) for i in range(total))
+    assert not left, "%d keys left in store" % left
+    assert dropped == [users] * threads, "unregister_where removed %s" % dropped
+    assert not store._tags.keys and not store._tags.tag_of, "tag index isn't empty"
+
+    print("stress: %d threads x %d users ok in %.2fs" % (threads, users, elapsed))
+
+
+async def register_and_hit(store: steps.MetaStore, first: int, users: int) -> int:
+    client = FakeClient()
+    steps.listen(client, store)
+    callback = client.callback
+    msgs = [message(i) for i in range(first, first + users)]
+
+    async def step(_c, _u):
+        pass
+
+    for m in msgs:
+        await steps.register_next_step(m.from_user.id, step, store)
+        await feed(callback, client, m)
+
+    return users
+
+
+def throughput(threads: int, users: int) -> None:
+    total = threads * users
+
+    for store in (steps.RootStore(), ThreadSafeStore()):
+        start = time.perf_counter()
+        asyncio.run(register_and_hit(store, 0, total))
+        report("1 thread, %s" % type(store).__name__, total, time.perf_counter() - start)
+
+    store = ThreadSafeStore()
+
+    async def target(index: int) -> None:
+        await register_and_hit(store, index * users, users)
+
+    report("%d threads, ThreadSafeStore" % threads, total, run_threads(threads, target))
+
+
+def main() -> None:
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    stress(threads, users)
+    throughput(threads, users)
+
+
+if __name__ == "__main__":
+    main()
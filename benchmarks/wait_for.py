@@ -0,0 +1,77 @@
+"""
+Memory and latency of many concurrent `wait_for`s which time out, against the
+previous implementation which used `asyncio.wait_for` for each waiter.
+
+Usage::
+
+    python -m benchmarks.wait_for [COUNT ...]   # default: 10000 100000
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from pyrostep import steps
+
+TIMEOUT = 1.0
+
+
+async def legacy_wait_for(id: int, timeout: float, store: steps.MetaStore):
+    waiters = steps._waiters_of(store)
+    waiter = steps._Waiter(id, asyncio.get_event_loop().create_future(), None, (None,))
+    waiters.add(waiter)
+
+    try:
+        return await asyncio.wait_for(waiter.future, timeout)
+    finally:
+        waiters.remove(waiter)
+
+
+async def run(wait_for, count: int, trace: bool):
+    store = steps.RootStore()
+    expired = 0
+
+    async def one(i):
+        nonlocal expired
+        try:
+            await wait_for(i, TIMEOUT, store)
+        except (TimeoutError, asyncio.TimeoutError):
+            expired += 1
+
+    if trace:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    tasks = [asyncio.ensure_future(one(i)) for i in range(count)]
+    await asyncio.sleep(0)
+    registered = time.perf_counter() - start
+
+    memory = 0
+    if trace:
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    await asyncio.gather(*tasks)
+    # time from when the last waiter was due until every waiter task finished
+    lag = time.perf_counter() - start - registered - TIMEOUT
+
+    assert expired == count
+    return registered, memory, lag
+
+
+def main() -> None:
+    counts = [int(i) for i in sys.argv[1:]] or [10_000, 100_000]
+
+    print("%-10s %-10s %14s %14s %14s" % ("waiters", "impl", "register us/op", "bytes/waiter", "expiry lag ms"))
+    for count in counts:
+        for name, fn in (("legacy", legacy_wait_for), ("wheel", steps.wait_for)):
+            registered, _, lag = asyncio.run(run(fn, count, False))
+            _, memory, _ = asyncio.run(run(fn, count, True))
+            print(
+                "%-10d %-10s %14.2f %14.0f %14.1f"
+                % (count, name, registered / count * 1e6, memory / count, lag * 1e3)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -55,20 +55,20 @@ async def ask_handling(_, msg: types.Message):
 
     await msg.reply("Ok, I made my choice, guess it:")
 
-    while True:
-        answer = await pyrostep.wait_for(msg.from_user.id)
-
-        try:
-            choose = int(answer.text)
-        except ValueError:
-            await msg.reply("Please send number!")
-            continue
-
-        if choose == num:
-            await msg.reply("Oh you guess my choice! you win!")
-            break
-
-        await msg.reply("No, Your choice is %s, try again:" % ("small", "big")[choose > num])
+    # stream stays registered during the game, so fast answers are not lost
+    async with pyrostep.stream(msg.from_user.id) as answers:
+        async for answer in answers:
+            try:
+                choose = int(answer.text)
+            except ValueError:
+                await msg.reply("Please send number!")
+                continue
+
+            if choose == num:
+                await msg.reply("Oh you guess my choice! you win!")
+                break
+
+            await msg.reply("No, Your choice is %s, try again:" % ("small", "big")[choose > num])
 
 
 async def main():
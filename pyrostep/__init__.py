@@ -5,28 +5,44 @@ __author__ = "aWolver"
 __version__ = "2.11.22"
 
 __all__ = [
+    "RootStore",
     "change_root_store",
     "listen",
+    "StepPool",
     "register_next_step",
     "unregister_steps",
+    "unregister_tag",
+    "unregister_where",
     "wait_for",
+    "set_metrics",
+    "stream",
     "clear",
+    "step_handler",
     "shortcuts",
 ]
 
 from .steps import (
     MetaStore as MetaStore,
+    RootStore as RootStore,
+    Step as Step,
+    step_handler as step_handler,
     change_root_store as change_root_store,
     listen as listen,
+    StepPool as StepPool,
     register_next_step as register_next_step,
     unregister_steps as unregister_steps,
+    unregister_tag as unregister_tag,
+    unregister_where as unregister_where,
     wait_for as wait_for,
+    set_metrics as set_metrics,
+    stream as stream,
     clear as clear
 )
 
 from . import (
     shortcuts as shortcuts,
     connection as connection,
+    stores as stores,
 )
 
 from ._install import install as install
@@ -10,8 +10,8 @@ async def _unregister_steps(_, id, store=None):
     await steps.unregister_steps(id, store)
 
 
-async def _wait_for(_, id, timeout=None, store=None):
-    return await steps.wait_for(id, timeout, store)
+async def _wait_for(_, id, timeout=None, store=None, **kwargs):
+    return await steps.wait_for(id, timeout, store, **kwargs)
 
 
 def install(register_next_step=True, unregister_steps=True, wait_for=True, listen=True):
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket; `acquire()` waits until a token is available.
+
+    `pause(seconds)` empties bucket and blocks all acquirers until pause is over, which
+    is what a FloodWait asks for.
+    """
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated", "_paused_until", "_lock")
+
+    def __init__(self, rate: float, burst: float = 0) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a token without waiting; returns False if there isn't one.
+        """
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+
+        return False
+
+    def delay(self) -> float:
+        """
+        Seconds until a token is available.
+        """
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now + 1 / self.rate
+
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # lock keeps waiters in order
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep(self.delay())
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._updated = self._paused_until
+        self._tokens = 0.0
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
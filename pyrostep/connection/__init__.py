@@ -4,3 +4,12 @@ from .connection import (
     session_max_retries,  # noqa
     session_start_timeout,  # noqa
 )
+from .scheduler import (
+    SendScheduler,  # noqa
+)
+from .telemetry import (
+    Backoff,  # noqa
+    ConnectionStats,  # noqa
+    instrument,  # noqa
+    uninstrument,  # noqa
+)
@@ -0,0 +1,331 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+import typing
+
+import cachebox
+from pyrogram.errors import FloodWait
+
+from .._ratelimit import TokenBucket
+
+log = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "attempts")
+
+    def __init__(self, fn: typing.Callable, args: tuple, kwargs: dict, future: asyncio.Future) -> None:
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class SendScheduler:
+    """
+    Queues outgoing API calls and sends them as fast as Telegram allows.
+
+    Calls are sent under a global token bucket and a per-chat one (private chats and
+    groups have their own rates); chats are served in turn, so one busy chat can't delay
+    others. Calls run concurrently, so a slow request doesn't hold the queue.
+
+    A `FloodWait` doesn't block the caller's task: the chat is paused for the asked time,
+    the call is queued again, and global rate is cut by `decrease` (once per second at
+    most). Every successful call raises it back by `increase / rate` (so about `increase`
+    per second), up to `rate`.
+
+    Pyrogram sleeps on FloodWaits shorter than client's `sleep_threshold` itself; create
+    client with `sleep_threshold=0` so the scheduler sees them.
+
+    Parameters:
+        rate (`float`, *optional*):
+            maximum calls per second, overall.
+
+        chat_rate (`float`, *optional*):
+            maximum calls per second to a private chat (positive id).
+
+        group_rate (`float`, *optional*):
+            maximum calls per second to a group or channel (negative id).
+
+        burst (`float`, *optional*):
+            how many calls may be sent at once after being idle; defaults to a tenth of
+            `rate`. Up to `rate + burst` calls may be sent in one second.
+
+        min_rate (`float`, *optional*):
+            global rate is never cut below this.
+
+        decrease (`float`, *optional*):
+            global rate is multiplied by this on FloodWait.
+
+        increase (`float`, *optional*):
+            global rate recovers by about this many calls per second, every second.
+
+        max_retries (`int`, *optional*):
+            how many times a call is queued again on FloodWait, before FloodWait is raised
+            to caller.
+
+        max_pending (`int`, *optional*):
+            if positive, `call()` waits while this many calls are queued or running.
+
+    Example::
+
+        app = Client(..., sleep_threshold=0)
+        scheduler = SendScheduler()
+
+        await scheduler.call(chat_id, app.send_message, chat_id, "Hello")
+
+        # on shutdown
+        await scheduler.close()
+    """
+
+    def __init__(
+        self,
+        rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        burst: float = 0,
+        min_rate: float = 1.0,
+        decrease: float = 0.5,
+        increase: float = 1.0,
+        max_retries: int = 5,
+        max_pending: int = 0,
+        max_chats: int = 100_000,
+    ) -> None:
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+
+        self.max_rate = rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.min_rate = min(min_rate, rate)
+        self.decrease = decrease
+        self.increase = increase
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+
+        self.sent = 0
+        self.flood_waits = 0
+
+        self._bucket = TokenBucket(rate, burst or max(1.0, rate / 10))
+        # idle chats' buckets are refilled anyway; least recently used can be forgotten
+        self._chats: cachebox.LRUCache = cachebox.LRUCache(max_chats)
+        self._queues: typing.Dict[int, typing.Deque[_Job]] = {}
+        self._ready: typing.List[typing.Tuple[float, int, int]] = []
+        self._counter = itertools.count()
+        self._last_decrease = 0.0
+
+        self._wakeup: typing.Optional[asyncio.Event] = None
+        self._runner: typing.Optional[asyncio.Task] = None
+        self._running: typing.Set[asyncio.Task] = set()
+        self._pending = 0
+        self._room: typing.Optional[asyncio.Semaphore] = None
+        self._idle: typing.Optional[asyncio.Event] = None
+
+    @property
+    def rate(self) -> float:
+        """
+        Current global rate.
+        """
+        return self._bucket.rate
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of calls which are queued or running.
+        """
+        return self._pending
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id, None)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate if chat_id > 0 else self.group_rate, 1)
+
+        return bucket
+
+    def _schedule(self, chat_id: int, at: float) -> None:
+        heapq.heappush(self._ready, (at, next(self._counter), chat_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _start(self) -> None:
+        if self._runner is None:
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            if self.max_pending > 0 and self._room is None:
+                self._room = asyncio.Semaphore(self.max_pending)
+
+            self._runner = asyncio.ensure_future(self._run())
+
+    async def call(self, chat_id: int, fn: typing.Callable[..., typing.Awaitable], *args, **kwargs) -> typing.Any:
+        """
+        Queues `fn(*args, **kwargs)` as a call to `chat_id` and returns its result.
+        """
+        return await (await self.submit(chat_id, fn, *args, **kwargs))
+
+    async def submit(self, chat_id: int, fn: typing.Callable[..., typing.Awaitable], *args, **kwargs) -> asyncio.Future:
+        """
+        Queues `fn(*args, **kwargs)` as a call to `chat_id`; returns a future of its result
+        without waiting for it (only waits for room if `max_pending` is set).
+        """
+        self._start()
+
+        if self._room is not None:
+            await self._room.acquire()
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(chat_id, _Job(fn, args, kwargs, future))
+        self._pending += 1
+        self._idle.clear()  # type: ignore[union-attr]
+        return future
+
+    def _enqueue(self, chat_id: int, job: _Job, front: bool = False, at: float = 0.0) -> None:
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = collections.deque()
+            self._schedule(chat_id, at or time.monotonic())
+
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+
+    async def _run(self) -> None:
+        ready = self._ready
+        wakeup = self._wakeup
+        assert wakeup is not None
+
+        while True:
+            if not ready:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+
+            at, _, chat_id = ready[0]
+            now = time.monotonic()
+            if at > now:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), at - now)
+                except asyncio.TimeoutError:
+                    pass
+
+                continue
+
+            heapq.heappop(ready)
+            queue = self._queues.get(chat_id)
+            if not queue:
+                self._queues.pop(chat_id, None)
+                continue
+
+            bucket = self._chat_bucket(chat_id)
+            if not bucket.try_acquire():
+                self._schedule(chat_id, now + bucket.delay())
+                continue
+
+            await self._bucket.acquire()
+
+            job = queue.popleft()
+            if queue:
+                self._schedule(chat_id, time.monotonic() + bucket.delay())
+            else:
+                del self._queues[chat_id]
+
+            if job.future.done():
+                # cancelled by caller
+                self._done()
+                continue
+
+            task = asyncio.ensure_future(self._execute(chat_id, job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, chat_id: int, job: _Job) -> None:
+        try:
+            result = await job.fn(*job.args, **job.kwargs)
+        except FloodWait as e:
+            self._on_flood_wait(chat_id, job, e)
+            return
+        except BaseException as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+
+            self._done()
+            return
+
+        if not job.future.done():
+            job.future.set_result(result)
+
+        self.sent += 1
+        bucket = self._bucket
+        if bucket.rate < self.max_rate:
+            bucket.rate = min(self.max_rate, bucket.rate + self.increase / bucket.rate)
+
+        self._done()
+
+    def _on_flood_wait(self, chat_id: int, job: _Job, e: FloodWait) -> None:
+        self.flood_waits += 1
+        seconds = float(e.value)  # type: ignore[arg-type]
+
+        now = time.monotonic()
+        if now - self._last_decrease >= 1:
+            self._last_decrease = now
+            bucket = self._bucket
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            log.warning("FloodWait of %.0fs on chat %d; rate is cut to %.2f/s", seconds, chat_id, bucket.rate)
+
+        self._chat_bucket(chat_id).pause(seconds)
+
+        job.attempts += 1
+        if job.attempts > self.max_retries:
+            if not job.future.done():
+                job.future.set_exception(e)
+
+            self._done()
+            return
+
+        self._enqueue(chat_id, job, front=True, at=now + seconds)
+
+    def _done(self) -> None:
+        self._pending -= 1
+
+        if self._room is not None:
+            self._room.release()
+
+        if not self._pending:
+            self._idle.set()  # type: ignore[union-attr]
+
+    async def join(self) -> None:
+        """
+        Waits until every queued call is done.
+        """
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def close(self) -> None:
+        """
+        Stops scheduler; queued calls are cancelled, running ones are waited for.
+        """
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+
+            self._runner = None
+
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+                self._done()
+
+        self._queues.clear()
+        self._ready.clear()
+
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
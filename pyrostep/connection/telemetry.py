@@ -0,0 +1,406 @@
+import pyrogram.connection.connection
+import pyrogram.session.session
+from pyrogram.errors import FloodWait, InternalServerError, ServiceUnavailable
+
+import asyncio
+import contextvars
+import logging
+import math
+import random
+import sys
+import threading
+import time
+import typing
+
+from ..metrics import DEFAULT_BUCKETS, Histogram, _number
+from .connection import connection_max_retries
+
+log = logging.getLogger(__name__)
+
+_connection_module = pyrogram.connection.connection
+_Connection = _connection_module.Connection
+_Session = pyrogram.session.session.Session
+
+
+class Backoff:
+    """
+    Adaptive, jittered exponential backoff.
+
+    Delay before a retry is between half and all of `min(cap, base * 2 ** n)`, chosen at
+    random so that many clients don't retry together; `n` is the larger of retry's
+    attempt number and `level`. `level` is shared by all connections and calls: it rises
+    by one on failure (once per delay at most, so a burst of concurrent failures counts
+    as one) and is halved on success. On a flaky network even first retries wait longer,
+    and on a healthy one they're quick again.
+
+    Parameters:
+        base (`float`, *optional*):
+            delay of first retry, in seconds, on a healthy network. Connection attempts
+            wait at least one second anyway, as pyrogram sleeps that long between them.
+
+        cap (`float`, *optional*):
+            maximum delay.
+
+        max_attempts (`int`, *optional*):
+            how many times connecting is tried before ConnectionError; None for forever.
+
+        jitter (`bool`, *optional*):
+            if False, delays are exactly the upper bound.
+    """
+
+    def __init__(
+        self, base: float = 0.5, cap: float = 30.0, max_attempts: typing.Optional[int] = 5, jitter: bool = True
+    ) -> None:
+        if base <= 0 or cap < base:
+            raise ValueError("base must be positive and cap must not be less than base")
+
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+        self.level = 0.0
+        self._max_level = math.log2(cap / base)
+        self._next_rise = 0.0
+
+    def _ceiling(self, n: float) -> float:
+        return min(self.cap, self.base * 2**n)
+
+    def delay(self, attempt: int = 0) -> float:
+        """
+        Returns delay of retry number `attempt` (counted from zero), in seconds.
+        """
+        ceiling = self._ceiling(max(self.level, attempt))
+        return random.uniform(ceiling / 2, ceiling) if self.jitter else ceiling
+
+    def failure(self) -> None:
+        now = time.monotonic()
+        if now < self._next_rise:
+            return
+
+        self.level = min(self.level + 1, self._max_level)
+        self._next_rise = now + self._ceiling(self.level) / 2
+
+    def success(self) -> None:
+        self.level /= 2
+
+
+class ConnectionStats:
+    """
+    Counters and latency histograms of pyrogram connections and API calls; filled in
+    after `instrument()`.
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS, prefix: str = "pyrostep_connection") -> None:
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+        self.connects = 0
+        self.connect_failures = 0
+        self.reconnects = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.errors = 0
+        self.retry_wait_seconds = 0.0
+        self.flood_wait_seconds = 0.0
+
+        self.connect_seconds = Histogram(buckets)
+        self.invoke_seconds = Histogram(buckets)
+        self.restart_seconds = Histogram(buckets)
+
+    @property
+    def wait_seconds(self) -> float:
+        """
+        Time spent sleeping before retries and on FloodWaits.
+        """
+        return self.retry_wait_seconds + self.flood_wait_seconds
+
+    def prometheus(self) -> str:
+        """
+        Returns stats in Prometheus text exposition format.
+        """
+        p = self.prefix
+        lines: typing.List[str] = []
+
+        def metric(name: str, kind: str, help: str, samples: typing.Iterable[typing.Tuple[str, float]]) -> None:
+            lines.append("# HELP %s_%s %s" % (p, name, help))
+            lines.append("# TYPE %s_%s %s" % (p, name, kind))
+            for suffix, value in samples:
+                lines.append("%s_%s%s %s" % (p, name, suffix, _number(value)))
+
+        def histogram(h: Histogram) -> typing.List[typing.Tuple[str, float]]:
+            samples = []
+            total = 0
+            for bound, n in zip(h.bounds + (float("inf"),), h.counts):
+                total += n
+                samples.append(('_bucket{le="%s"}' % _number(bound), total))
+
+            samples.append(("_sum", h.sum))
+            samples.append(("_count", h.count))
+            return samples
+
+        with self._lock:
+            metric(
+                "connects_total",
+                "counter",
+                "Connection attempts by result.",
+                [('{result="ok"}', self.connects), ('{result="failed"}', self.connect_failures)],
+            )
+            metric("reconnects_total", "counter", "Session restarts.", [("", self.reconnects)])
+            metric("retries_total", "counter", "API calls retried after a network or server error.", [("", self.retries)])
+            metric("flood_waits_total", "counter", "FloodWaits received.", [("", self.flood_waits)])
+            metric("errors_total", "counter", "API calls which raised after retries.", [("", self.errors)])
+            metric(
+                "wait_seconds_total",
+                "counter",
+                "Time slept before retries and on FloodWaits.",
+                [('{reason="retry"}', self.retry_wait_seconds), ('{reason="flood_wait"}', self.flood_wait_seconds)],
+            )
+            metric("connect_seconds", "histogram", "Time to open a connection.", histogram(self.connect_seconds))
+            metric(
+                "invoke_seconds", "histogram", "API call latency, with retries and waits.", histogram(self.invoke_seconds)
+            )
+            metric("restart_seconds", "histogram", "Time to restart a session.", histogram(self.restart_seconds))
+
+        return "\n".join(lines) + "\n"
+
+
+_stats: typing.Optional[ConnectionStats] = None
+_backoff: typing.Optional[Backoff] = None
+_transport: typing.Callable[[bool, typing.Any], typing.Any] = _connection_module.TCPAbridged
+_originals: typing.Dict[str, typing.Any] = {}
+
+# failed attempts of the `Connection.connect` call running in this context
+_attempts: "contextvars.ContextVar[typing.List[int]]" = contextvars.ContextVar("pyrostep_connect_attempts")
+
+# errors which pyrogram retries an API call on
+_RETRIABLE = (OSError, InternalServerError, ServiceUnavailable)
+
+
+class _Protocol:
+    """
+    Wraps the connection protocol which pyrogram creates for each connection attempt;
+    records the attempt, and waits by backoff before a retry.
+    """
+
+    def __init__(self, ipv6: bool, proxy: typing.Any) -> None:
+        self._protocol = _transport(ipv6, proxy)
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self._protocol, name)
+
+    async def connect(self, address: typing.Any) -> None:
+        attempts = _attempts.get(None)
+        stats = _stats
+
+        if attempts and _backoff is not None:
+            # pyrogram has slept one second already
+            extra = _backoff.delay(attempts[0] - 1) - 1.0
+            if extra > 0:
+                if stats is not None:
+                    stats.retry_wait_seconds += extra
+
+                await asyncio.sleep(extra)
+
+        start = time.perf_counter()
+        try:
+            await self._protocol.connect(address)
+        except OSError:
+            if attempts is not None:
+                attempts[0] += 1
+
+            if stats is not None:
+                stats.connect_failures += 1
+                stats.retry_wait_seconds += 1.0
+
+            if _backoff is not None:
+                _backoff.failure()
+
+            raise
+
+        if stats is not None:
+            stats.connects += 1
+            stats.connect_seconds.observe(time.perf_counter() - start)
+
+        if _backoff is not None:
+            _backoff.success()
+
+
+async def _connect(self) -> None:
+    """
+    `Connection.connect`, with its attempts counted by `_Protocol`.
+    """
+    token = _attempts.set([0])
+    try:
+        await _originals["connect"](self)
+    finally:
+        _attempts.reset(token)
+
+
+async def _send(self, data: typing.Any, *args, **kwargs) -> typing.Any:
+    """
+    `Session.send`, counting FloodWaits.
+    """
+    try:
+        return await _originals["send"](self, data, *args, **kwargs)
+    except FloodWait as e:
+        if _stats is not None:
+            _stats.flood_waits += 1
+            _stats.flood_wait_seconds += e.value  # type: ignore[operator]
+
+        raise
+
+
+async def _invoke(
+    self,
+    query: typing.Any,
+    retries: typing.Optional[int] = None,
+    timeout: typing.Optional[float] = None,
+    sleep_threshold: typing.Optional[float] = None,
+) -> typing.Any:
+    """
+    `Session.invoke`, with stats; pyrogram's invoke is called without retries, and
+    retries are made here, waiting by backoff.
+    """
+    if retries is None:
+        retries = _Session.MAX_RETRIES
+
+    options: typing.Dict[str, typing.Any] = {}
+    if timeout is not None:
+        options["timeout"] = timeout
+
+    if sleep_threshold is not None:
+        options["sleep_threshold"] = sleep_threshold
+
+    invoke = _originals["invoke"]
+    stats = _stats
+    start = time.perf_counter()
+    attempt = 0
+
+    while True:
+        try:
+            result = await invoke(self, query, 0, **options)
+        except FloodWait as e:
+            # too long to sleep; pyrogram raised it instead
+            if stats is not None:
+                stats.errors += 1
+                stats.flood_wait_seconds -= e.value  # type: ignore[operator]
+
+            raise
+        except _RETRIABLE as e:
+            if attempt >= retries:
+                if stats is not None:
+                    stats.errors += 1
+
+                raise
+
+            attempt += 1
+            (log.warning if retries - attempt < 2 else log.info)(
+                '[%s] Retrying "%s" due to: %s', attempt, type(query).__name__, str(e) or repr(e)
+            )
+
+            if _backoff is None:
+                delay = 0.5
+            else:
+                delay = _backoff.delay(attempt - 1)
+                _backoff.failure()
+
+            if stats is not None:
+                stats.retries += 1
+                stats.retry_wait_seconds += delay
+
+            await asyncio.sleep(delay)
+        else:
+            if stats is not None:
+                stats.invoke_seconds.observe(time.perf_counter() - start)
+
+            if attempt and _backoff is not None:
+                _backoff.success()
+
+            return result
+
+
+async def _restart(self) -> None:
+    """
+    `Session.restart`, with stats.
+    """
+    start = time.perf_counter()
+    await _originals["restart"](self)
+
+    if _stats is not None:
+        _stats.reconnects += 1
+        _stats.restart_seconds.observe(time.perf_counter() - start)
+
+
+def instrument(
+    stats: typing.Optional[ConnectionStats] = None,
+    backoff: typing.Optional[Backoff] = None,
+    transport: typing.Optional[typing.Callable[[bool, typing.Any], typing.Any]] = None,
+) -> ConnectionStats:
+    """
+    Wraps pyrogram's `Connection.connect`, `Session.send`, `Session.invoke` and
+    `Session.restart` to record stats. pyrogram's own methods do the work, so they keep
+    working as pyrogram changes.
+
+    With `backoff`, API call retries wait by it instead of half a second, and connection
+    attempts wait by it (but at least pyrogram's one second) and are tried
+    `backoff.max_attempts` times before pyrogram's session starts over.
+
+    `transport` is called as `transport(ipv6, proxy)` to create connection protocol
+    (TCPAbridged by default); give a fake one to test behaviour on a flaky network.
+
+    Call it before starting clients. Returns stats. `uninstrument()` restores pyrogram's
+    methods.
+
+    Example::
+
+        from pyrostep import connection
+
+        stats = connection.instrument(backoff=connection.Backoff(base=0.5, cap=30, max_attempts=None))
+
+        # ...
+        print(stats.reconnects, stats.retries, stats.invoke_seconds.quantile(0.99))
+    """
+    global _stats, _backoff, _transport
+
+    if not _originals:
+        _originals["connect"] = _Connection.connect
+        _originals["send"] = _Session.send
+        _originals["invoke"] = _Session.invoke
+        _originals["restart"] = _Session.restart
+        _originals["transport"] = _connection_module.TCPAbridged
+        _originals["attempts"] = connection_max_retries()
+
+    _stats = stats if stats is not None else ConnectionStats()
+    _backoff = backoff
+    _transport = transport or _originals["transport"]
+
+    if backoff is not None:
+        connection_max_retries(backoff.max_attempts or sys.maxsize)
+    else:
+        connection_max_retries(_originals["attempts"])
+
+    # pyrogram creates the protocol by this module-level name
+    _connection_module.TCPAbridged = _Protocol  # type: ignore[misc,assignment]
+    _Connection.connect = _connect  # type: ignore[assignment]
+    _Session.send = _send  # type: ignore[assignment]
+    _Session.invoke = _invoke  # type: ignore[assignment]
+    _Session.restart = _restart  # type: ignore[assignment]
+    return _stats
+
+
+def uninstrument() -> None:
+    """
+    Restores pyrogram's original methods.
+    """
+    global _stats, _backoff, _transport
+
+    if _originals:
+        _Connection.connect = _originals.pop("connect")
+        _Session.send = _originals.pop("send")
+        _Session.invoke = _originals.pop("invoke")
+        _Session.restart = _originals.pop("restart")
+        _connection_module.TCPAbridged = _transport = _originals.pop("transport")
+        connection_max_retries(_originals.pop("attempts"))
+
+    _stats = None
+    _backoff = None
@@ -0,0 +1,228 @@
+import typing
+
+from pyrogram.client import Client as _Client
+from pyrogram import ContinuePropagation
+from pyrogram.handlers.message_handler import MessageHandler
+
+from .steps import _check, _handler_types, _update_types
+
+END = None
+"""
+Returned by a transition handler (or used as `to`) to finish the conversation.
+"""
+
+_RESULT = object()
+
+_Handler = typing.Callable[[_Client, typing.Any, typing.Any], typing.Awaitable[typing.Any]]
+
+
+class Machine:
+    """
+    Declarative conversation engine.
+
+    Declare states and their transitions; a transition is chosen by update type and
+    filters, and its handler returns name of next state (or `END`). Per conversation, only
+    a (state id, context) pair is kept, and transitions are compiled into a table indexed
+    by state id and update type on first dispatch.
+
+    Example::
+
+        signin = Machine()
+
+        @signin.on("username")
+        async def username(client, message, ctx):
+            ctx["username"] = message.text
+            await message.reply("And password?")
+            return "password"
+
+        @signin.on("password", filters=filters.text)
+        async def password(client, message, ctx):
+            await message.reply("Signed in as %s" % ctx["username"])
+            return END
+
+        signin.listen(app)
+
+        @app.on_message(filters.command("signin"))
+        async def start(_, message):
+            await message.reply("Username?")
+            signin.start(message.from_user.id, "username", {})
+    """
+
+    def __init__(self) -> None:
+        self._names: typing.Dict[str, int] = {}
+        self._transitions: typing.List[typing.Tuple[int, tuple, typing.Any, _Handler, typing.Any]] = []
+        self._table: typing.Optional[typing.List[typing.Dict[typing.Optional[type], tuple]]] = None
+        self._conversations: typing.Dict[int, typing.Tuple[int, typing.Any]] = {}
+        # conversations whose transition is running
+        self._busy: typing.Set[int] = set()
+
+    def state(self, name: str) -> int:
+        """
+        Declares a state (if not declared) and returns its id.
+        """
+        try:
+            return self._names[name]
+        except KeyError:
+            self._names[name] = len(self._names)
+            self._table = None
+            return self._names[name]
+
+    def on(
+        self,
+        state: str,
+        update_type: typing.Union[type, typing.Tuple[type, ...], None] = None,
+        filters: typing.Any = None,
+        to: typing.Any = _RESULT,
+    ) -> typing.Callable[[_Handler], _Handler]:
+        """
+        Declares a transition from `state`; decorates its handler.
+
+        Handler is called as `handler(client, update, context)` for updates of `update_type`
+        (a type or tuple of types, None for all) which pass `filters`. It returns name of
+        next state, or `END`; if `to` is given, it is used instead and handler's return
+        value is ignored. Transitions of a state are tried in order of declaration.
+
+        While a transition runs, other updates of that conversation aren't dispatched
+        (they propagate to next handlers), like a popped step. If handler returns a state
+        which isn't declared, conversation is ended and ValueError is raised.
+        """
+        update_types = _update_types(update_type)
+
+        def decorator(fn: _Handler) -> _Handler:
+            target = to if to is _RESULT or to is END else self.state(to)
+            self._transitions.append((self.state(state), update_types, filters, fn, target))
+            self._table = None
+            return fn
+
+        return decorator
+
+    def compile(self) -> None:
+        """
+        Builds dispatch table; called on first dispatch after declarations change.
+        """
+        table: typing.List[typing.Dict[typing.Optional[type], list]] = [{} for _ in self._names]
+
+        for state, update_types, *_ in self._transitions:
+            for t in update_types:
+                table[state].setdefault(t, [])
+
+        # transitions for all types are listed under every type too, in order of declaration
+        for state, update_types, filters, fn, target in self._transitions:
+            for t, lst in table[state].items():
+                if None in update_types or t in update_types:
+                    lst.append((filters, fn, target))
+
+        self._table = [{t: tuple(lst) for t, lst in slots.items()} for slots in table]
+
+    def start(self, key: int, state: str, context: typing.Any = None) -> None:
+        """
+        Starts (or restarts) conversation with user/chat `key` in `state`.
+        """
+        self._conversations[key] = (self._names[state], context)
+
+    def stop(self, key: int) -> typing.Any:
+        """
+        Finishes conversation with `key`; returns its context (None if there wasn't one).
+        """
+        pair = self._conversations.pop(key, None)
+        return None if pair is None else pair[1]
+
+    def current(self, key: int) -> typing.Optional[typing.Tuple[str, typing.Any]]:
+        """
+        Returns (state name, context) of conversation with `key`, or None.
+        """
+        pair = self._conversations.get(key)
+        if pair is None:
+            return None
+
+        for name, id in self._names.items():
+            if id == pair[0]:
+                return name, pair[1]
+
+        return None
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    async def dispatch(self, client: _Client, update: typing.Any) -> bool:
+        """
+        Runs transition for update; returns False if there's no conversation or no
+        transition matched.
+        """
+        conversations = self._conversations
+
+        key = None
+        user = getattr(update, "from_user", None)
+        if user is not None and user.id in conversations:
+            key = user.id
+        else:
+            chat = getattr(update, "chat", None)
+            if chat is not None and chat.id in conversations:
+                key = chat.id
+
+        if key is None or key in self._busy:
+            return False
+
+        if self._table is None:
+            self.compile()
+
+        self._busy.add(key)
+        try:
+            return await self._dispatch(client, update, key)
+        finally:
+            self._busy.discard(key)
+
+    async def _dispatch(self, client: _Client, update: typing.Any, key: int) -> bool:
+        conversations = self._conversations
+        state, context = conversations[key]
+        slots = self._table[state]  # type: ignore[index]
+
+        transitions = slots.get(type(update))
+        if transitions is None:
+            transitions = slots.get(None, ())
+
+        for filters, fn, target in transitions:
+            if filters is not None and not await _check(filters, client, update):
+                continue
+
+            result = await fn(client, update, context)
+            if target is _RESULT:
+                target = END if result is END else self._names.get(result, _RESULT)
+
+            if target is _RESULT:
+                # a state which isn't declared; don't leave conversation stuck in this one
+                if conversations.get(key, (None,))[0] == state:
+                    del conversations[key]
+
+                raise ValueError("transition handler %r returned undeclared state %r" % (fn, result))
+
+            if target is END:
+                if conversations.get(key, (None,))[0] == state:
+                    del conversations[key]
+            elif conversations.get(key, (None,))[0] == state:
+                # handler may have started another conversation itself
+                conversations[key] = (target, context)
+
+            return True
+
+        return False
+
+    def listen(
+        self,
+        app: _Client,
+        handler: typing.Any = MessageHandler,
+        filters: typing.Any = None,
+        group: int = 0,
+    ) -> None:
+        """
+        Adds a handler to client which dispatches updates of running conversations.
+
+        `handler` may be a handler type or an iterable of them.
+        """
+
+        async def _machine_wrapper(_c, _u):
+            if not await self.dispatch(_c, _u):
+                raise ContinuePropagation
+
+        for h in _handler_types(handler):
+            app.add_handler(h(_machine_wrapper, filters), group=group)
@@ -0,0 +1,175 @@
+import bisect
+import threading
+import typing
+
+from .steps import MetricsHook
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+"""
+Default histogram buckets in seconds.
+"""
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed upper bounds, like Prometheus histograms.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: typing.Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns upper bound of the bucket which contains `q` quantile (inf if it's in the last one).
+        """
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        total = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            total += n
+            if total >= rank:
+                return bound
+
+        return float("inf")
+
+
+class Collector(MetricsHook):
+    """
+    In-process metrics collector; keeps counters and latency histograms of step dispatching.
+
+    Example::
+
+        from pyrostep.metrics import Collector
+
+        collector = Collector()
+        pyrostep.set_metrics(collector)
+
+        # ...
+        print(collector.prometheus())
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS, prefix: str = "pyrostep") -> None:
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        self.waiting = 0
+        self.handler_errors = 0
+        self.waits: typing.Dict[str, int] = {"resolved": 0, "timeout": 0, "cancelled": 0}
+        self.max_stream_depth = 0
+
+        self.handler_seconds = Histogram(buckets)
+        self.wait_seconds = Histogram(buckets)
+        self.stream_depth = Histogram((1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+    def on_update(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def on_pending(self, delta: int) -> None:
+        self.pending += delta
+
+    def on_handler(self, seconds: float, error: bool) -> None:
+        with self._lock:
+            self.handler_seconds.observe(seconds)
+            self.handler_errors += error
+
+    def on_wait_start(self) -> None:
+        self.waiting += 1
+
+    def on_wait(self, seconds: float, outcome: str) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.waits[outcome] += 1
+            self.wait_seconds.observe(seconds)
+
+    def on_stream_put(self, depth: int) -> None:
+        with self._lock:
+            self.stream_depth.observe(depth)
+            if depth > self.max_stream_depth:
+                self.max_stream_depth = depth
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def timeout_ratio(self) -> float:
+        total = sum(self.waits.values())
+        return self.waits["timeout"] / total if total else 0.0
+
+    def prometheus(self) -> str:
+        """
+        Returns metrics in Prometheus text exposition format.
+        """
+        p = self.prefix
+        lines: typing.List[str] = []
+
+        def metric(name: str, kind: str, help: str, samples: typing.Iterable[typing.Tuple[str, float]]) -> None:
+            lines.append("# HELP %s_%s %s" % (p, name, help))
+            lines.append("# TYPE %s_%s %s" % (p, name, kind))
+            for suffix, value in samples:
+                lines.append("%s_%s%s %s" % (p, name, suffix, _number(value)))
+
+        def histogram(h: Histogram, labels: str = "") -> typing.List[typing.Tuple[str, float]]:
+            samples = []
+            total = 0
+            for bound, n in zip(h.bounds + (float("inf"),), h.counts):
+                total += n
+                samples.append(('_bucket{%sle="%s"}' % (labels, _number(bound)), total))
+
+            samples.append(("_sum", h.sum))
+            samples.append(("_count", h.count))
+            return samples
+
+        with self._lock:
+            metric(
+                "updates_total",
+                "counter",
+                "Updates which reached listener, by whether a step or waiter took them.",
+                [('{result="hit"}', self.hits), ('{result="miss"}', self.misses)],
+            )
+            metric("pending_steps", "gauge", "Steps registered by register_next_step.", [("", self.pending)])
+            metric("waiters", "gauge", "wait_for calls which are waiting.", [("", self.waiting)])
+            metric(
+                "waits_total",
+                "counter",
+                "Finished wait_for calls by outcome.",
+                [('{outcome="%s"}' % k, v) for k, v in self.waits.items()],
+            )
+            metric(
+                "wait_seconds", "histogram", "Time from wait_for call to its end.", histogram(self.wait_seconds)
+            )
+            metric(
+                "handler_seconds", "histogram", "Run time of step handlers.", histogram(self.handler_seconds)
+            )
+            metric("handler_errors_total", "counter", "Step handlers which raised.", [("", self.handler_errors)])
+            metric(
+                "stream_depth", "histogram", "Stream buffer size after each update.", histogram(self.stream_depth)
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(value) if isinstance(value, float) else str(value)
@@ -6,9 +6,33 @@ from pyrogram.types import (
 )
 from pyrogram.client import Client
 from pyrogram.enums import ChatMemberStatus
-from pyrogram.errors import UserNotParticipant
+from pyrogram.errors import (
+    UserNotParticipant,
+    FloodWait,
+    MessageNotModified,
+    UserIsBlocked,
+    UserIsBot,
+    InputUserDeactivated,
+    UserDeactivated,
+    UserDeactivatedBan,
+    PeerIdInvalid,
+    ChatWriteForbidden,
+    ChannelPrivate,
+    RPCError,
+)
+from pyrogram.handlers import ChatMemberUpdatedHandler, CallbackQueryHandler
+from pyrogram import ContinuePropagation, filters
 
+import asyncio
+import collections.abc
+import inspect
+import os
+import struct
+import time
 import typing
+import cachebox
+
+from ._ratelimit import TokenBucket
 
 
 def split_list(lst: list, rows: int) -> list:
@@ -110,18 +134,862 @@ def inline_button(text: str, value=None, _type: str = "callback_data") -> Inline
     return InlineKeyboardButton(text) if value is None else InlineKeyboardButton(text, **{_type: value})
 
 
+class Slot(typing.NamedTuple):
+    """
+    Placeholder of a keyboard template; filled by keyword `name` when template is called.
+
+    If `fmt` is given, value is formatted with it (`fmt.format(value)`), otherwise used as is.
+    """
+
+    name: str
+    fmt: typing.Optional[str] = None
+
+
+class KeyboardTemplate:
+    """
+    Prebuilt keyboard markup.
+
+    Buttons are built once; calling template returns markup. Template without slots returns
+    the same markup object every time, so don't change it. With slots, only buttons which
+    have slots and their rows are created again.
+
+    Example::
+
+        menu = KeyboardTemplate(
+            [
+                [["Buy", Slot("item", "buy:{}")], ["Help", "help"]],
+            ],
+            inline=True,
+        )
+        await message.reply("Menu", reply_markup=menu(item=item_id))
+    """
+
+    __slots__ = ("names", "inline", "_rows", "_slots", "_slot_rows", "_kwargs", "_markup")
+
+    def __init__(self, lst: typing.List[typing.List[typing.List[typing.Any]]], inline: bool = False, **kwargs) -> None:
+        make = inline_button if inline else button
+
+        rows = []
+        slots = []
+        for r, line in enumerate(lst):
+            row = []
+            for c, kb in enumerate(line):
+                if any(isinstance(v, Slot) for v in kb):
+                    slots.append((r, c, tuple(kb)))
+                    row.append(None)
+                else:
+                    row.append(make(*kb))
+
+            rows.append(row)
+
+        self.inline = inline
+        self.names = frozenset(v.name for *_, kb in slots for v in kb if isinstance(v, Slot))
+        self._rows = rows
+        self._slots = tuple(slots)
+        self._slot_rows = tuple(sorted({r for r, *_ in slots}))
+        self._kwargs = kwargs
+        self._markup = None if slots else self._build(rows)
+
+    def _build(self, rows: list) -> typing.Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]:
+        if self.inline:
+            return InlineKeyboardMarkup(rows)
+
+        return ReplyKeyboardMarkup(rows, **self._kwargs)
+
+    def __call__(self, **values) -> typing.Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]:
+        if self._markup is not None:
+            return self._markup
+
+        make = inline_button if self.inline else button
+
+        rows = self._rows.copy()
+        for r in self._slot_rows:
+            rows[r] = rows[r].copy()
+
+        for r, c, kb in self._slots:
+            rows[r][c] = make(
+                *(
+                    (values[v.name] if v.fmt is None else v.fmt.format(values[v.name])) if isinstance(v, Slot) else v
+                    for v in kb
+                )
+            )
+
+        return self._build(rows)
+
+
+_templates = cachebox.LRUCache(256)
+
+
+def _template(lst: list, inline: bool, kwargs: dict) -> KeyboardTemplate:
+    try:
+        key = (inline, tuple(tuple(tuple(kb) for kb in line) for line in lst), tuple(sorted(kwargs.items())))
+        hash(key)
+    except TypeError:
+        return KeyboardTemplate(lst, inline, **kwargs)
+
+    template = _templates.get(key, None)
+    if template is None:
+        template = _templates[key] = KeyboardTemplate(lst, inline, **kwargs)
+
+    return template
+
+
+def keyboard_template(lst: typing.List[typing.List[typing.List[typing.Any]]], **kwargs) -> KeyboardTemplate:
+    """
+    keyboard_template returns KeyboardTemplate of a ReplyKeyboardMarkup; same as `keyboard`,
+    but values may be `Slot`s. Templates are cached by structure, so calling it again with an
+    equal list doesn't build buttons again.
+
+    Example::
+
+        menu = keyboard_template([[["Profile"], ["Settings"]], [["Share contact", True, "request_contact"]]])
+        await message.reply("Menu", reply_markup=menu())
+    """
+    return _template(lst, False, kwargs)
+
+
+def inlinekeyboard_template(lst: typing.List[typing.List[typing.List[typing.Any]]]) -> KeyboardTemplate:
+    """
+    inlinekeyboard_template returns KeyboardTemplate of an InlineKeyboardMarkup; same as
+    `inlinekeyboard`, but values may be `Slot`s. Templates are cached by structure.
+
+    Example::
+
+        like = inlinekeyboard_template([[["Like", Slot("post", "like:{}")], ["Next", "next"]]])
+        await message.reply(text, reply_markup=like(post=post_id))
+    """
+    return _template(lst, True, {})
+
+
+class Paginator:
+    """
+    Inline keyboard of one page of a catalog, with navigation buttons.
+
+    Only items of requested page are fetched and rendered (one more item is fetched to know
+    whether there's a next page), and page number is kept in callback data of navigation
+    buttons as `"<name>:<page>"`.
+
+    Parameters:
+        name (`str`):
+            unique name; prefix of navigation callback data.
+
+        source (`Sequence | Iterable | AsyncIterable | (offset, limit) -> list`):
+            items. A sequence is sliced; a callable is called with (offset, limit) and may be
+            async (e.g. a database query). Iterators can't seek, so their items are kept
+            in memory as far as requested pages need.
+
+        per_page (`int`, `optional`):
+            number of items of each page.
+
+        columns (`int`, `optional`):
+            number of item buttons in each row.
+
+        render (`(item) -> list`, `optional`):
+            returns `inline_button` arguments of an item, e.g. `[title, "item:%d" % id]`.
+            By default, `[str(item), str(item)]`.
+
+    Example::
+
+        products = Paginator("products", fetch_products, render=lambda p: [p.title, "product:%d" % p.id])
+        products.listen(app)
+
+        @app.on_message(filters.command("catalog"))
+        async def catalog(_, message):
+            await message.reply("Catalog", reply_markup=await products.markup())
+    """
+
+    def __init__(
+        self,
+        name: str,
+        source: typing.Any,
+        per_page: int = 10,
+        columns: int = 1,
+        render: typing.Optional[typing.Callable[[typing.Any], list]] = None,
+        prev_text: str = "«",
+        next_text: str = "»",
+    ) -> None:
+        if ":" in name:
+            raise ValueError("name cannot contain ':'")
+
+        if per_page < 1:
+            raise ValueError("per_page must be at least 1")
+
+        self.name = name
+        self.source = source
+        self.per_page = per_page
+        self.columns = columns
+        self.render = render or (lambda item: [str(item), str(item)])
+        self.prev_text = prev_text
+        self.next_text = next_text
+
+        self._prefix = name + ":"
+        self._buffer: list = []
+        self._iterator: typing.Any = None
+        self._lock: typing.Optional[asyncio.Lock] = None
+
+        if not isinstance(source, collections.abc.Sequence) and not callable(source):
+            if hasattr(source, "__aiter__"):
+                self._iterator = source.__aiter__()
+            else:
+                self._iterator = iter(source)
+
+    async def _fill(self, count: int) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            buffer = self._buffer
+            iterator = self._iterator
+
+            while iterator is not None and len(buffer) < count:
+                try:
+                    if hasattr(iterator, "__anext__"):
+                        buffer.append(await iterator.__anext__())
+                    else:
+                        buffer.append(next(iterator))
+                except (StopIteration, StopAsyncIteration):
+                    self._iterator = iterator = None
+
+    async def page(self, page: int) -> typing.Tuple[list, bool]:
+        """
+        Returns (items of page, whether there's a next page).
+        """
+        offset = page * self.per_page
+        limit = self.per_page + 1
+        source = self.source
+
+        if isinstance(source, collections.abc.Sequence):
+            items = source[offset : offset + limit]
+        elif callable(source):
+            items = source(offset, limit)
+            if inspect.isawaitable(items):
+                items = await items
+        else:
+            if self._iterator is not None and len(self._buffer) < offset + limit:
+                await self._fill(offset + limit)
+
+            items = self._buffer[offset : offset + limit]
+
+        items = list(items)
+        return items[: self.per_page], len(items) > self.per_page
+
+    def data(self, page: int) -> str:
+        """
+        Returns callback data of `page`.
+        """
+        return self._prefix + str(page)
+
+    def parse(self, data: typing.Union[str, bytes, None]) -> typing.Optional[int]:
+        """
+        Returns page number of callback data, or None if it's not of this paginator.
+        """
+        if isinstance(data, bytes):
+            try:
+                data = data.decode()
+            except UnicodeDecodeError:
+                return None
+
+        if not data or not data.startswith(self._prefix):
+            return None
+
+        try:
+            return max(0, int(data[len(self._prefix) :]))
+        except ValueError:
+            return None
+
+    async def markup(self, page: int = 0) -> InlineKeyboardMarkup:
+        """
+        Returns keyboard of `page`.
+        """
+        page = max(0, page)
+        items, has_next = await self.page(page)
+
+        render = self.render
+        rows = split_list([inline_button(*render(item)) for item in items], self.columns)
+
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton(self.prev_text, callback_data=self.data(page - 1)))
+
+        if page > 0 or has_next:
+            if isinstance(self.source, collections.abc.Sequence):
+                text = "%d/%d" % (page + 1, max(1, -(-len(self.source) // self.per_page)))
+            else:
+                text = str(page + 1)
+
+            nav.append(InlineKeyboardButton(text, callback_data=self.data(page)))
+
+        if has_next:
+            nav.append(InlineKeyboardButton(self.next_text, callback_data=self.data(page + 1)))
+
+        if nav:
+            rows.append(nav)
+
+        return InlineKeyboardMarkup(rows)
+
+    @property
+    def filter(self) -> filters.Filter:
+        """
+        Filter of callback queries of this paginator's navigation buttons.
+        """
+
+        async def func(_, __, query):
+            return self.parse(query.data) is not None
+
+        return filters.create(func)
+
+    def listen(self, app: Client, group: int = 0) -> None:
+        """
+        Adds a callback query handler to client which turns pages.
+        """
+
+        async def _paginator_wrapper(_c, query):
+            try:
+                await query.edit_message_reply_markup(await self.markup(self.parse(query.data)))
+            except MessageNotModified:
+                pass
+
+            await query.answer()
+
+        app.add_handler(CallbackQueryHandler(_paginator_wrapper, self.filter), group=group)
+
+
+CALLBACK_DATA_LIMIT = 64
+"""
+Maximum size of callback data, in bytes.
+"""
+
+
+def _pack_varint(buffer: bytearray, value: int) -> None:
+    if not -(1 << 63) <= value < (1 << 63):
+        raise ValueError("int fields must fit in 64 bits")
+
+    value = (value << 1) ^ (value >> 63)
+
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    buffer.append(value)
+
+
+def _unpack_varint(data: bytes, offset: int) -> typing.Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), offset
+
+        shift += 7
+
+
+def _pack_bytes(buffer: bytearray, value: bytes) -> None:
+    _pack_varint(buffer, len(value))
+    buffer += value
+
+
+def _unpack_bytes(data: bytes, offset: int) -> typing.Tuple[bytes, int]:
+    size, offset = _unpack_varint(data, offset)
+    end = offset + size
+    if end > len(data):
+        raise IndexError("truncated callback data")
+
+    return data[offset:end], end
+
+
+def _pack_str(buffer: bytearray, value: str) -> None:
+    _pack_bytes(buffer, value.encode())
+
+
+def _unpack_str(data: bytes, offset: int) -> typing.Tuple[str, int]:
+    value, offset = _unpack_bytes(data, offset)
+    return value.decode(), offset
+
+
+def _pack_bool(buffer: bytearray, value: bool) -> None:
+    buffer.append(1 if value else 0)
+
+
+def _unpack_bool(data: bytes, offset: int) -> typing.Tuple[bool, int]:
+    return data[offset] != 0, offset + 1
+
+
+def _pack_float(buffer: bytearray, value: float) -> None:
+    buffer += struct.pack("<d", value)
+
+
+def _unpack_float(data: bytes, offset: int) -> typing.Tuple[float, int]:
+    if offset + 8 > len(data):
+        raise IndexError("truncated callback data")
+
+    return struct.unpack_from("<d", data, offset)[0], offset + 8
+
+
+_CODECS = {
+    int: (_pack_varint, _unpack_varint),
+    str: (_pack_str, _unpack_str),
+    bytes: (_pack_bytes, _unpack_bytes),
+    bool: (_pack_bool, _unpack_bool),
+    float: (_pack_float, _unpack_float),
+}
+
+# values accepted by each field type; bool is an int subclass, but it's not accepted as one
+_ACCEPTS = {
+    int: int,
+    str: str,
+    bytes: (bytes, bytearray),
+    bool: bool,
+    float: (int, float),
+}
+
+
+def _raw(data: typing.Union[str, bytes]) -> bytes:
+    # pyrogram decodes callback data to str when it's valid utf-8
+    return data.encode() if isinstance(data, str) else data
+
+
+class CallbackData:
+    """
+    Typed schema of callback data, packed into a compact binary format.
+
+    Packed data is `prefix`, a zero byte, `version` byte, and then fields in order of
+    declaration: ints as zigzag varints, str/bytes with a varint length, bools as one
+    byte, floats as 8 bytes. Packing raises ValueError if result is bigger than 64 bytes.
+
+    Supported field types are int, str, bytes, bool and float.
+
+    Example::
+
+        Buy = CallbackData("buy", item=int, qty=int)
+
+        button = Buy.button("Buy one", item=1280, qty=1)  # callback data is b"buy\x00\x00\x80\x14\x02"
+
+        @app.on_callback_query(Buy.filter)
+        async def buy(_, query):
+            data = Buy.unpack(query.data)
+            print(data.item, data.qty)
+    """
+
+    def __init__(self, prefix: str, version: int = 0, **fields: type) -> None:
+        if "\x00" in prefix:
+            raise ValueError("prefix cannot contain zero byte")
+
+        if not 0 <= version < 256:
+            raise ValueError("version must be in range 0-255")
+
+        unsupported = [name for name, t in fields.items() if t not in _CODECS]
+        if unsupported:
+            raise TypeError("unsupported field type of %s" % ", ".join(unsupported))
+
+        self.prefix = prefix
+        self.version = version
+        self.fields = fields
+        self.header = prefix.encode() + bytes((0, version))
+        name = "CallbackData_" + "".join(c if c.isalnum() else "_" for c in prefix)
+        self.type = collections.namedtuple(name, list(fields))  # type: ignore[misc]
+
+        self._packers = tuple(_CODECS[t][0] for t in fields.values())
+        self._accepts = tuple(_ACCEPTS[t] for t in fields.values())
+        self._unpackers = tuple(_CODECS[t][1] for t in fields.values())
+        self._names = tuple(fields)
+
+        if len(self.header) > CALLBACK_DATA_LIMIT:
+            raise ValueError("prefix is too long")
+
+    def __repr__(self) -> str:
+        return "CallbackData(%r, version=%d, %s)" % (
+            self.prefix,
+            self.version,
+            ", ".join("%s=%s" % (name, t.__name__) for name, t in self.fields.items()),
+        )
+
+    def pack(self, *args, **kwargs) -> bytes:
+        """
+        Packs field values (positional or by name) to callback data.
+
+        raise TypeError if a value isn't of its field type, and ValueError if it's out of
+        range or result is too long.
+        """
+        values = self.type(*args, **kwargs)
+
+        buffer = bytearray(self.header)
+        for name, pack, accepts, value in zip(self._names, self._packers, self._accepts, values):
+            if not isinstance(value, accepts) or (isinstance(value, bool) and accepts is not bool):
+                raise TypeError("%s should be %s, got %r" % (name, self.fields[name].__name__, value))
+
+            pack(buffer, value)
+
+        if len(buffer) > CALLBACK_DATA_LIMIT:
+            raise ValueError(
+                "packed callback data is %d bytes, limit is %d bytes" % (len(buffer), CALLBACK_DATA_LIMIT)
+            )
+
+        return bytes(buffer)
+
+    def unpack(self, data: typing.Union[str, bytes]) -> typing.Any:
+        """
+        Unpacks callback data; raises ValueError if it's not of this schema.
+        """
+        data = _raw(data)
+        if not data.startswith(self.header):
+            raise ValueError("callback data is not of %r" % self)
+
+        return self._unpack(data, len(self.header))
+
+    def _unpack(self, data: bytes, offset: int) -> typing.Any:
+        values = []
+        try:
+            for unpack in self._unpackers:
+                value, offset = unpack(data, offset)
+                values.append(value)
+        except (IndexError, UnicodeDecodeError) as e:
+            raise ValueError("malformed callback data of %r" % self) from e
+
+        if offset != len(data):
+            raise ValueError("malformed callback data of %r" % self)
+
+        return self.type(*values)
+
+    def match(self, data: typing.Union[str, bytes, None]) -> bool:
+        return data is not None and _raw(data).startswith(self.header)
+
+    def button(self, text: str, *args, **kwargs) -> InlineKeyboardButton:
+        """
+        Returns InlineKeyboardButton with packed callback data.
+        """
+        return InlineKeyboardButton(text, callback_data=self.pack(*args, **kwargs))
+
+    @property
+    def filter(self) -> filters.Filter:
+        """
+        Filter of callback queries of this schema.
+        """
+
+        async def func(_, __, query):
+            return self.match(query.data)
+
+        return filters.create(func)
+
+
+_CallbackHandler = typing.Callable[[Client, typing.Any, typing.Any], typing.Awaitable[typing.Any]]
+
+
+class CallbackRouter:
+    """
+    Dispatches callback queries to handlers by their `CallbackData` schema.
+
+    Headers (prefix and version) of schemas are kept in a trie, so finding the handler of a
+    query takes one walk over its header, however many schemas are registered. Handler is
+    called as `handler(client, query, data)` with unpacked data.
+
+    Example::
+
+        router = CallbackRouter()
+
+        @router.route(Buy)
+        async def buy(client, query, data):
+            await query.answer("Bought %d of #%d" % (data.qty, data.item))
+
+        router.listen(app)
+    """
+
+    def __init__(self) -> None:
+        self._root: dict = {}
+
+    def add(self, schema: CallbackData, handler: _CallbackHandler) -> None:
+        node = self._root
+        for byte in schema.header:
+            node = node.setdefault(byte, {})
+
+        if None in node:
+            raise ValueError("%r already has a handler" % schema)
+
+        node[None] = (schema, handler)
+
+    def route(self, schema: CallbackData) -> typing.Callable[[_CallbackHandler], _CallbackHandler]:
+        """
+        Decorator; registers handler of `schema`.
+        """
+
+        def decorator(fn: _CallbackHandler) -> _CallbackHandler:
+            self.add(schema, fn)
+            return fn
+
+        return decorator
+
+    def find(self, data: typing.Union[str, bytes, None]) -> typing.Optional[typing.Tuple[CallbackData, _CallbackHandler, typing.Any]]:
+        """
+        Returns (schema, handler, unpacked data) for callback data, or None if no schema matches.
+        """
+        if not data:
+            return None
+
+        data = _raw(data)
+        node = self._root
+        for offset, byte in enumerate(data):
+            node = node.get(byte)
+            if node is None:
+                return None
+
+            entry = node.get(None)
+            if entry is not None:
+                schema, handler = entry
+                try:
+                    return schema, handler, schema._unpack(data, offset + 1)
+                except ValueError:
+                    return None
+
+        return None
+
+    async def dispatch(self, client: Client, query: typing.Any) -> bool:
+        """
+        Calls handler of query; returns False if there's none.
+        """
+        found = self.find(query.data)
+        if found is None:
+            return False
+
+        await found[1](client, query, found[2])
+        return True
+
+    def listen(self, app: Client, group: int = 0) -> None:
+        """
+        Adds a callback query handler to client which dispatches routed queries.
+        """
+
+        async def _router_wrapper(_c, query):
+            if not await self.dispatch(_c, query):
+                raise ContinuePropagation
+
+        app.add_handler(CallbackQueryHandler(_router_wrapper), group=group)
+
+
 _VF = typing.Callable[[Client, int, typing.Iterable[typing.Union[int, str]]], typing.Coroutine]
 
 
+def _joined(member: typing.Any) -> bool:
+    # used for both get_chat_member results and ChatMemberUpdated, so cache agrees with API
+    status = member.status
+    if status in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED):
+        return False
+
+    if status == ChatMemberStatus.RESTRICTED:
+        # restricted users may have left the chat
+        return bool(member.is_member)
+
+    return True
+
+
+async def _is_member(app: Client, id: int, channel: typing.Union[int, str]) -> bool:
+    try:
+        member = await app.get_chat_member(channel, id)
+    except UserNotParticipant:
+        return False
+
+    return _joined(member)
+
+
+def _peer(value: typing.Union[int, str]) -> typing.Union[int, str]:
+    return value.lstrip("@").lower() if isinstance(value, str) else value
+
+
+class MembershipCache:
+    """
+    Bounded cache of channel membership results, keyed by (channel, user).
+
+    Both positive and negative results are kept, each with its own TTL; give it to
+    `validation_channels` or `missing_channels` as `cache`. Call `install()` to keep
+    it up to date from ChatMemberUpdated updates (bot has to be admin of channels to
+    receive them).
+
+    Parameters:
+        maxsize (`int`, `optional`):
+            maximum number of results; nearest to expire is evicted when full.
+
+        ttl (`float`, `optional`):
+            seconds to keep positive results (user is member).
+
+        negative_ttl (`float`, `optional`):
+            seconds to keep negative results (user is not member).
+
+    Example::
+
+        cache = MembershipCache(ttl=600)
+        cache.install(app)
+
+        is_joined = await validation_channels(app, user_id, channels, cache=cache)
+    """
+
+    def __init__(self, maxsize: int = 100_000, ttl: float = 300, negative_ttl: float = 30) -> None:
+        self.cache = cachebox.VTTLCache(maxsize)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def set(self, channel: typing.Union[int, str], user: typing.Union[int, str], member: bool) -> None:
+        """
+        Stores membership result of user in channel.
+        """
+        self.cache.insert((_peer(channel), _peer(user)), member, self.ttl if member else self.negative_ttl)
+
+    def get(self, channel: typing.Union[int, str], user: typing.Union[int, str]) -> typing.Optional[bool]:
+        """
+        Returns cached result, or None if there isn't one.
+        """
+        return self.cache.get((_peer(channel), _peer(user)), None)
+
+    def invalidate(self, channel: typing.Union[int, str], user: typing.Union[int, str]) -> None:
+        """
+        Removes cached result of user in channel.
+        """
+        self.cache.pop((_peer(channel), _peer(user)), None)
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    async def is_member(self, app: Client, id: typing.Union[int, str], channel: typing.Union[int, str]) -> bool:
+        """
+        Returns cached result, or asks telegram and caches it.
+        """
+        member = self.get(channel, id)
+        if member is None:
+            member = await _is_member(app, id, channel)
+            self.set(channel, id, member)
+
+        return member
+
+    async def on_chat_member_updated(self, _c: Client, update: typing.Any) -> None:
+        """
+        ChatMemberUpdated handler; stores new membership of user, so next check doesn't need
+        a request.
+        """
+        new = update.new_chat_member
+        user = new.user if new is not None else update.old_chat_member.user
+        member = new is not None and _joined(new)
+
+        chats = (update.chat.id, update.chat.username)
+        users = (user.id, user.username)
+        for ch in chats:
+            for u in users:
+                if ch is not None and u is not None:
+                    self.set(ch, u, member)
+
+        raise ContinuePropagation
+
+    def install(self, app: Client, group: int = 0) -> None:
+        """
+        Adds a ChatMemberUpdated handler to client which keeps cache up to date.
+        """
+        app.add_handler(ChatMemberUpdatedHandler(self.on_chat_member_updated), group=group)
+
+
+async def missing_channels(
+    app: Client,
+    id: int,
+    channels: typing.Iterable[typing.Union[int, str]],
+    concurrency: int = 5,
+    first: bool = False,
+    cache: typing.Optional[MembershipCache] = None,
+) -> typing.List[typing.Union[int, str]]:
+    """
+    missing_channels returns channels which user is not member of.
+
+    Channels are checked concurrently, at most `concurrency` at a time.
+
+    Parameters:
+        app (`pyrogram.Client`):
+            client.
+
+        id (`int | str`):
+            user id or username.
+
+        channels (`list[int | str]`):
+            list of channels id or username.
+
+        concurrency (`int`, `optional`):
+            maximum number of get_chat_member requests in flight.
+
+        first (`bool`, `optional`):
+            if True, stops (and cancels remaining checks) as soon as one missing channel found.
+
+        cache (`MembershipCache`, `optional`):
+            membership cache; channels with a cached result are not requested.
+
+    Returns:
+        missing channels, in order of `channels`.
+
+    Example::
+
+        missing = await missing_channels(app, user_id, channels)
+        if missing:
+            await app.send_message(user_id, "Join %s first" % ", ".join(map(str, missing)))
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    channels = list(channels)
+    results: typing.Dict[int, bool] = {}
+
+    if cache is not None:
+        for index, ch in enumerate(channels):
+            member = cache.get(ch, id)
+            if member is None:
+                continue
+
+            if first and not member:
+                return [ch]
+
+            results[index] = member
+
+    if len(results) < len(channels):
+        semaphore = asyncio.Semaphore(concurrency)
+        is_member = _is_member if cache is None else cache.is_member
+
+        async def check(channel):
+            async with semaphore:
+                return await is_member(app, id, channel)
+
+        tasks = {
+            asyncio.ensure_future(check(ch)): index for index, ch in enumerate(channels) if index not in results
+        }
+
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                found = False
+                for task in done:
+                    results[tasks[task]] = member = task.result()
+                    found = found or not member
+
+                if first and found:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+    return [ch for index, ch in enumerate(channels) if results.get(index) is False]
+
+
 async def validation_channels(
     app: Client,
     id: int,
     channels: typing.Iterable[typing.Union[int, str]],
     invite_func: typing.Optional[_VF] = None,
+    concurrency: int = 5,
+    cache: typing.Optional[MembershipCache] = None,
 ) -> bool:
     """
     validation_channels checks user already in channels or not.
 
+    Channels are checked concurrently (see `missing_channels`); without `invite_func`,
+    remaining checks are cancelled as soon as one channel fails.
+
     Parameters:
         app (`pyrogram.Client`):
             client.
@@ -133,7 +1001,13 @@ async def validation_channels(
             list of channels id or username.
 
         invite_func (`(Client, int, list[int | str]) -> None`, `optional`):
-            validation_channels calls it when user not member of channels. (before return False)
+            validation_channels calls it with channels which user is not member of. (before return False)
+
+        concurrency (`int`, `optional`):
+            maximum number of get_chat_member requests in flight.
+
+        cache (`MembershipCache`, `optional`):
+            membership cache; channels with a cached result are not requested.
 
     Returns:
         returns True if user already in channels, returns False otherwise.
@@ -152,19 +1026,403 @@ async def validation_channels(
 
         is_joined = await validation_channels(app, user_id, channels, invite_func=invite)
     """
-    for ch in channels:
+    # invite_func needs all missing channels, so don't stop at first one
+    missing = await missing_channels(app, id, channels, concurrency, first=invite_func is None, cache=cache)
+    if not missing:
+        return True
+
+    if invite_func:
+        await invite_func(app, id, missing)
+
+    return False
+
+
+_T = typing.TypeVar("_T")
+_R = typing.TypeVar("_R")
+
+
+class _Checkpoint:
+    """
+    Low watermark of a batch run, kept in a file: every item before `offset` is done.
+    """
+
+    def __init__(self, path: str, interval: float = 1.0) -> None:
+        self.path = path
+        self.interval = interval
+        self._done: typing.Set[int] = set()
+        self._saved = time.monotonic()
+
         try:
-            status = await app.get_chat_member(ch, id)
-        except UserNotParticipant:
-            if invite_func:
-                await invite_func(app, id, channels)
+            with open(path, "r") as f:
+                self.offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            self.offset = 0
 
-            return False
+    def done(self, index: int) -> None:
+        if index != self.offset:
+            self._done.add(index)
+        else:
+            self.offset += 1
+            while self.offset in self._done:
+                self._done.remove(self.offset)
+                self.offset += 1
 
-        if status.status == ChatMemberStatus.LEFT:
-            if invite_func:
-                await invite_func(app, id, channels)
+        if time.monotonic() - self._saved >= self.interval:
+            self.save()
 
-            return False
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(self.offset))
 
-    return True
+        os.replace(tmp, self.path)
+        self._saved = time.monotonic()
+
+
+async def _imap(
+    func: typing.Callable[[_T], typing.Awaitable[_R]],
+    items: typing.Union[typing.Iterable[_T], typing.AsyncIterable[_T]],
+    concurrency: int,
+    start: int = 0,
+) -> typing.AsyncIterator[typing.Tuple[int, _T, _R]]:
+    """
+    Runs `func` over items, at most `concurrency` at a time; yields (index, item, result)
+    in order of completion. Items are pulled lazily, and first `start` items are skipped.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    if hasattr(items, "__aiter__"):
+        aiterator = items.__aiter__()  # type: ignore[union-attr]
+        next_item = aiterator.__anext__
+    else:
+        iterator = iter(items)  # type: ignore[arg-type]
+
+        async def next_item():
+            try:
+                return next(iterator)
+            except StopIteration:
+                raise StopAsyncIteration from None
+
+    tasks: typing.Dict[asyncio.Future, typing.Tuple[int, _T]] = {}
+    index = 0
+    exhausted = False
+
+    try:
+        while True:
+            while not exhausted and len(tasks) < concurrency:
+                try:
+                    item = await next_item()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+
+                if index >= start:
+                    tasks[asyncio.ensure_future(func(item))] = (index, item)
+
+                index += 1
+
+            if not tasks:
+                return
+
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                i, item = tasks.pop(task)
+                yield i, item, task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _call(func: typing.Callable, *args) -> None:
+    result = func(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def validate_members(
+    app: Client,
+    users: typing.Union[typing.Iterable[typing.Union[int, str]], typing.AsyncIterable[typing.Union[int, str]]],
+    channels: typing.Iterable[typing.Union[int, str]],
+    concurrency: int = 10,
+    rate: float = 20.0,
+    cache: typing.Optional[MembershipCache] = None,
+    checkpoint: typing.Optional[str] = None,
+    on_error: typing.Optional[
+        typing.Callable[[typing.Union[int, str], typing.Union[int, str], Exception], typing.Any]
+    ] = None,
+) -> typing.AsyncIterator[typing.Tuple[typing.Union[int, str], typing.List[typing.Union[int, str]]]]:
+    """
+    validate_members checks many users at once; yields (user, missing channels) pairs as
+    soon as each user is checked (so not in order of `users`).
+
+    All get_chat_member requests share a rate limit; on FloodWait all of them pause for
+    the asked time, and the failed request is retried. If a request fails with any other
+    API error (e.g. PeerIdInvalid), that channel is counted as missing for the user (and
+    isn't cached), the error is given to `on_error`, and the run goes on.
+
+    Parameters:
+        app (`pyrogram.Client`):
+            client.
+
+        users (`Iterable[int | str] | AsyncIterable[int | str]`):
+            user ids or usernames; pulled lazily, so it can be a generator or a database cursor.
+
+        channels (`list[int | str]`):
+            list of channels id or username.
+
+        concurrency (`int`, `optional`):
+            number of users checked at a time.
+
+        rate (`float`, `optional`):
+            maximum get_chat_member requests per second.
+
+        cache (`MembershipCache`, `optional`):
+            membership cache; cached results are used and new results are stored.
+
+        checkpoint (`str`, `optional`):
+            path of checkpoint file. It keeps number of users (from the beginning) which are done;
+            if it exists, that many users are skipped, so an interrupted run resumes where it
+            stopped. `users` must be iterated in the same order every time.
+
+        on_error (`Callable[[int | str, int | str, Exception], Any]`, `optional`):
+            called (or awaited) with user, channel and error of failed requests.
+
+    Example::
+
+        async for user_id, missing in validate_members(app, user_ids, channels, checkpoint="draw.ckpt"):
+            if not missing:
+                candidates.append(user_id)
+    """
+    channels = list(channels)
+    limiter = TokenBucket(rate)
+    state = _Checkpoint(checkpoint) if checkpoint else None
+
+    async def check(user):
+        missing = []
+        for ch in channels:
+            member = None if cache is None else cache.get(ch, user)
+
+            failed = False
+            while member is None:
+                await limiter.acquire()
+                try:
+                    member = await _is_member(app, user, ch)
+                except FloodWait as e:
+                    limiter.pause(e.value)  # type: ignore[arg-type]
+                except RPCError as e:
+                    # a bad user or channel mustn't stop the run, nor be retried forever on resume
+                    member, failed = False, True
+                    if on_error is not None:
+                        await _call(on_error, user, ch, e)
+
+            if cache is not None and not failed:
+                cache.set(ch, user, member)
+
+            if not member:
+                missing.append(ch)
+
+        return missing
+
+    try:
+        async for index, user, missing in _imap(check, users, concurrency, state.offset if state else 0):
+            yield user, missing
+
+            if state is not None:
+                state.done(index)
+    finally:
+        if state is not None:
+            state.save()
+
+
+# recipients which will never receive a message; they are counted as blocked
+_UNREACHABLE = (
+    UserIsBlocked,
+    UserIsBot,
+    InputUserDeactivated,
+    UserDeactivated,
+    UserDeactivatedBan,
+    PeerIdInvalid,
+    ChatWriteForbidden,
+    ChannelPrivate,
+)
+
+
+class BroadcastStats:
+    """
+    Progress of a `broadcast()`.
+
+    Attributes:
+        sent (`int`): messages sent.
+        blocked (`int`): recipients which blocked the bot, are deleted, or can't be written to.
+        failed (`int`): recipients which failed with any other error.
+        skipped (`int`): recipients skipped because a checkpoint said they were done.
+        flood_waits (`int`): FloodWaits received.
+        errors (`collections.Counter`): number of blocked and failed recipients by error name.
+    """
+
+    __slots__ = ("sent", "blocked", "failed", "skipped", "flood_waits", "errors", "started")
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.skipped = 0
+        self.flood_waits = 0
+        self.errors: typing.Counter[str] = collections.Counter()
+        self.started = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        """
+        Recipients handled in this run.
+        """
+        return self.sent + self.blocked + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        """
+        Messages sent per second.
+        """
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return "BroadcastStats(sent=%d, blocked=%d, failed=%d, skipped=%d, flood_waits=%d, rate=%.1f/s)" % (
+            self.sent,
+            self.blocked,
+            self.failed,
+            self.skipped,
+            self.flood_waits,
+            self.rate,
+        )
+
+
+def _read_recipients(path: str) -> typing.Iterator[typing.Union[int, str]]:
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                yield int(line)
+            except ValueError:
+                yield line
+
+
+async def broadcast(
+    app: Client,
+    recipients: typing.Union[
+        str, typing.Iterable[typing.Union[int, str]], typing.AsyncIterable[typing.Union[int, str]]
+    ],
+    send: typing.Callable[[Client, typing.Union[int, str]], typing.Awaitable[typing.Any]],
+    concurrency: int = 20,
+    rate: float = 25.0,
+    checkpoint: typing.Optional[str] = None,
+    on_error: typing.Optional[typing.Callable[[typing.Union[int, str], Exception], typing.Any]] = None,
+    progress: typing.Optional[typing.Callable[[BroadcastStats], typing.Any]] = None,
+    progress_interval: float = 5.0,
+) -> BroadcastStats:
+    """
+    broadcast sends a message to every recipient, at most `rate` per second.
+
+    Recipients are pulled lazily and at most `concurrency` messages are in flight, so memory
+    use doesn't grow with number of recipients. On FloodWait all sends pause for the asked
+    time and the failed one is retried. Recipients which blocked the bot (or are deleted,
+    or can't be written to) and ones failing with any other error are counted, given to
+    `on_error`, and skipped; they don't stop the broadcast.
+
+    Parameters:
+        app (`pyrogram.Client`):
+            client.
+
+        recipients (`str | Iterable[int | str] | AsyncIterable[int | str]`):
+            chat ids or usernames; can be a generator or a database cursor. A `str` is path
+            of a file with one recipient per line.
+
+        send (`Callable[[Client, int | str], Awaitable]`):
+            sends the message to a recipient, e.g. `lambda app, id: app.copy_message(id, ...)`.
+
+        concurrency (`int`, `optional`):
+            number of messages in flight.
+
+        rate (`float`, `optional`):
+            maximum messages per second.
+
+        checkpoint (`str`, `optional`):
+            path of checkpoint file. It keeps number of recipients (from the beginning) which
+            are done; if it exists, that many recipients are skipped, so a crashed run resumes
+            where it stopped. `recipients` must be iterated in the same order every time.
+
+        on_error (`Callable[[int | str, Exception], Any]`, `optional`):
+            called (or awaited) with recipient and error for blocked and failed recipients.
+
+        progress (`Callable[[BroadcastStats], Any]`, `optional`):
+            called (or awaited) with stats every `progress_interval` seconds, and once at the end.
+
+        progress_interval (`float`, `optional`):
+            seconds between `progress` calls.
+
+    Example::
+
+        async def send(app, chat_id):
+            await app.copy_message(chat_id, from_chat_id, message_id)
+
+        stats = await broadcast(app, "subscribers.txt", send, checkpoint="news.ckpt", progress=print)
+    """
+    if isinstance(recipients, str):
+        recipients = _read_recipients(recipients)
+
+    stats = BroadcastStats()
+    limiter = TokenBucket(rate)
+    state = _Checkpoint(checkpoint) if checkpoint else None
+    if state is not None:
+        stats.skipped = state.offset
+
+    async def deliver(chat_id) -> typing.Optional[Exception]:
+        while True:
+            await limiter.acquire()
+            try:
+                await send(app, chat_id)
+                return None
+            except FloodWait as e:
+                stats.flood_waits += 1
+                limiter.pause(e.value)  # type: ignore[arg-type]
+            except Exception as e:
+                return e
+
+    reported = time.monotonic()
+
+    try:
+        async for index, chat_id, error in _imap(deliver, recipients, concurrency, stats.skipped):
+            if error is None:
+                stats.sent += 1
+            else:
+                if isinstance(error, _UNREACHABLE):
+                    stats.blocked += 1
+                else:
+                    stats.failed += 1
+
+                stats.errors[getattr(error, "ID", None) or type(error).__name__] += 1
+                if on_error is not None:
+                    await _call(on_error, chat_id, error)
+
+            if state is not None:
+                state.done(index)
+
+            if progress is not None and time.monotonic() - reported >= progress_interval:
+                reported = time.monotonic()
+                await _call(progress, stats)
+    finally:
+        if state is not None:
+            state.save()
+
+    if progress is not None:
+        await _call(progress, stats)
+
+    return stats
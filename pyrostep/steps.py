@@ -1,65 +1,1461 @@
 import asyncio
+import collections
+import contextvars
 import typing
 import functools
+import heapq
+import inspect
+import logging
+import math
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import weakref
 import cachebox
 
 from pyrogram.client import Client as _Client
 from pyrogram import filters, types, ContinuePropagation
 from pyrogram.handlers.message_handler import MessageHandler
+from pyrogram import handlers as _handlers_module
 
+log = logging.getLogger(__name__)
 
 _MT = typing.Union[asyncio.Future, typing.Callable]
 
+ALL_HANDLERS = (
+    MessageHandler,
+    _handlers_module.CallbackQueryHandler,
+    _handlers_module.ChatJoinRequestHandler,
+    _handlers_module.ChatMemberUpdatedHandler,
+    _handlers_module.ChosenInlineResultHandler,
+    _handlers_module.EditedMessageHandler,
+    _handlers_module.InlineQueryHandler,
+)
+"""
+Every handler type which `listen()` supports.
+"""
+
+_handlers: typing.Dict[str, typing.Callable] = {}
+_handler_names: typing.Dict[typing.Callable, str] = {}
+
+
+class Step(typing.NamedTuple):
+    """
+    Serializable form of a registered step: handler name and its extra arguments.
+    """
+
+    name: str
+    args: tuple = ()
+    kwargs: dict = {}
+
+
+def step_handler(fn: typing.Optional[typing.Callable] = None, *, name: typing.Optional[str] = None):
+    """
+    Registers `fn` as named step handler, so stores which keep steps outside of process
+    memory can save it by name.
+
+    name defaults to `module.qualname` of function; it must be same in all processes.
+
+    Example::
+
+        @pyrostep.step_handler
+        async def get_age(client, message, name=None):
+            ...
+
+        @pyrostep.step_handler(name="signin.password")
+        async def get_password(client, message, username=None):
+            ...
+
+        await pyrostep.register_next_step(user_id, "signin.password", kwargs={"username": "x"})
+    """
+
+    def decorator(fn: typing.Callable) -> typing.Callable:
+        key = name or "%s.%s" % (fn.__module__, fn.__qualname__)
+        _handlers[key] = fn
+        _handler_names[fn] = key
+        return fn
+
+    return decorator if fn is None else decorator(fn)
+
+
+def to_step(value: typing.Callable) -> Step:
+    """
+    Converts a step handler (or `functools.partial` of one) to `Step`.
+
+    raise TypeError if handler isn't registered by `step_handler`.
+    """
+    args, kwargs = (), {}
+    if isinstance(value, functools.partial):
+        value, args, kwargs = value.func, value.args, value.keywords
+
+    try:
+        return Step(_handler_names[value], args, kwargs)
+    except (KeyError, TypeError):
+        pass
+
+    raise TypeError("step handler %r is not registered, use pyrostep.step_handler" % (value,))
+
+
+def from_step(step: Step) -> typing.Callable:
+    """
+    Converts `Step` back to a callable step handler.
+
+    raise KeyError if handler isn't registered.
+    """
+    fn = _handlers[step.name]
+    return functools.partial(fn, *step.args, **step.kwargs) if step.args or step.kwargs else fn
+
+
+class MetricsHook:
+    """
+    Receives events of step dispatching; subclass it and override the methods you need,
+    then pass it to `set_metrics`. `pyrostep.metrics.Collector` is a ready one.
+
+    Methods are called synchronously on the hot path, so they must be quick.
+    """
+
+    def on_update(self, hit: bool) -> None:
+        """
+        An update reached listener; `hit` is True if a waiter or step took it.
+        """
+
+    def on_pending(self, delta: int) -> None:
+        """
+        Number of steps registered by `register_next_step` changed by `delta`.
+        """
+
+    def on_handler(self, seconds: float, error: bool) -> None:
+        """
+        A step handler finished after `seconds`; `error` is True if it raised.
+        """
+
+    def on_wait_start(self) -> None:
+        """
+        A `wait_for` started waiting.
+        """
+
+    def on_wait(self, seconds: float, outcome: str) -> None:
+        """
+        A `wait_for` finished after `seconds`; outcome is "resolved", "timeout" or "cancelled".
+        """
+
+    def on_stream_put(self, depth: int) -> None:
+        """
+        An update was buffered in a stream; `depth` is buffer size after that.
+        """
+
+
+_metrics: typing.Optional[MetricsHook] = None
+
+
+def set_metrics(hook: typing.Optional[MetricsHook]) -> None:
+    """
+    Sets metrics hook; None disables metrics (the default).
+
+    Example::
+
+        from pyrostep.metrics import Collector
+
+        collector = Collector()
+        pyrostep.set_metrics(collector)
+
+        # e.g. in your /metrics HTTP endpoint
+        text = collector.prometheus()
+    """
+    global _metrics
+    _metrics = hook
+
 
 class MetaStore:
+    #: `wait_for` keeps its futures in a local index attached to the store, which allows
+    #: many waiters per key; stores which deliver futures to other processes through
+    #: `set_item` set it to False.
+    local_waiters: bool = True
+
+    #: if True, `has_item` answers from an index of keys registered from this process,
+    #: so updates without pending step are skipped without awaiting store. Only stores
+    #: which are written from this process alone (and start empty) should set it.
+    local_index: bool = False
+
     async def set_item(self, key: int, value: _MT) -> None:
         """
-        Stores key-value.
+        Stores key-value.
+        """
+        raise NotImplementedError
+
+    async def pop_item(self, key: int) -> _MT:
+        """
+        Gives stored key-value.
+
+        raise KeyError if not found.
+        """
+        raise NotImplementedError
+
+    async def clear(self) -> typing.AsyncGenerator[_MT, None]:
+        """
+        Gives and clears all stored key-value.
+        """
+        raise NotImplementedError
+
+    async def pop_first(self, keys: typing.Sequence[int]) -> typing.Tuple[int, _MT]:
+        """
+        Gives and removes value of the first stored key in `keys`, as (key, value).
+
+        raise KeyError if none of them found.
+
+        Default implementation calls `pop_item` for each key; override it if your
+        store can do it in one round-trip.
+        """
+        for key in keys:
+            try:
+                return key, await self.pop_item(key)
+            except KeyError:
+                pass
+
+        raise KeyError(keys)
+
+    async def set_many(self, items: typing.Iterable[typing.Tuple[int, _MT]]) -> None:
+        """
+        Stores many key-values.
+
+        Default implementation calls `set_item` for each item.
+        """
+        for key, value in items:
+            await self.set_item(key, value)
+
+    async def pop_many(self, keys: typing.Iterable[int]) -> typing.Dict[int, _MT]:
+        """
+        Gives and removes stored values of `keys`; keys which aren't found are skipped.
+
+        Default implementation calls `pop_item` for each key.
+        """
+        result = {}
+        for key in keys:
+            try:
+                result[key] = await self.pop_item(key)
+            except KeyError:
+                pass
+
+        return result
+
+    def has_item(self, key: int) -> bool:
+        """
+        Reports whether a value may be stored for key, without awaiting.
+
+        Listener calls it before `pop_item` to skip updates which have no pending step.
+        By default it returns True, so every update is looked up in store; with
+        `local_index` it checks keys registered from this process. Override it if your
+        store can answer it cheaply.
+        """
+        if not self.local_index:
+            return True
+
+        try:
+            return key in self._keys
+        except AttributeError:
+            return False
+
+    def _track(self, key: int) -> None:
+        if not self.local_index:
+            return
+
+        try:
+            self._keys.add(key)
+        except AttributeError:
+            self._keys: typing.Set[int] = {key}
+
+    def _untrack(self, key: int) -> None:
+        try:
+            self._keys.discard(key)
+        except AttributeError:
+            pass
+
+    def _untrack_all(self) -> None:
+        try:
+            self._keys.clear()
+        except AttributeError:
+            pass
+
+
+class SnapshotReport(typing.NamedTuple):
+    """
+    Result of `RootStore.snapshot()`.
+
+    Attributes:
+        saved (`int`): number of steps written.
+        waiters (`list[int]`): keys with a pending `wait_for` (or `stream`); they can't be saved.
+        skipped (`list[int]`): keys whose handler isn't registered by `step_handler`, or whose
+            arguments can't be pickled.
+    """
+
+    saved: int
+    waiters: typing.List[int]
+    skipped: typing.List[int]
+
+
+class RestoreReport(typing.NamedTuple):
+    """
+    Result of `RootStore.restore()`.
+
+    Attributes:
+        restored (`int`): number of steps restored.
+        expired (`int`): number of steps whose ttl passed while bot was down.
+        unknown (`list[int]`): keys whose handler name isn't registered in this process.
+    """
+
+    restored: int
+    expired: int
+    unknown: typing.List[int]
+
+
+# snapshot file: header, name table, fixed-size records, then pickled arguments
+_SNAPSHOT_MAGIC = b"PYROSTEP"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<8sHIQ")  # magic, version, names, records
+_SNAPSHOT_NAME = struct.Struct("<H")  # length of utf-8 name which follows
+# key, name index, wall-clock deadline (nan if none), offset and length of pickled
+# (args, kwargs, tag); length is 0 if there is none
+_SNAPSHOT_RECORD = struct.Struct("<qIdQI")
+
+
+class RootStore(MetaStore):
+    """
+    In-memory store; used as default root store.
+
+    Parameters:
+        maxsize (`int`, *optional*):
+            maximum number of registered steps; 0 means unbounded.
+
+        ttl (`float`, *optional*):
+            default lifetime of registered steps in seconds; None means forever.
+
+        policy (`str`, *optional*):
+            which step is dropped when store is full: "lru" drops least recently used,
+            "ttl" drops the one that expires first.
+
+        on_expire (`(int, value) -> Any`, *optional*):
+            called with key and value of every step which is expired or dropped;
+            may be a coroutine function.
+
+        resolution (`float`, *optional*):
+            deadlines are grouped in buckets of this many seconds and swept together
+            on writes, so `on_expire` may be called up to `resolution` seconds late.
+
+    Example::
+
+        async def expired(key, value):
+            await app.send_message(key, "Your session expired.")
+
+        pyrostep.change_root_store(RootStore(maxsize=100_000, ttl=3600, on_expire=expired))
+
+    Steps can be kept across a planned restart with `snapshot()` and `restore()`.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        ttl: typing.Optional[float] = None,
+        policy: str = "lru",
+        on_expire: typing.Optional[typing.Callable[[int, _MT], typing.Any]] = None,
+        resolution: float = 1.0,
+    ) -> None:
+        if policy == "lru":
+            self.cache = cachebox.LRUCache(maxsize)
+        elif policy == "ttl":
+            self.cache = cachebox.FIFOCache(maxsize)
+        else:
+            raise ValueError("policy must be 'lru' or 'ttl', got %r" % (policy,))
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.policy = policy
+        self.on_expire = on_expire
+        self.resolution = resolution
+
+        self._deadlines: typing.Dict[int, float] = {}
+        self._buckets: typing.Dict[int, typing.Set[int]] = {}
+        self._slots: typing.List[int] = []
+        self._tasks: typing.Set[asyncio.Future] = set()
+
+    async def set_item(self, key: int, value: _MT, ttl: typing.Optional[float] = None) -> None:
+        self._set(key, value, time.monotonic(), self.ttl if ttl is None else ttl)
+
+    async def pop_item(self, key: int) -> _MT:
+        return self._pop(key)
+
+    async def clear(self) -> typing.AsyncGenerator[_MT, None]:
+        self._deadlines.clear()
+        self._buckets.clear()
+        self._slots.clear()
+
+        # swap in an empty cache, so old one can be given out lazily
+        cache, self.cache = self.cache, type(self.cache)(self.cache.maxsize)
+
+        for v in cache.values():
+            yield v
+
+    async def pop_first(self, keys: typing.Sequence[int]) -> typing.Tuple[int, _MT]:
+        for key in keys:
+            try:
+                return key, self._pop(key)
+            except KeyError:
+                pass
+
+        raise KeyError(keys)
+
+    async def set_many(
+        self, items: typing.Iterable[typing.Tuple[int, _MT]], ttl: typing.Optional[float] = None
+    ) -> None:
+        now = time.monotonic()
+        ttl = self.ttl if ttl is None else ttl
+
+        for key, value in items:
+            self._set(key, value, now, ttl)
+
+    async def pop_many(self, keys: typing.Iterable[int]) -> typing.Dict[int, _MT]:
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self._pop(key)
+            except KeyError:
+                pass
+
+        return result
+
+    def has_item(self, key: int) -> bool:
+        return key in self.cache
+
+    # cache can answer has_item itself; no need to keep index
+    def _track(self, key: int) -> None:
+        pass
+
+    def _untrack(self, key: int) -> None:
+        pass
+
+    def _untrack_all(self) -> None:
+        pass
+
+    def expire(self, now: typing.Optional[float] = None) -> int:
+        """
+        Drops expired steps and returns how many were dropped.
+
+        Store calls it itself on writes; call it periodically if your bot may stay
+        idle for long and you need `on_expire` to be called in time.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        count = 0
+        while self._slots and self._slots[0] * self.resolution <= now:
+            slot = heapq.heappop(self._slots)
+
+            for key in self._buckets.pop(slot, ()):
+                deadline = self._deadlines.get(key)
+
+                # key may be popped or registered again with another deadline
+                if deadline is None or deadline > now:
+                    continue
+
+                del self._deadlines[key]
+                self._expired(key, self.cache.pop(key))
+                count += 1
+
+        return count
+
+    def snapshot(self, path: str) -> SnapshotReport:
+        """
+        Writes every pending step to `path` in a compact binary file, to be loaded by
+        `restore()` after a restart. Steps are saved by name, so their handlers must be
+        registered by `step_handler` and their arguments must be picklable; others are
+        skipped. Deadlines and tags are kept.
+
+        Pending `wait_for`s (and `stream`s) can't be saved, since their callers are gone
+        after a restart; their keys are reported, so you can tell those users. The store
+        isn't changed. File is replaced atomically.
+
+        Example::
+
+            report = store.snapshot("steps.snap")
+            for user_id in report.waiters:
+                await app.send_message(user_id, "Bot is restarting, please start again.")
+        """
+        names: typing.Dict[str, int] = {}
+        records = bytearray()
+        blob = bytearray()
+        waiters: typing.List[int] = []
+        skipped: typing.List[int] = []
+
+        tags = _tags_of(self, False)
+        tag_of = {} if tags is None else tags.tag_of
+        deadlines = self._deadlines
+        # deadlines are monotonic; file keeps wall-clock time, which survives a restart
+        offset = time.time() - time.monotonic()
+        nan = math.nan
+
+        record = _SNAPSHOT_RECORD.pack
+        dumps = pickle.dumps
+
+        for key, value in self.cache.items():
+            if isinstance(value, asyncio.Future):
+                if not value.done():
+                    waiters.append(key)
+
+                continue
+
+            try:
+                name, args, kwargs = to_step(value)
+                tag = tag_of.get(key)
+                extra = b""
+                if args or kwargs or tag is not None:
+                    extra = dumps((args, kwargs, tag), pickle.HIGHEST_PROTOCOL)
+            except (TypeError, AttributeError, pickle.PicklingError):
+                skipped.append(key)
+                continue
+
+            index = names.get(name)
+            if index is None:
+                index = names[name] = len(names)
+
+            deadline = deadlines.get(key)
+            records += record(key, index, nan if deadline is None else deadline + offset, len(blob), len(extra))
+            blob += extra
+
+        waiters.extend(k for k in _waiters_of(self).by_key if k not in waiters)
+
+        count = len(records) // _SNAPSHOT_RECORD.size
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, len(names), count))
+            for name in names:
+                encoded = name.encode()
+                f.write(_SNAPSHOT_NAME.pack(len(encoded)))
+                f.write(encoded)
+
+            f.write(records)
+            f.write(blob)
+
+        os.replace(tmp, path)
+        return SnapshotReport(count, waiters, skipped)
+
+    def restore(self, path: str) -> RestoreReport:
+        """
+        Loads steps written by `snapshot()` into this store; existing steps of same keys
+        are replaced. Steps whose deadline passed are dropped (without `on_expire`), and
+        keys of steps whose handler isn't registered now are reported.
+
+        File is memory-mapped and read in place, so millions of steps load in seconds.
+        Register your step handlers (import their modules) before calling it.
+
+        raise ValueError if file isn't a snapshot, or is truncated or corrupt (steps read
+        before the damaged record stay restored).
+        """
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _SNAPSHOT_HEADER.size:
+                raise ValueError("%r is not a pyrostep snapshot" % (path,))
+
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            return self._restore(mm, path)
+        finally:
+            mm.close()
+
+    def _restore(self, mm: mmap.mmap, path: str) -> RestoreReport:
+        magic, version, name_count, record_count = _SNAPSHOT_HEADER.unpack_from(mm, 0)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("%r is not a pyrostep snapshot" % (path,))
+
+        if version != _SNAPSHOT_VERSION:
+            raise ValueError("unsupported snapshot version %d" % version)
+
+        size = len(mm)
+        pos = _SNAPSHOT_HEADER.size
+        handlers: typing.List[typing.Optional[typing.Callable]] = []
+        for _ in range(name_count):
+            if pos + _SNAPSHOT_NAME.size > size:
+                raise ValueError("snapshot %r is truncated" % (path,))
+
+            (length,) = _SNAPSHOT_NAME.unpack_from(mm, pos)
+            pos += _SNAPSHOT_NAME.size
+            if pos + length > size:
+                raise ValueError("snapshot %r is truncated" % (path,))
+
+            try:
+                name = mm[pos : pos + length].decode()
+            except UnicodeDecodeError:
+                raise ValueError("snapshot %r is corrupt" % (path,)) from None
+
+            handlers.append(_handlers.get(name))
+            pos += length
+
+        blob = pos + record_count * _SNAPSHOT_RECORD.size
+        if blob > size:
+            raise ValueError("snapshot %r is truncated" % (path,))
+
+        blob_size = size - blob
+
+        now = time.monotonic()
+        offset = time.time() - now
+        tags = None
+        restored = expired = 0
+        # steps which aren't replacing one; only those are new to the pending gauge
+        added = 0
+        unknown: typing.List[int] = []
+
+        loads = pickle.loads
+        partial = functools.partial
+        set_item = self._set
+        cache = self.cache
+        deadlines = self._deadlines
+        # without a bound or a ttl, _set() is just this; skip it for speed
+        plain = not self.maxsize
+
+        with memoryview(mm) as view:
+            for key, index, deadline, start, length in _SNAPSHOT_RECORD.iter_unpack(view[pos:blob]):
+                if index >= name_count or start + length > blob_size:
+                    self._restored(added)
+                    raise ValueError("snapshot %r is corrupt" % (path,))
+
+                fn = handlers[index]
+                if fn is None:
+                    unknown.append(key)
+                    continue
+
+                ttl = None
+                if deadline == deadline:  # not nan
+                    ttl = deadline - offset - now
+                    if ttl <= 0:
+                        expired += 1
+                        continue
+
+                if length:
+                    try:
+                        args, kwargs, tag = loads(view[blob + start : blob + start + length])
+                    except Exception:
+                        self._restored(added)
+                        raise ValueError("snapshot %r is corrupt" % (path,)) from None
+
+                    if args or kwargs:
+                        fn = partial(fn, *args, **kwargs)
+
+                    if tag is not None:
+                        if tags is None:
+                            tags = _tags_of(self)
+
+                        tags.set(key, tag)
+
+                if _metrics is not None:
+                    old = cache.get(key)
+                    added += old is None or not _is_step(old)
+
+                if plain and ttl is None:
+                    cache[key] = fn
+                    if deadlines:
+                        deadlines.pop(key, None)
+                else:
+                    set_item(key, fn, now, ttl)
+
+                restored += 1
+
+        self._restored(added)
+        return RestoreReport(restored, expired, unknown)
+
+    @staticmethod
+    def _restored(count: int) -> None:
+        if _metrics is not None and count:
+            _metrics.on_pending(count)
+
+    def _set(self, key: int, value: _MT, now: float, ttl: typing.Optional[float]) -> None:
+        if self._slots and self._slots[0] * self.resolution <= now:
+            self.expire(now)
+
+        if self.maxsize and key not in self.cache and len(self.cache) >= self.maxsize:
+            self._evict()
+
+        self.cache[key] = value
+        self._set_deadline(key, now, ttl)
+
+    def _pop(self, key: int) -> _MT:
+        value = self.cache.pop(key)
+        deadline = self._deadlines.pop(key, None)
+
+        if deadline is not None and deadline <= time.monotonic():
+            self._expired(key, value)
+            raise KeyError(key)
+
+        return value
+
+    def _set_deadline(self, key: int, now: float, ttl: typing.Optional[float]) -> None:
+        if ttl is None:
+            self._deadlines.pop(key, None)
+            return
+
+        deadline = now + ttl
+        self._deadlines[key] = deadline
+
+        slot = math.ceil(deadline / self.resolution)
+        try:
+            self._buckets[slot].add(key)
+        except KeyError:
+            self._buckets[slot] = {key}
+            heapq.heappush(self._slots, slot)
+
+    def _evict(self) -> None:
+        key = self._first_deadline() if self.policy == "ttl" else None
+
+        if key is None:
+            key, value = self.cache.popitem()
+        else:
+            value = self.cache.pop(key)
+
+        self._deadlines.pop(key, None)
+        self._expired(key, value)
+
+    def _first_deadline(self) -> typing.Optional[int]:
+        while self._slots:
+            slot = self._slots[0]
+            live = [
+                k
+                for k in self._buckets[slot]
+                if k in self._deadlines and math.ceil(self._deadlines[k] / self.resolution) == slot
+            ]
+            if live:
+                return min(live, key=self._deadlines.__getitem__)
+
+            del self._buckets[heapq.heappop(self._slots)]
+
+        return None
+
+    def _expired(self, key: int, value: _MT) -> None:
+        # every expiry and eviction comes here; keep tag index in step with cache
+        tags = _tags_of(self, False)
+        if tags is not None:
+            tags.discard(key)
+
+        if isinstance(value, asyncio.Future):
+            if not value.done():
+                value.set_exception(asyncio.TimeoutError())
+
+        elif _metrics is not None:
+            _metrics.on_pending(-1)
+
+        if self.on_expire is None:
+            return
+
+        result = self.on_expire(key, value)
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+
+_RootStore = RootStore
+
+
+root = RootStore()
+
+
+def change_root_store(store: MetaStore) -> None:
+    """
+    changes root store.
+    """
+    global root
+    root = store
+
+
+class _Waiter:
+    __slots__ = ("key", "future", "filters", "types", "slot")
+
+    def __init__(self, key: int, future: asyncio.Future, filters: typing.Any, types: tuple) -> None:
+        self.key = key
+        self.future = future
+        self.filters = filters
+        self.types = types
+        self.slot = 0
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    async def put(self, _u) -> bool:
+        self.future.set_result(_u)
+        return True
+
+    def cancel(self, msg: typing.Any = None) -> None:
+        self.future.cancel(msg)
+
+
+#: `wait_for` timeouts are rounded up to this many seconds, so waiters which expire
+#: close together are expired in one batch by one event loop timer.
+TIMER_RESOLUTION = 0.1
+
+_CLOCK_RESOLUTION = time.get_clock_info("monotonic").resolution
+
+
+class _TimerWheel:
+    """
+    Expires waiters in batches: deadlines are grouped in slots of `resolution` seconds,
+    and only the nearest slot has a timer on event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, resolution: float) -> None:
+        self.loop = loop
+        self.resolution = resolution
+        self.buckets: typing.Dict[int, typing.Set[_Waiter]] = {}
+        self.slots: typing.List[int] = []
+        self.handle: typing.Optional[asyncio.TimerHandle] = None
+        self.next: typing.Optional[int] = None
+
+    def add(self, waiter: _Waiter, timeout: float) -> None:
+        slot = math.ceil((self.loop.time() + timeout) / self.resolution)
+        waiter.slot = slot
+
+        try:
+            self.buckets[slot].add(waiter)
+        except KeyError:
+            self.buckets[slot] = {waiter}
+            heapq.heappush(self.slots, slot)
+
+            if self.next is None or slot < self.next:
+                self._schedule(slot)
+
+    def discard(self, waiter: _Waiter) -> None:
+        # empty buckets are dropped when their timer fires
+        bucket = self.buckets.get(waiter.slot)
+        if bucket is not None:
+            bucket.discard(waiter)
+
+    def _schedule(self, slot: int) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+
+        self.next = slot
+        self.handle = self.loop.call_at(slot * self.resolution, self._fire)
+
+    def _fire(self) -> None:
+        self.handle = self.next = None
+        now = self.loop.time() + _CLOCK_RESOLUTION
+
+        while self.slots and self.slots[0] * self.resolution <= now:
+            for waiter in self.buckets.pop(heapq.heappop(self.slots)):
+                if not waiter.future.done():
+                    waiter.future.set_exception(asyncio.TimeoutError())
+
+        if self.slots:
+            self._schedule(self.slots[0])
+
+
+_wheels: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _TimerWheel]" = weakref.WeakKeyDictionary()
+
+
+def _wheel() -> _TimerWheel:
+    loop = asyncio.get_event_loop()
+
+    try:
+        return _wheels[loop]
+    except KeyError:
+        _wheels[loop] = wheel = _TimerWheel(loop, TIMER_RESOLUTION)
+        return wheel
+
+
+async def _wait(waiter: _Waiter, timeout: typing.Optional[float]) -> types.Update:
+    metrics = _metrics
+    if metrics is None and timeout is None:
+        return await waiter.future
+
+    if metrics is not None:
+        metrics.on_wait_start()
+        start = time.perf_counter()
+
+    wheel = None
+    if timeout is not None:
+        wheel = _wheel()
+        wheel.add(waiter, timeout)
+
+    outcome = "cancelled"
+    try:
+        result = await waiter.future
+        outcome = "resolved"
+        return result
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    finally:
+        if wheel is not None:
+            wheel.discard(waiter)
+
+        if metrics is not None:
+            metrics.on_wait(time.perf_counter() - start, outcome)
+
+
+class _Waiters:
+    """
+    `wait_for` waiters and streams by key, then by update type; None type matches every update.
+    """
+
+    def __init__(self) -> None:
+        self.by_key: typing.Dict[int, typing.Dict[typing.Optional[type], typing.List[_Waiter]]] = {}
+
+    def add(self, waiter: _Waiter) -> None:
+        slots = self.by_key.setdefault(waiter.key, {})
+        for t in waiter.types:
+            slots.setdefault(t, []).append(waiter)
+
+    def remove(self, waiter: _Waiter) -> None:
+        slots = self.by_key.get(waiter.key)
+        if slots is None:
+            return
+
+        for t in waiter.types:
+            lst = slots.get(t)
+            if lst is None:
+                continue
+
+            try:
+                lst.remove(waiter)
+            except ValueError:
+                continue
+
+            if not lst:
+                del slots[t]
+
+        if not slots:
+            del self.by_key[waiter.key]
+
+    def candidates(self, _u) -> typing.List[_Waiter]:
+        result: typing.List[_Waiter] = []
+        t = type(_u)
+
+        user = getattr(_u, "from_user", None)
+        chat = getattr(_u, "chat", None)
+        uid = None if user is None else user.id
+
+        for key in (uid, None if chat is None or chat.id == uid else chat.id):
+            slots = None if key is None else self.by_key.get(key)
+            if not slots:
+                continue
+
+            result.extend(slots.get(t, ()))
+            result.extend(slots.get(None, ()))
+
+        return result
+
+    def pop_key(self, key: int) -> typing.List[_Waiter]:
+        slots = self.by_key.pop(key, None)
+        if not slots:
+            return []
+
+        # a waiter is listed once for each of its types
+        return list({id(w): w for lst in slots.values() for w in lst}.values())
+
+    def pop_all(self) -> typing.List[_Waiter]:
+        return [w for key in list(self.by_key) for w in self.pop_key(key)]
+
+
+class _Tags:
+    """
+    Secondary index of steps registered with a tag: tag -> keys, and key -> tag.
+    """
+
+    def __init__(self) -> None:
+        self.keys: typing.Dict[typing.Hashable, typing.Set[int]] = {}
+        self.tag_of: typing.Dict[int, typing.Hashable] = {}
+
+    def set(self, key: int, tag: typing.Hashable) -> None:
+        self.discard(key)
+
+        if tag is not None:
+            self.tag_of[key] = tag
+            try:
+                self.keys[tag].add(key)
+            except KeyError:
+                self.keys[tag] = {key}
+
+    def discard(self, key: int) -> None:
+        tag = self.tag_of.pop(key, None)
+        if tag is None:
+            return
+
+        keys = self.keys[tag]
+        keys.discard(key)
+        if not keys:
+            del self.keys[tag]
+
+    def pop_tag(self, tag: typing.Hashable) -> typing.Set[int]:
+        keys = self.keys.pop(tag, set())
+        for key in keys:
+            del self.tag_of[key]
+
+        return keys
+
+    def pop_where(self, predicate: typing.Callable[[typing.Any], bool]) -> typing.List[int]:
+        keys: typing.List[int] = []
+        for tag in [t for t in self.keys if predicate(t)]:
+            keys.extend(self.pop_tag(tag))
+
+        return keys
+
+    def clear(self) -> None:
+        self.keys.clear()
+        self.tag_of.clear()
+
+
+class _LockedTags(_Tags):
+    """
+    `_Tags` guarded by a lock, for stores which are shared between threads.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.RLock()
+
+    def set(self, key: int, tag: typing.Hashable) -> None:
+        with self._lock:
+            super().set(key, tag)
+
+    def discard(self, key: int) -> None:
+        with self._lock:
+            super().discard(key)
+
+    def pop_tag(self, tag: typing.Hashable) -> typing.Set[int]:
+        with self._lock:
+            return super().pop_tag(tag)
+
+    def pop_where(self, predicate: typing.Callable[[typing.Any], bool]) -> typing.List[int]:
+        with self._lock:
+            return super().pop_where(predicate)
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+
+
+def _tags_of(store: MetaStore, create: bool = True) -> typing.Optional[_Tags]:
+    try:
+        return store._tags  # type: ignore[attr-defined]
+    except AttributeError:
+        if not create:
+            return None
+
+        store._tags = tags = _Tags()  # type: ignore[attr-defined]
+        return tags
+
+
+def _waiters_of(store: MetaStore) -> _Waiters:
+    try:
+        return store._waiters  # type: ignore[attr-defined]
+    except AttributeError:
+        store._waiters = waiters = _Waiters()  # type: ignore[attr-defined]
+        return waiters
+
+
+async def _check(f: typing.Any, _c, _u) -> bool:
+    result = f(_c, _u)
+    if inspect.isawaitable(result):
+        result = await result
+
+    return bool(result)
+
+
+async def _resolve_waiters(waiters: _Waiters, _c, _u) -> bool:
+    resolved = False
+
+    for w in waiters.candidates(_u):
+        if w.done():
+            continue
+
+        if w.filters is not None and not await _check(w.filters, _c, _u):
+            continue
+
+        # filter may have awaited; waiter could be cancelled meanwhile
+        if not w.done() and await w.put(_u):
+            resolved = True
+
+    return resolved
+
+
+class _WaiterProxy:
+    """
+    Base of callables which stores keep in place of a `wait_for` future that belongs to
+    another loop or process; they aren't steps.
+    """
+
+    __slots__ = ()
+
+
+def _is_step(value: _MT) -> bool:
+    return not isinstance(value, (asyncio.Future, _WaiterProxy))
+
+
+def _exact_index(store: MetaStore) -> bool:
+    # has_item of base MetaStore is True for every key unless local_index is set
+    return store.local_index or type(store).has_item is not MetaStore.has_item
+
+
+def _cancel(value: _MT) -> None:
+    # futures, or proxies of futures which are waited on in another process
+    cancel = getattr(value, "cancel", None)
+    if cancel is not None:
+        cancel("cancelled")
+
+
+def _pending_keys(store: MetaStore, _u) -> typing.Tuple[int, ...]:
+    user = getattr(_u, "from_user", None)
+    uid = user.id if user is not None and store.has_item(user.id) else None
+
+    chat = getattr(_u, "chat", None)
+    cid = chat.id if chat is not None and store.has_item(chat.id) else None
+
+    if uid is None:
+        return () if cid is None else (cid,)
+
+    return (uid,) if cid is None or cid == uid else (uid, cid)
+
+
+async def _process(
+    store: MetaStore, keys: typing.Tuple[int, ...], _c, _u, pool: typing.Optional["StepPool"] = None
+) -> bool:
+    try:
+        key, fn = await store.pop_first(keys)
+    except KeyError:
+        # none of them is stored; index was stale
+        for key in keys:
+            store._untrack(key)
+
+        return False
+
+    store._untrack(key)
+
+    tags = _tags_of(store, False)
+    if tags is not None:
+        tags.discard(key)
+
+    if isinstance(fn, asyncio.Future):
+        if not fn.done():
+            fn.set_result(_u)
+
+        return True
+
+    if pool is not None:
+        await pool.submit(key, fn, _c, _u)
+    else:
+        await _run_step(fn, _c, _u)
+
+    return True
+
+
+async def _run_step(fn: typing.Callable, _c, _u) -> None:
+    metrics = _metrics
+    if metrics is None or isinstance(fn, _WaiterProxy):
+        await fn(_c, _u)
+        return
+
+    metrics.on_pending(-1)
+    start = time.perf_counter()
+    error = True
+    try:
+        await fn(_c, _u)
+        error = False
+    finally:
+        metrics.on_handler(time.perf_counter() - start, error)
+
+
+async def _dispatch(store: MetaStore, waiters: _Waiters, _c, _u, pool: typing.Optional["StepPool"] = None) -> bool:
+    # most updates have no pending step; reject them without awaiting store
+    if waiters.by_key and await _resolve_waiters(waiters, _c, _u):
+        hit = True
+    else:
+        busy = None if pool is None else pool._busy_key(_u)
+        if busy is not None:
+            # a step of key is queued or running, and may register the next one;
+            # look update up after it, in order
+            await pool._defer(busy, functools.partial(_dispatch_later, store, waiters, pool), _c, _u)  # type: ignore
+            return True
+
+        keys = _pending_keys(store, _u)
+        hit = bool(keys) and await _process(store, keys, _c, _u, pool)
+
+    if _metrics is not None:
+        _metrics.on_update(hit)
+
+    return hit
+
+
+async def _dispatch_later(store: MetaStore, waiters: _Waiters, pool: "StepPool", _c, _u) -> None:
+    # runs in a worker of pool after earlier steps of the key; a step found now runs inline
+    hit = await _dispatch(store, waiters, _c, _u)
+    if not hit and pool.on_miss is not None:
+        result = pool.on_miss(_c, _u)
+        if inspect.isawaitable(result):
+            await result
+
+
+# pool whose worker runs the current task; wait_for tells it which keys mustn't wait for it
+_current_pool: "contextvars.ContextVar[typing.Optional[StepPool]]" = contextvars.ContextVar(
+    "pyrostep_current_pool", default=None
+)
+
+
+# Task.cancelling() tells whether a task itself is being cancelled (Python 3.11+)
+_CANCELLING = hasattr(asyncio.Task, "cancelling")
+
+
+class _StepJob(typing.NamedTuple):
+    fn: typing.Callable
+    client: typing.Any
+    update: typing.Any
+    # a deferred lookup of update, not a step handler
+    deferred: bool = False
+
+    def __call__(self) -> typing.Awaitable[None]:
+        if self.deferred:
+            return self.fn(self.client, self.update)
+
+        return _run_step(self.fn, self.client, self.update)
+
+
+class StepPool:
+    """
+    Runs step handlers in background tasks instead of pyrogram's dispatcher workers, so a
+    slow step doesn't delay updates of other users.
+
+    Steps of the same key (user or chat id) run one after another, in order of their
+    updates; steps of different keys run concurrently on at most `workers` tasks. When
+    `max_pending` steps are queued or running, dispatching waits for room, which slows
+    pyrogram's dispatcher down instead of queueing without bound.
+
+    A step handler registers the next step only when it runs; so while a step of a key is
+    queued or running, later updates of that key (which have no step yet) are queued
+    behind it and looked up once it's done. Such an update can't propagate to other
+    handlers anymore if no step is found for it; it's given to `on_miss` instead.
+    `wait_for` called from a step handler is answered at once.
+
+    Errors of step handlers are logged. After `stop()`, steps are run inline again.
+
+    Parameters:
+        workers (`int`, *optional*):
+            maximum number of step handlers running at a time.
+
+        max_pending (`int`, *optional*):
+            maximum number of step handlers (and queued updates) queued or running.
+
+        on_miss (`Callable`, *optional*):
+            called as `on_miss(client, update)` (may be async) for a queued update which
+            turned out to have no step.
+
+    Example::
+
+        pool = pyrostep.StepPool(workers=32)
+        pyrostep.listen(app, pool=pool)
+
+        # on shutdown
+        await app.stop()
+        await pool.stop(timeout=10)
+    """
+
+    def __init__(
+        self, workers: int = 64, max_pending: int = 1000, on_miss: typing.Optional[typing.Callable] = None
+    ) -> None:
+        if workers < 1 or max_pending < 1:
+            raise ValueError("workers and max_pending must be at least 1")
+
+        self.workers = workers
+        self.max_pending = max_pending
+        self.on_miss = on_miss
+
+        # a key is in _ready at most once, and only one worker runs its queue
+        self._queues: typing.Dict[int, typing.Deque[_StepJob]] = {}
+        self._ready: typing.Deque[int] = collections.deque()
+        self._tasks: typing.Set[asyncio.Task] = set()
+        # keys which a running step handler waits for by wait_for; never deferred
+        self._waiting: typing.Dict[int, int] = {}
+        self._working = 0
+        self._pending = 0
+        self._room: typing.Optional[asyncio.Semaphore] = None
+        self._idle: typing.Optional[asyncio.Event] = None
+        self._stopped = False
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of step handlers queued or running.
         """
-        raise NotImplementedError
+        return self._pending
 
-    async def pop_item(self, key: int) -> _MT:
+    @property
+    def stopped(self) -> bool:
+        return self._stopped
+
+    async def submit(self, key: int, fn: typing.Callable, _c, _u) -> None:
         """
-        Gives stored key-value.
+        Queues `fn(_c, _u)` after other steps of `key`; waits for room if pool is full.
+        """
+        await self._queue(key, _StepJob(fn, _c, _u))
 
-        raise KeyError if not found.
+    async def _defer(self, key: int, fn: typing.Callable, _c, _u) -> None:
+        await self._queue(key, _StepJob(fn, _c, _u, True))
+
+    def _busy_key(self, _u) -> typing.Optional[int]:
         """
-        raise NotImplementedError
+        Returns user or chat id of update which has steps queued or running, if any.
+        """
+        queues = self._queues
+        if not queues or self._stopped:
+            return None
 
-    async def clear(self) -> typing.AsyncGenerator[_MT, None]:
+        for attr in ("from_user", "chat"):
+            obj = getattr(_u, attr, None)
+            if obj is not None and obj.id in queues and obj.id not in self._waiting:
+                return obj.id
+
+        return None
+
+    def _wait(self, key: int) -> None:
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+
+    def _done_waiting(self, key: int) -> None:
+        n = self._waiting.pop(key) - 1
+        if n:
+            self._waiting[key] = n
+
+    async def _queue(self, key: int, job: _StepJob) -> None:
+        if self._stopped:
+            await job()
+            return
+
+        if self._room is None:
+            self._room = asyncio.Semaphore(self.max_pending)
+            self._idle = asyncio.Event()
+            self._idle.set()
+
+        await self._room.acquire()
+        if self._stopped:
+            # stopped while waiting for room
+            self._room.release()
+            await job()
+            return
+
+        self._pending += 1
+        self._idle.clear()  # type: ignore[union-attr]
+
+        queue = self._queues.get(key)
+        if queue is None:
+            self._queues[key] = collections.deque((job,))
+            self._ready.append(key)
+            if self._working < self.workers:
+                self._working += 1
+                task = asyncio.ensure_future(self._work())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        else:
+            queue.append(job)
+
+    async def _work(self) -> None:
+        ready = self._ready
+        _current_pool.set(self)
+
+        try:
+            while ready:
+                key = ready.popleft()
+                queue = self._queues[key]
+                job = queue[0]
+
+                try:
+                    await self._run(key, job)
+                finally:
+                    # job stays queued while running, so that new steps of key wait for it
+                    queue.popleft()
+                    if queue:
+                        ready.append(key)
+                    else:
+                        del self._queues[key]
+
+                    self._pending -= 1
+                    self._room.release()  # type: ignore[union-attr]
+                    if not self._pending:
+                        self._idle.set()  # type: ignore[union-attr]
+        finally:
+            # counted here, not by done callback, so that submit() never sees an exited worker
+            self._working -= 1
+
+    @staticmethod
+    async def _run(key: int, job: _StepJob) -> None:
         """
-        Gives and clears all stored key-value.
+        Runs a step handler and logs its errors. Only cancellation of the worker itself
+        (by `stop()`, or on shutdown) is raised; a cancelled handler is just logged.
         """
-        raise NotImplementedError
+        if _CANCELLING:
+            try:
+                await job()
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():  # type: ignore[union-attr]
+                    raise
 
+                log.error("step handler of %d was cancelled", key)
+            except Exception:
+                log.exception("step handler of %d raised an error", key)
 
-class _RootStore(MetaStore):
-    def __init__(self) -> None:
-        self.cache = cachebox.Cache(0)
+            return
 
-    async def set_item(self, key: int, value: _MT) -> None:
-        self.cache[key] = value
+        # no Task.cancelling() before Python 3.11; run handler in its own task to tell them apart
+        step = asyncio.ensure_future(job())
+        try:
+            await asyncio.wait((step,))
+        except asyncio.CancelledError:
+            step.cancel()
+            raise
 
-    async def pop_item(self, key: int) -> _MT:
-        return self.cache.pop(key)
+        if step.cancelled():
+            log.error("step handler of %d was cancelled", key)
+        elif step.exception() is not None:
+            log.error("step handler of %d raised an error", key, exc_info=step.exception())
 
-    async def clear(self) -> typing.AsyncGenerator[_MT, None]:
-        for k in self.cache.keys():
-            yield self.cache.pop(k)
+    async def join(self) -> None:
+        """
+        Waits until every queued step handler is done.
+        """
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def stop(self, timeout: typing.Optional[float] = None) -> int:
+        """
+        Stops accepting steps (later ones run inline) and waits for queued ones; after
+        `timeout` seconds, running ones are cancelled and queued ones are dropped.
 
+        Returns number of step handlers which were cancelled or dropped.
+        """
+        self._stopped = True
 
-root = _RootStore()
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
 
+        dropped = self._pending
+        if not dropped:
+            return 0
 
-def change_root_store(store: MetaStore) -> None:
-    """
-    changes root store.
-    """
-    global root
-    root = store
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for queue in self._queues.values():
+            self._pending -= len(queue)
+            for _ in queue:
+                self._room.release()  # type: ignore[union-attr]
+
+        self._queues.clear()
+        self._ready.clear()
+        self._idle.set()  # type: ignore[union-attr]
+        return dropped
 
 
-async def listening_handler(_c, _u, store: typing.Optional[MetaStore] = None):
+async def listening_handler(_c, _u, store: typing.Optional[MetaStore] = None, pool: typing.Optional[StepPool] = None):
     """
     listen function for steps.
 
@@ -74,6 +1470,8 @@ async def listening_handler(_c, _u, store: typing.Optional[MetaStore] = None):
         - `EditedMessageHandler`
         - `InlineQueryHandler`
 
+    If `pool` is given, step handlers run on it; see `StepPool`.
+
     Example::
 
         # plugin file
@@ -83,25 +1481,8 @@ async def listening_handler(_c, _u, store: typing.Optional[MetaStore] = None):
     """
     store = store or root
 
-    fn = None
-
-    try:
-        fn = await root.pop_item(_u.from_user.id)
-    except (KeyError, AttributeError):
-        try:
-            fn = await root.pop_item(_u.chat.id)
-        except (KeyError, AttributeError):
-            pass
-
-    if fn is not None:
-        if isinstance(fn, asyncio.Future):
-            fn.set_result(_u)
-            return
-
-        await fn(_c, _u)
-        return
-
-    raise ContinuePropagation
+    if not await _dispatch(store, _waiters_of(store), _c, _u, pool):
+        raise ContinuePropagation
 
 
 def listen(
@@ -110,10 +1491,18 @@ def listen(
     handler: typing.Any = MessageHandler,
     filters: typing.Optional[filters.Filter] = None,
     group: int = 0,
+    pool: typing.Optional[StepPool] = None,
 ) -> None:
     """
     listen client for steps.
 
+    `handler` may be a handler type or an iterable of them (e.g. `ALL_HANDLERS`); one
+    dispatcher is added for all of them, and waiters of `wait_for` with `update_type`
+    are only looked up for updates of that type.
+
+    By default step handlers run inline, in pyrogram's dispatcher worker; if `pool` is
+    given, they run on it (in order per user or chat) and the worker is freed at once.
+
     supported handlers:
         - `MessageHandler`
         - `CallbackQueryHandler`
@@ -127,44 +1516,56 @@ def listen(
 
         app = Client(...)
         pyrostep.listen(app)
+
+        # messages and callback queries
+        pyrostep.listen(app, handler=(MessageHandler, CallbackQueryHandler))
+
+        # slow step handlers
+        pyrostep.listen(app, pool=pyrostep.StepPool(workers=32))
     """
     store = store or root
+    waiters = _waiters_of(store)
 
     async def _listen_wrapper(_c, _u):
-        fn = None
-
-        try:
-            fn = await store.pop_item(_u.from_user.id)
-        except (KeyError, AttributeError):
-            try:
-                fn = await store.pop_item(_u.chat.id)
-            except (KeyError, AttributeError):
-                pass
+        if not await _dispatch(store, waiters, _c, _u, pool):
+            raise ContinuePropagation
 
-        if fn is not None:
-            if isinstance(fn, asyncio.Future):
-                fn.set_result(_u)
-                return
+    for h in _handler_types(handler):
+        app.add_handler(h(_listen_wrapper, filters), group=group)
 
-            await fn(_c, _u)
-            return
 
-        raise ContinuePropagation
+def _handler_types(handler: typing.Any) -> typing.Tuple[type, ...]:
+    if isinstance(handler, type):
+        return (handler,)
 
-    app.add_handler(handler(_listen_wrapper, filters), group=group)
+    # duplicates would dispatch an update twice
+    return tuple(dict.fromkeys(handler))
 
 
 async def register_next_step(
-    id: int,
+    id: typing.Union[int, typing.Iterable[int]],
     _next: typing.Any,
     store: typing.Optional[MetaStore] = None,
     *,
     args: tuple = (),
     kwargs: dict = {},
+    ttl: typing.Optional[float] = None,
+    tag: typing.Hashable = None,
 ) -> None:
     """
     register next step for user/chat.
 
+    `_next` may be a step handler or name of one registered by `step_handler`.
+
+    `id` may be an iterable of ids to register the same step for all of them in one batch.
+
+    `ttl` is the step lifetime in seconds; the store must accept a `ttl` keyword
+    in `set_item` and `set_many` to use it (all stores of pyrostep do).
+
+    `tag` (any hashable, e.g. a chat id or campaign name) groups steps, so they can be
+    unregistered together by `unregister_tag` or `unregister_where`. Tags are indexed in
+    memory of this process.
+
     Example::
 
         async def step1(client, msg):
@@ -174,43 +1575,374 @@ async def register_next_step(
         async def step2(client, msg):
             # code ...
     """
+    if isinstance(_next, str):
+        _next = _handlers[_next]
+
     if args or kwargs:
         _next = functools.partial(_next, *args, **kwargs)
 
-    await (store or root).set_item(id, _next)
+    store = store or root
+    options = {} if ttl is None else {"ttl": ttl}
+
+    # a step without tag replaces a tagged one, so index is updated either way
+    tags = _tags_of(store, tag is not None)
+
+    # only new keys are counted as pending; an overwritten step is still one step
+    exact = _metrics is not None and _exact_index(store)
+
+    if isinstance(id, int):
+        new = not (exact and store.has_item(id))
+        await store.set_item(id, _next, **options)
+        store._track(id)
+
+        if tags is not None:
+            tags.set(id, tag)
+
+        if _metrics is not None and new:
+            _metrics.on_pending(1)
+
+        return
+
+    ids = list(id)
+    new_count = len(ids) - sum(map(store.has_item, ids)) if exact else len(ids)
+    # tagged before writing, so keys which the batch itself evicts are untagged again
+    if tags is not None:
+        for i in ids:
+            tags.set(i, tag)
+
+    try:
+        await store.set_many(((i, _next) for i in ids), **options)
+    except BaseException:
+        if tags is not None:
+            for i in ids:
+                tags.discard(i)
+
+        raise
+
+    for i in ids:
+        store._track(i)
+
+    if _metrics is not None:
+        _metrics.on_pending(new_count)
 
 
-async def unregister_steps(id: int, store: typing.Optional[MetaStore] = None) -> None:
+async def unregister_steps(
+    id: typing.Union[int, typing.Iterable[int]], store: typing.Optional[MetaStore] = None
+) -> None:
     """
-    unregister steps for `id`.
+    unregister steps for `id`; `id` may be an iterable of ids.
 
-    if step is `asyncio.Future`, cancels that.
+    cancels `wait_for`s of `id` too.
     """
-    try:
-        u = await (store or root).pop_item(id)
-    except KeyError:
+    store = store or root
+    waiters = _waiters_of(store)
+    tags = _tags_of(store, False)
+
+    if isinstance(id, int):
+        for w in waiters.pop_key(id):
+            w.cancel("cancelled")
+
+        store._untrack(id)
+        if tags is not None:
+            tags.discard(id)
+
+        try:
+            u = await store.pop_item(id)
+        except KeyError:
+            return
+
+        _cancel(u)
+
+        if _metrics is not None and _is_step(u):
+            _metrics.on_pending(-1)
+
         return
-    else:
-        if isinstance(u, asyncio.Future):
-            u.cancel("cancelled")
+
+    ids = list(id)
+    for i in ids:
+        for w in waiters.pop_key(i):
+            w.cancel("cancelled")
+
+        store._untrack(i)
+        if tags is not None:
+            tags.discard(i)
+
+    removed = 0
+    for u in (await store.pop_many(ids)).values():
+        _cancel(u)
+        removed += _is_step(u)
+
+    if _metrics is not None:
+        _metrics.on_pending(-removed)
+
+
+async def _unregister_keys(store: MetaStore, keys: typing.Collection[int], batch_size: int) -> int:
+    keys = list(keys)
+    removed = 0
+
+    for start in range(0, len(keys), batch_size):
+        if start:
+            await asyncio.sleep(0)
+
+        batch = keys[start : start + batch_size]
+        for key in batch:
+            store._untrack(key)
+
+        for u in (await store.pop_many(batch)).values():
+            _cancel(u)
+            removed += _is_step(u)
+
+    if _metrics is not None:
+        _metrics.on_pending(-removed)
+
+    return removed
+
+
+async def unregister_tag(
+    tag: typing.Hashable, store: typing.Optional[MetaStore] = None, batch_size: int = 1000
+) -> int:
+    """
+    unregister steps which are registered with `tag`; returns number of removed steps.
+
+    Only keys of tag are touched (found by tag index, not by scanning store), in batches
+    of `batch_size`.
+
+    Example::
+
+        await register_next_step(user_ids, ask_answer, tag=("campaign", 12))
+
+        # campaign is over
+        await unregister_tag(("campaign", 12))
+    """
+    store = store or root
+    tags = _tags_of(store, False)
+    if tags is None:
+        return 0
+
+    return await _unregister_keys(store, tags.pop_tag(tag), batch_size)
+
+
+async def unregister_where(
+    predicate: typing.Callable[[typing.Any], bool],
+    store: typing.Optional[MetaStore] = None,
+    batch_size: int = 1000,
+) -> int:
+    """
+    unregister steps whose tag passes `predicate(tag)`; returns number of removed steps.
+
+    `predicate` is called once per distinct tag, not per step.
+
+    Example::
+
+        # steps were registered with tag=("chat", chat_id)
+        await unregister_where(lambda tag: tag[0] == "chat" and tag[1] in banned_chats)
+    """
+    store = store or root
+    tags = _tags_of(store, False)
+    if tags is None:
+        return 0
+
+    return await _unregister_keys(store, tags.pop_where(predicate), batch_size)
 
 
 async def _wait_future(id: int, timeout: typing.Optional[float], store: MetaStore) -> types.Update:
-    fn = asyncio.get_event_loop().create_future()
+    waiter = _Waiter(id, asyncio.get_event_loop().create_future(), None, ())
+
+    await store.set_item(id, waiter.future)
+    store._track(id)
+
+    tags = _tags_of(store, False)
+    if tags is not None:
+        tags.discard(id)
 
-    await store.set_item(id, fn)
+    # in a step handler of a pool, updates of id mustn't be queued behind this handler
+    pool = _current_pool.get()
+    if pool is not None:
+        pool._wait(id)
 
     try:
-        return await asyncio.wait_for(fn, timeout)
+        return await _wait(waiter, timeout)
     finally:
+        if pool is not None:
+            pool._done_waiting(id)
+
         await unregister_steps(id, store)
 
 
-async def wait_for(id: int, timeout: typing.Optional[float] = None, store: typing.Optional[MetaStore] = None) -> types.Update:
+async def _wait_local(
+    id: int, timeout: typing.Optional[float], waiters: _Waiters, filters: typing.Any, update_type: typing.Any
+) -> types.Update:
+    waiter = _Waiter(id, asyncio.get_event_loop().create_future(), filters, _update_types(update_type))
+    waiters.add(waiter)
+
+    try:
+        return await _wait(waiter, timeout)
+    finally:
+        waiters.remove(waiter)
+
+
+def _update_types(update_type: typing.Any) -> tuple:
+    if update_type is None:
+        return (None,)
+
+    if isinstance(update_type, tuple):
+        return update_type
+
+    return (update_type,)
+
+
+class Stream:
+    """
+    Buffered stream of updates which come from an id; created by `stream()`.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        store: MetaStore,
+        filters: typing.Any = None,
+        update_type: typing.Any = None,
+        maxsize: int = 100,
+        timeout: typing.Optional[float] = None,
+    ) -> None:
+        self.key = id
+        self.filters = filters
+        self.types = _update_types(update_type)
+        self.maxsize = maxsize
+        self.timeout = timeout
+
+        self._waiters = _waiters_of(store)
+        self._buffer: typing.Deque[types.Update] = collections.deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._closed = False
+
+        self._waiters.add(self)  # type: ignore[arg-type]
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def done(self) -> bool:
+        return self._closed
+
+    async def put(self, _u) -> bool:
+        # blocks listener while buffer is full
+        while len(self._buffer) >= self.maxsize and not self._closed:
+            self._not_full.clear()
+            await self._not_full.wait()
+
+        if self._closed:
+            return False
+
+        self._buffer.append(_u)
+        self._not_empty.set()
+
+        if _metrics is not None:
+            _metrics.on_stream_put(len(self._buffer))
+
+        return True
+
+    def cancel(self, msg: typing.Any = None) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stops receiving updates; updates which are already buffered can still be read.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        self._waiters.remove(self)  # type: ignore[arg-type]
+        self._not_empty.set()
+        self._not_full.set()
+
+    def __aiter__(self) -> "Stream":
+        return self
+
+    async def __anext__(self) -> types.Update:
+        while not self._buffer:
+            if self._closed:
+                raise StopAsyncIteration
+
+            self._not_empty.clear()
+
+            if self.timeout is None:
+                await self._not_empty.wait()
+                continue
+
+            try:
+                await asyncio.wait_for(self._not_empty.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                self.close()
+                raise TimeoutError from None
+
+        _u = self._buffer.popleft()
+        self._not_full.set()
+        return _u
+
+    async def __aenter__(self) -> "Stream":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self.close()
+
+
+def stream(
+    id: int,
+    store: typing.Optional[MetaStore] = None,
+    *,
+    filters: typing.Optional[filters.Filter] = None,
+    update_type: typing.Union[type, typing.Tuple[type, ...], None] = None,
+    maxsize: int = 100,
+    timeout: typing.Optional[float] = None,
+) -> Stream:
+    """
+    Returns a stream of updates which come from id, which stays registered until closed.
+
+    Unlike calling `wait_for` in a loop, no update is lost between two iterations: updates
+    are buffered, up to `maxsize` of them; when the buffer is full, listener waits for the
+    stream to be read. Iteration raises TimeoutError if no update comes in `timeout` seconds,
+    and stops after `close()` once buffered updates are read.
+
+    `filters` and `update_type` work like in `wait_for`.
+
+    Example::
+
+        async with pyrostep.stream(message.from_user.id, timeout=60) as answers:
+            async for answer in answers:
+                if answer.text == "/done":
+                    break
+
+                await answer.reply("Got it.")
+    """
+    store = store or root
+
+    if not store.local_waiters:
+        raise ValueError("%s doesn't support streams" % type(store).__name__)
+
+    return Stream(id, store, filters, update_type, maxsize, timeout)
+
+
+async def wait_for(
+    id: int,
+    timeout: typing.Optional[float] = None,
+    store: typing.Optional[MetaStore] = None,
+    *,
+    filters: typing.Optional[filters.Filter] = None,
+    update_type: typing.Union[type, typing.Tuple[type, ...], None] = None,
+) -> types.Update:
     """
     wait for update which comming from id.
 
-    raise TimeoutError if timed out.
+    raise TimeoutError if timed out; timeout is rounded up to `TIMER_RESOLUTION`.
+
+    Many `wait_for`s can wait on the same id at once; each one is resolved only by updates
+    of `update_type` (e.g. `types.CallbackQuery`, or a tuple of types) which pass `filters`.
+    An update resolves every waiter it matches, and waiters take it before a step
+    registered by `register_next_step`.
 
     Example::
 
@@ -226,19 +1958,54 @@ async def wait_for(id: int, timeout: typing.Optional[float] = None, store: typin
                 return
 
             await answer.reply_text(f"Your Name Is: {answer.text}")
+
+        # in a group, wait for this user's answer in this chat only
+        answer = await pyrostep.wait_for(
+            message.chat.id, filters=filters.user(message.from_user.id), update_type=Message
+        )
     """
+    store = store or root
+
     try:
-        return await _wait_future(id, timeout, store or root)
+        if store.local_waiters:
+            return await _wait_local(id, timeout, _waiters_of(store), filters, update_type)
+
+        if filters is not None or update_type is not None:
+            raise ValueError("%s doesn't support filters and update_type" % type(store).__name__)
+
+        return await _wait_future(id, timeout, store)
     except asyncio.TimeoutError:
         raise TimeoutError
 
 
-async def clear(store: typing.Optional[MetaStore] = None) -> None:
+async def clear(store: typing.Optional[MetaStore] = None, batch_size: int = 1000) -> None:
     """
     Clears all registered key-value's.
 
-    Blocks listener until complete clearing.
+    Values are cancelled in batches of `batch_size`, and event loop runs between batches,
+    so listener keeps serving updates while a big store is cleared. Steps registered
+    meanwhile may be kept.
     """
-    async for i in (store or root).clear(): # type: ignore
-        if isinstance(i, asyncio.Future):
-            i.cancel()
+    store = store or root
+    store._untrack_all()
+
+    tags = _tags_of(store, False)
+    if tags is not None:
+        tags.clear()
+
+    for n, w in enumerate(_waiters_of(store).pop_all(), 1):
+        w.cancel()
+        if n % batch_size == 0:
+            await asyncio.sleep(0)
+
+    removed = count = 0
+    async for i in store.clear(): # type: ignore
+        _cancel(i)
+        removed += _is_step(i)
+
+        count += 1
+        if count % batch_size == 0:
+            await asyncio.sleep(0)
+
+    if _metrics is not None:
+        _metrics.on_pending(-removed)
@@ -0,0 +1,10 @@
+from .shared import (
+    SharedStore,  # noqa
+    MemoryRedis,  # noqa
+)
+from .sqlite import (
+    SQLiteStore,  # noqa
+)
+from .threaded import (
+    ThreadSafeStore,  # noqa
+)
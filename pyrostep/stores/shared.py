@@ -0,0 +1,527 @@
+import asyncio
+import fnmatch
+import heapq
+import logging
+import os
+import pickle
+import socket
+import time
+import typing
+import uuid
+
+from pyrogram.client import Client as _Client
+from pyrogram.types import Object
+
+from .. import steps
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # redis is optional; MemoryRedis raises this one
+
+    class WatchError(Exception):  # type: ignore[no-redef]
+        pass
+
+
+log = logging.getLogger(__name__)
+
+
+class MemoryRedis:
+    """
+    In-process stand-in for `redis.asyncio.Redis`; implements only what `SharedStore` uses.
+
+    Share one instance between several `SharedStore`s to simulate workers in tests.
+    """
+
+    def __init__(self) -> None:
+        self.data: typing.Dict[str, bytes] = {}
+        self._expires: typing.Dict[str, float] = {}
+        # (deadline, name); entries whose deadline changed since are skipped
+        self._deadlines: typing.List[typing.Tuple[float, str]] = []
+        self._channels: typing.Dict[str, typing.Set["MemoryPubSub"]] = {}
+        # bumped on every write of a key; WATCH compares them
+        self._versions: typing.Dict[str, int] = {}
+
+    def _expire(self) -> None:
+        deadlines = self._deadlines
+        if not deadlines or deadlines[0][0] > time.monotonic():
+            return
+
+        now = time.monotonic()
+        while deadlines and deadlines[0][0] <= now:
+            deadline, name = heapq.heappop(deadlines)
+            if self._expires.get(name) == deadline:
+                del self._expires[name]
+                self.data.pop(name, None)
+                self._touch(name)
+
+    def _touch(self, name: str) -> None:
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def _version(self, name: str) -> int:
+        self._expire()
+        return self._versions.get(name, 0)
+
+    async def get(self, name: str) -> typing.Optional[bytes]:
+        self._expire()
+        return self.data.get(name)
+
+    async def mget(self, names: typing.Sequence[str]) -> typing.List[typing.Optional[bytes]]:
+        self._expire()
+        return [self.data.get(n) for n in names]
+
+    async def set(self, name: str, value: bytes, px: typing.Optional[int] = None) -> bool:
+        self.data[name] = value
+        self._touch(name)
+        if px is None:
+            self._expires.pop(name, None)
+        else:
+            deadline = self._expires[name] = time.monotonic() + px / 1000
+            heapq.heappush(self._deadlines, (deadline, name))
+
+        return True
+
+    async def getdel(self, name: str) -> typing.Optional[bytes]:
+        self._expire()
+        self._expires.pop(name, None)
+        self._touch(name)
+        return self.data.pop(name, None)
+
+    async def delete(self, *names: str) -> int:
+        self._expire()
+        for n in names:
+            self._expires.pop(n, None)
+            self._touch(n)
+
+        return sum(self.data.pop(n, None) is not None for n in names)
+
+    async def scan_iter(self, match: str = "*") -> typing.AsyncGenerator[str, None]:
+        self._expire()
+        for name in [n for n in self.data if fnmatch.fnmatchcase(n, match)]:
+            yield name
+
+    async def publish(self, channel: str, message: bytes) -> int:
+        subscribers = self._channels.get(channel, ())
+        for p in subscribers:
+            p._queue.put_nowait({"type": "message", "channel": channel, "data": message})
+
+        return len(subscribers)
+
+    def pubsub(self) -> "MemoryPubSub":
+        return MemoryPubSub(self)
+
+    def pipeline(self, transaction: bool = True) -> "MemoryPipeline":
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """
+    Buffers commands until `execute()`; after `watch()` they run at once until `multi()`.
+    """
+
+    def __init__(self, redis: MemoryRedis) -> None:
+        self._redis = redis
+        self._commands: typing.List[typing.Tuple[str, tuple, dict]] = []
+        self._watched: typing.Optional[typing.Dict[str, int]] = None
+        self._immediate = False
+
+    async def __aenter__(self) -> "MemoryPipeline":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.reset()
+
+    async def watch(self, *names: str) -> None:
+        self._watched = {n: self._redis._version(n) for n in names}
+        self._immediate = True
+
+    def multi(self) -> None:
+        self._immediate = False
+
+    def _command(self, name: str, *args, **kwargs) -> typing.Any:
+        if self._immediate:
+            return getattr(self._redis, name)(*args, **kwargs)
+
+        self._commands.append((name, args, kwargs))
+        return self
+
+    def get(self, name: str) -> typing.Any:
+        return self._command("get", name)
+
+    def mget(self, names: typing.Sequence[str]) -> typing.Any:
+        return self._command("mget", names)
+
+    def set(self, name: str, value: bytes, px: typing.Optional[int] = None) -> typing.Any:
+        return self._command("set", name, value, px=px)
+
+    def delete(self, *names: str) -> typing.Any:
+        return self._command("delete", *names)
+
+    def publish(self, channel: str, message: bytes) -> typing.Any:
+        return self._command("publish", channel, message)
+
+    async def execute(self) -> typing.List[typing.Any]:
+        commands, watched = self._commands, self._watched
+        await self.reset()
+
+        redis = self._redis
+        if watched is not None and any(redis._version(n) != v for n, v in watched.items()):
+            raise WatchError("Watched variable changed.")
+
+        # nothing awaits inside MemoryRedis, so commands run together like MULTI/EXEC
+        return [await getattr(redis, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+    async def reset(self) -> None:
+        self._commands = []
+        self._watched = None
+        self._immediate = False
+
+
+class MemoryPubSub:
+    def __init__(self, redis: MemoryRedis) -> None:
+        self._redis = redis
+        self._queue: "asyncio.Queue[dict]" = asyncio.Queue()
+        self._subscribed: typing.Set[str] = set()
+
+    async def subscribe(self, *channels: str) -> None:
+        for ch in channels:
+            self._redis._channels.setdefault(ch, set()).add(self)
+            self._subscribed.add(ch)
+            self._queue.put_nowait({"type": "subscribe", "channel": ch, "data": len(self._subscribed)})
+
+    async def unsubscribe(self, *channels: str) -> None:
+        for ch in channels or tuple(self._subscribed):
+            self._redis._channels.get(ch, set()).discard(self)
+            self._subscribed.discard(ch)
+
+    async def listen(self) -> typing.AsyncGenerator[dict, None]:
+        while self._subscribed:
+            yield await self._queue.get()
+
+    async def aclose(self) -> None:
+        await self.unsubscribe()
+
+
+class _RemoteWaiter(steps._WaiterProxy):
+    """
+    Proxy of a `wait_for` future which is waited on in another worker.
+    """
+
+    __slots__ = ("store", "worker", "token")
+
+    def __init__(self, store: "SharedStore", worker: str, token: str) -> None:
+        self.store = store
+        self.worker = worker
+        self.token = token
+
+    async def __call__(self, _c, _u) -> None:
+        # pyrogram objects drop their client when pickled; receiver binds its own
+        message = pickle.dumps((self.token, _u), pickle.HIGHEST_PROTOCOL)
+        await self.store.redis.publish(self.store._worker_channel(self.worker), message)
+
+    def cancel(self, msg: typing.Any = None) -> None:
+        message = pickle.dumps((self.token, None))
+        self.store._spawn(self.store.redis.publish(self.store._worker_channel(self.worker), message))
+
+
+class SharedStore(steps.MetaStore):
+    """
+    Store which keeps steps in Redis (or anything that speaks the same protocol), so several
+    worker processes or hosts can serve one bot.
+
+    Steps are saved by name and arguments, so step handlers must be registered with
+    `pyrostep.step_handler` and their arguments must be picklable. `wait_for` works across
+    workers too: worker which receives the answer publishes it to the worker which waits.
+
+    Each worker keeps a local copy of registered keys, updated through pub/sub, so updates
+    which have no pending step are skipped without a round-trip.
+
+    `ttl` of `register_next_step` is supported; Redis expires the step itself (`PX`).
+
+    A step is removed only if its handler is registered in this worker, so during a
+    rolling deploy a worker which doesn't know a handler yet leaves the step to others.
+    Batches (`set_many`, `pop_first`, `pop_many`) take one pipeline each.
+
+    Parameters:
+        redis (`redis.asyncio.Redis`):
+            client; `MemoryRedis` can be used in tests.
+
+        prefix (`str`, *optional*):
+            prefix of keys and channels.
+
+        client (`pyrogram.Client`, *optional*):
+            client to bind the updates which are received from other workers to.
+
+        worker (`str`, *optional*):
+            unique name of this worker; random by default.
+
+    Example::
+
+        from redis.asyncio import Redis
+        from pyrostep.stores import SharedStore
+
+        store = SharedStore(Redis(), client=app)
+        await store.start()
+
+        pyrostep.listen(app, store)
+    """
+
+    local_waiters = False
+
+    def __init__(
+        self,
+        redis: typing.Any,
+        prefix: str = "pyrostep",
+        client: typing.Optional[_Client] = None,
+        worker: typing.Optional[str] = None,
+    ) -> None:
+        self.redis = redis
+        self.prefix = prefix
+        self.client = client
+        self.worker = worker or "%s-%d-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+        self._keys: typing.Set[int] = set()
+        self._futures: typing.Dict[str, asyncio.Future] = {}
+        self._tasks: typing.Set[asyncio.Future] = set()
+        self._pubsub: typing.Any = None
+        self._reader: typing.Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Loads registered keys and starts listening to other workers.
+        """
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(self._keys_channel(), self._worker_channel(self.worker))
+
+        offset = len(self._key(0)) - 1
+        async for name in self.redis.scan_iter(match=self._key("*")):
+            self._keys.add(int(_text(name)[offset:]))
+
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def close(self) -> None:
+        """
+        Stops listening to other workers and cancels local waiters.
+        """
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+        for fut in self._futures.values():
+            fut.cancel()
+
+        self._futures.clear()
+
+    async def set_item(self, key: int, value: steps._MT, ttl: typing.Optional[float] = None) -> None:
+        await self.set_many(((key, value),), ttl)
+
+    async def set_many(
+        self, items: typing.Iterable[typing.Tuple[int, steps._MT]], ttl: typing.Optional[float] = None
+    ) -> None:
+        # redis drops the key itself after ttl; local copies of keys keep it until a pop misses
+        px = None if ttl is None else max(1, int(ttl * 1000))
+
+        keys = []
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in items:
+            pipe.set(self._key(key), self._dumps(value), px=px)
+            keys.append(key)
+
+        if not keys:
+            return
+
+        pipe.publish(self._keys_channel(), b"+" + _join(keys))
+        await pipe.execute()
+        self._keys.update(keys)
+
+    async def pop_item(self, key: int) -> steps._MT:
+        result = await self._pop((key,), True)
+        if not result:
+            raise KeyError(key)
+
+        return result[key]
+
+    async def pop_first(self, keys: typing.Sequence[int]) -> typing.Tuple[int, steps._MT]:
+        result = await self._pop(keys, True)
+        if not result:
+            raise KeyError(keys)
+
+        return result.popitem()
+
+    async def pop_many(self, keys: typing.Iterable[int]) -> typing.Dict[int, steps._MT]:
+        return await self._pop(list(keys), False)
+
+    async def clear(self) -> typing.AsyncGenerator[steps._MT, None]:
+        self._keys.clear()
+        await self.redis.publish(self._keys_channel(), b"*")
+
+        async for name in self.redis.scan_iter(match=self._key("*")):
+            data = await self.redis.getdel(name)
+            if data is None:
+                continue
+
+            try:
+                value = self._load(pickle.loads(data))
+            except KeyError:
+                # handler isn't registered; nothing to give out, step is deleted anyway
+                continue
+
+            if value is not None:
+                yield value
+
+    def has_item(self, key: int) -> bool:
+        return key in self._keys
+
+    def _track(self, key: int) -> None:
+        pass
+
+    def _untrack(self, key: int) -> None:
+        pass
+
+    def _untrack_all(self) -> None:
+        pass
+
+    def _key(self, key: typing.Union[int, str]) -> str:
+        return "%s:step:%s" % (self.prefix, key)
+
+    def _keys_channel(self) -> str:
+        return "%s:keys" % self.prefix
+
+    def _worker_channel(self, worker: str) -> str:
+        return "%s:worker:%s" % (self.prefix, worker)
+
+    def _dumps(self, value: steps._MT) -> bytes:
+        if isinstance(value, asyncio.Future):
+            token = uuid.uuid4().hex
+            self._futures[token] = value
+            value.add_done_callback(lambda _: self._futures.pop(token, None))
+            return pickle.dumps(("wait", self.worker, token))
+
+        return pickle.dumps(("step",) + tuple(steps.to_step(value)))
+
+    async def _pop(self, keys: typing.Sequence[int], first: bool) -> typing.Dict[int, steps._MT]:
+        """
+        Removes steps of `keys` (only the first one found if `first`) in one transaction;
+        steps are read and checked before they're deleted, and deleted only if unchanged.
+        """
+        if not keys:
+            return {}
+
+        names = [self._key(k) for k in keys]
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(*names)
+                    records = {}
+                    dead = []
+                    for key, data in zip(keys, await pipe.mget(names)):
+                        if data is None:
+                            self._keys.discard(key)
+                            continue
+
+                        record = pickle.loads(data)
+                        if record[0] == "step":
+                            if record[1] not in steps._handlers:
+                                log.warning(
+                                    "SharedStore: step handler %r of key %d is not registered; step is kept",
+                                    record[1],
+                                    key,
+                                )
+                                continue
+                        elif record[1] == self.worker and record[2] not in self._futures:
+                            # waiter is gone already (timed out or cancelled)
+                            dead.append(key)
+                            continue
+
+                        records[key] = record
+                        if first:
+                            break
+
+                    if not records and not dead:
+                        return {}
+
+                    removed = list(records) + dead
+                    pipe.multi()
+                    pipe.delete(*(self._key(k) for k in removed))
+                    pipe.publish(self._keys_channel(), b"-" + _join(removed))
+                    await pipe.execute()
+                except WatchError:
+                    # changed by another worker meanwhile; read again
+                    continue
+
+                break
+
+        self._keys.difference_update(removed)
+
+        result = {}
+        for key, record in records.items():
+            value = self._load(record)
+            if value is not None:
+                result[key] = value
+
+        return result
+
+    def _load(self, record: tuple) -> typing.Optional[steps._MT]:
+        if record[0] == "step":
+            return steps.from_step(steps.Step(*record[1:]))
+
+        _, worker, token = record
+        if worker != self.worker:
+            return _RemoteWaiter(self, worker, token)
+
+        # None if waiter is gone already (timed out or cancelled)
+        return self._futures.pop(token, None)
+
+    async def _read(self) -> None:
+        async for message in self._pubsub.listen():
+            if message["type"] != "message":
+                continue
+
+            try:
+                if _text(message["channel"]) == self._keys_channel():
+                    self._apply(message["data"])
+                else:
+                    self._deliver(message["data"])
+            except Exception:
+                log.exception("SharedStore: cannot handle message from %r", message["channel"])
+
+    def _apply(self, data: bytes) -> None:
+        op = data[:1]
+        if op == b"*":
+            self._keys.clear()
+        elif op == b"+":
+            self._keys.update(map(int, data[1:].split(b",")))
+        else:
+            self._keys.difference_update(map(int, data[1:].split(b",")))
+
+    def _deliver(self, data: bytes) -> None:
+        token, update = pickle.loads(data)
+
+        fut = self._futures.pop(token, None)
+        if fut is None or fut.done():
+            return
+
+        if update is None:
+            fut.cancel("cancelled")
+            return
+
+        if self.client is not None and isinstance(update, Object):
+            update.bind(self.client)
+
+        fut.set_result(update)
+
+    def _spawn(self, coro: typing.Awaitable) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+def _join(keys: typing.Iterable[int]) -> bytes:
+    return b",".join(b"%d" % k for k in keys)
+
+
+def _text(value: typing.Union[str, bytes]) -> str:
+    return value.decode() if isinstance(value, bytes) else value
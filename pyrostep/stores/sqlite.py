@@ -0,0 +1,265 @@
+import asyncio
+import concurrent.futures
+import logging
+import pickle
+import sqlite3
+import time
+import typing
+
+from .. import steps
+
+log = logging.getLogger(__name__)
+
+_CLEAR = object()
+
+# pickled step and its deadline; None deletes the row
+_Row = typing.Optional[typing.Tuple[bytes, typing.Optional[float]]]
+
+
+class SQLiteStore(steps.MetaStore):
+    """
+    Store which persists registered steps in SQLite, so they survive restarts.
+
+    Steps are saved by name and arguments, so step handlers must be registered with
+    `pyrostep.step_handler` and their arguments must be picklable. `wait_for` futures are
+    kept in memory only.
+
+    Reads are served from memory. Writes are collected and committed together in a
+    background thread every `flush_interval` seconds (or once `batch_size` writes are
+    pending), so the event loop never waits for disk. Steps registered less than
+    `flush_interval` seconds before a crash may be lost; `close()` flushes everything.
+
+    `ttl` of `register_next_step` is supported; deadlines are saved in wall-clock time,
+    and expired steps are deleted when they're popped or when the store is loaded.
+
+    Parameters:
+        path (`str`):
+            database file; created if not exists.
+
+        flush_interval (`float`, *optional*):
+            how long writes are collected before commit.
+
+        batch_size (`int`, *optional*):
+            commit earlier when this many writes are pending.
+
+    Example::
+
+        from pyrostep.stores import SQLiteStore
+
+        store = SQLiteStore("steps.db")
+        pyrostep.change_root_store(store)
+        pyrostep.listen(app, store)
+
+        # ...
+        await store.close()
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.05, batch_size: int = 10000) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS steps (key INTEGER PRIMARY KEY, value BLOB NOT NULL, deadline REAL)"
+        )
+        if "deadline" not in [row[1] for row in self._conn.execute("PRAGMA table_info(steps)")]:
+            # written by a version without ttl
+            self._conn.execute("ALTER TABLE steps ADD COLUMN deadline REAL")
+
+        self._conn.execute("DELETE FROM steps WHERE deadline <= ?", (time.time(),))
+
+        # persisted steps are kept as `Step` and converted to handler on pop,
+        # so handlers may be registered after the store is loaded
+        self._data: typing.Dict[int, typing.Union[steps.Step, asyncio.Future]] = {}
+        # wall-clock deadlines of steps which have a ttl
+        self._deadlines: typing.Dict[int, float] = {}
+        for key, value, deadline in self._conn.execute("SELECT key, value, deadline FROM steps"):
+            self._data[key] = steps.Step(*pickle.loads(value))
+            if deadline is not None:
+                self._deadlines[key] = deadline
+
+        self._pending: typing.Dict[typing.Any, _Row] = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="pyrostep-sqlite")
+        self._flusher: typing.Optional[asyncio.Future] = None
+
+    async def set_item(self, key: int, value: steps._MT, ttl: typing.Optional[float] = None) -> None:
+        self._set(key, value, None if ttl is None else time.time() + ttl)
+
+    async def set_many(
+        self, items: typing.Iterable[typing.Tuple[int, steps._MT]], ttl: typing.Optional[float] = None
+    ) -> None:
+        deadline = None if ttl is None else time.time() + ttl
+        for key, value in items:
+            self._set(key, value, deadline)
+
+    async def pop_item(self, key: int) -> steps._MT:
+        return self._pop(key)
+
+    async def clear(self) -> typing.AsyncGenerator[steps._MT, None]:
+        values = list(self._data.values())
+        self._data.clear()
+        self._deadlines.clear()
+
+        self._pending.clear()
+        self._write(_CLEAR, None)
+
+        for v in values:
+            if not isinstance(v, steps.Step):
+                yield v
+                continue
+
+            try:
+                yield steps.from_step(v)
+            except KeyError:
+                # handler isn't registered; nothing to give out, step is deleted anyway
+                pass
+
+    async def pop_first(self, keys: typing.Sequence[int]) -> typing.Tuple[int, steps._MT]:
+        for key in keys:
+            if key in self._data:
+                try:
+                    return key, self._pop(key)
+                except KeyError:
+                    pass
+
+        raise KeyError(keys)
+
+    async def pop_many(self, keys: typing.Iterable[int]) -> typing.Dict[int, steps._MT]:
+        result = {}
+        for key in keys:
+            if key in self._data:
+                try:
+                    result[key] = self._pop(key)
+                except KeyError:
+                    pass
+
+        return result
+
+    def has_item(self, key: int) -> bool:
+        return key in self._data
+
+    def _track(self, key: int) -> None:
+        pass
+
+    def _untrack(self, key: int) -> None:
+        pass
+
+    def _untrack_all(self) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """
+        Commits pending writes now.
+        """
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+
+        try:
+            await asyncio.get_event_loop().run_in_executor(self._executor, self._commit, dict(pending))
+        except BaseException:
+            # keep writes which came after, they are newer
+            pending.update(self._pending)
+            self._pending = pending
+            raise
+
+    async def close(self) -> None:
+        """
+        Commits pending writes and closes database.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+
+        await self.flush()
+        self._executor.shutdown()
+        self._conn.close()
+
+    def _set(self, key: int, value: steps._MT, deadline: typing.Optional[float]) -> None:
+        if deadline is None:
+            self._deadlines.pop(key, None)
+        else:
+            self._deadlines[key] = deadline
+
+        if isinstance(value, asyncio.Future):
+            self._data[key] = value
+            self._write(key, None)
+            return
+
+        step = steps.to_step(value)
+        self._data[key] = step
+        self._write(key, (pickle.dumps(tuple(step), pickle.HIGHEST_PROTOCOL), deadline))
+
+    def _pop(self, key: int) -> steps._MT:
+        value = self._data[key]
+
+        deadline = self._deadlines.get(key)
+        if deadline is not None and deadline <= time.time():
+            del self._data[key]
+            del self._deadlines[key]
+            if not isinstance(value, asyncio.Future):
+                self._write(key, None)
+
+            raise KeyError(key)
+
+        if isinstance(value, asyncio.Future):
+            del self._data[key]
+            self._deadlines.pop(key, None)
+            return value
+
+        # resolve handler before deleting, so a step isn't lost if it's not registered yet
+        try:
+            fn = steps.from_step(value)
+        except KeyError:
+            log.warning("SQLiteStore: step handler %r of key %d is not registered; step is kept", value.name, key)
+            raise KeyError(key) from None
+
+        del self._data[key]
+        self._deadlines.pop(key, None)
+        self._write(key, None)
+        return fn
+
+    def _write(self, key: typing.Any, value: _Row) -> None:
+        self._pending[key] = value
+
+        if len(self._pending) >= self.batch_size:
+            self._spawn_flush(0)
+        elif self._flusher is None:
+            self._spawn_flush(self.flush_interval)
+
+    def _spawn_flush(self, delay: float) -> None:
+        if self._flusher is not None:
+            if delay:
+                return
+
+            self._flusher.cancel()
+
+        self._flusher = asyncio.ensure_future(self._flush_later(delay))
+
+    async def _flush_later(self, delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+
+        self._flusher = None
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("SQLiteStore: cannot commit steps to %r", self.path)
+
+    def _commit(self, pending: typing.Dict[typing.Any, _Row]) -> None:
+        with self._conn:
+            self._conn.execute("BEGIN")
+
+            if _CLEAR in pending:
+                del pending[_CLEAR]
+                self._conn.execute("DELETE FROM steps")
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO steps (key, value, deadline) VALUES (?, ?, ?)",
+                [(k,) + v for k, v in pending.items() if v is not None],
+            )
+            self._conn.executemany("DELETE FROM steps WHERE key = ?", [(k,) for k, v in pending.items() if v is None])
@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+import typing
+
+from .. import steps
+
+
+def _resolve(future: asyncio.Future, _u: typing.Any) -> None:
+    if not future.done():
+        future.set_result(_u)
+
+
+class _LoopFuture(steps._WaiterProxy):
+    """
+    Proxy of a `wait_for` future which belongs to another thread's event loop; resolves
+    and cancels it on its own loop.
+    """
+
+    __slots__ = ("future", "loop")
+
+    def __init__(self, future: asyncio.Future) -> None:
+        self.future = future
+        self.loop = future.get_loop()
+
+    async def __call__(self, _c, _u) -> None:
+        self.loop.call_soon_threadsafe(_resolve, self.future, _u)
+
+    def cancel(self, msg: typing.Any = None) -> None:
+        self.loop.call_soon_threadsafe(self.future.cancel, msg)
+
+
+def _current_loop() -> typing.Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class ThreadSafeStore(steps.MetaStore):
+    """
+    Store which can be shared by clients running in different threads, each with its own
+    event loop.
+
+    Keys are spread over `stripes` dicts, each guarded by its own lock, so threads only
+    contend when they touch keys of the same stripe. A `wait_for` future popped in another
+    loop is resolved (or cancelled) on its own loop by `call_soon_threadsafe`. Tag index
+    of `register_next_step(..., tag=...)` is guarded by a lock of its own.
+
+    `ttl` of `register_next_step` is supported; an expired step is dropped when it's popped.
+
+    Parameters:
+        stripes (`int`, *optional*):
+            number of locks; rounded up to a power of two.
+
+    Example::
+
+        from pyrostep.stores import ThreadSafeStore
+
+        store = ThreadSafeStore()
+        pyrostep.change_root_store(store)
+
+        # in each thread
+        pyrostep.listen(app, store)
+    """
+
+    # waiter index of `wait_for` is a plain dict of one loop; keep waiters in store
+    local_waiters = False
+
+    def __init__(self, stripes: int = 64) -> None:
+        size = 1
+        while size < stripes:
+            size <<= 1
+
+        self._mask = size - 1
+        self._locks = [threading.Lock() for _ in range(size)]
+        self._dicts: typing.List[typing.Dict[int, typing.Any]] = [{} for _ in range(size)]
+        # monotonic deadlines of keys which have a ttl, striped like `_dicts`
+        self._deadlines: typing.List[typing.Dict[int, float]] = [{} for _ in range(size)]
+
+        # created here, as listener and register_next_step of any thread may use it
+        self._tags = steps._LockedTags()
+
+    @staticmethod
+    def _wrap(value: steps._MT) -> typing.Any:
+        return _LoopFuture(value) if isinstance(value, asyncio.Future) else value
+
+    @staticmethod
+    def _unwrap(value: typing.Any, loop: typing.Optional[asyncio.AbstractEventLoop]) -> steps._MT:
+        # own loop's futures are resolved directly
+        if isinstance(value, _LoopFuture) and value.loop is loop:
+            return value.future
+
+        return value
+
+    def _take(self, i: int, key: int, now: float) -> typing.Any:
+        # call with lock of stripe `i`; returns self if key isn't stored or is expired
+        value = self._dicts[i].pop(key, self)
+        deadlines = self._deadlines[i]
+        if deadlines:
+            deadline = deadlines.pop(key, None)
+            if deadline is not None and deadline <= now:
+                return self
+
+        return value
+
+    async def set_item(self, key: int, value: steps._MT, ttl: typing.Optional[float] = None) -> None:
+        i = hash(key) & self._mask
+        value = self._wrap(value)
+
+        with self._locks[i]:
+            self._dicts[i][key] = value
+            if ttl is not None:
+                self._deadlines[i][key] = time.monotonic() + ttl
+            elif self._deadlines[i]:
+                self._deadlines[i].pop(key, None)
+
+    async def pop_item(self, key: int) -> steps._MT:
+        i = hash(key) & self._mask
+
+        with self._locks[i]:
+            value = self._take(i, key, time.monotonic())
+
+        if value is self:
+            raise KeyError(key)
+
+        return self._unwrap(value, _current_loop())
+
+    async def pop_first(self, keys: typing.Iterable[int]) -> typing.Tuple[int, steps._MT]:
+        now = time.monotonic()
+        for key in keys:
+            i = hash(key) & self._mask
+
+            with self._locks[i]:
+                value = self._take(i, key, now)
+
+            if value is not self:
+                return key, self._unwrap(value, _current_loop())
+
+        raise KeyError(keys)
+
+    def _group(self, keys: typing.Iterable[int]) -> typing.Dict[int, typing.List[int]]:
+        groups: typing.Dict[int, typing.List[int]] = {}
+        for key in keys:
+            groups.setdefault(hash(key) & self._mask, []).append(key)
+
+        return groups
+
+    async def set_many(
+        self, items: typing.Iterable[typing.Tuple[int, steps._MT]], ttl: typing.Optional[float] = None
+    ) -> None:
+        groups: typing.Dict[int, typing.List[typing.Tuple[int, typing.Any]]] = {}
+        for key, value in items:
+            groups.setdefault(hash(key) & self._mask, []).append((key, self._wrap(value)))
+
+        deadline = None if ttl is None else time.monotonic() + ttl
+        for i, pairs in groups.items():
+            with self._locks[i]:
+                self._dicts[i].update(pairs)
+
+                deadlines = self._deadlines[i]
+                if deadline is not None:
+                    deadlines.update((key, deadline) for key, _ in pairs)
+                elif deadlines:
+                    for key, _ in pairs:
+                        deadlines.pop(key, None)
+
+    async def pop_many(self, keys: typing.Iterable[int]) -> typing.Dict[int, steps._MT]:
+        result = {}
+        now = time.monotonic()
+        for i, group in self._group(keys).items():
+            with self._locks[i]:
+                for key in group:
+                    value = self._take(i, key, now)
+                    if value is not self:
+                        result[key] = value
+
+        loop = _current_loop()
+        return {key: self._unwrap(value, loop) for key, value in result.items()}
+
+    async def clear(self) -> typing.AsyncGenerator[steps._MT, None]:
+        loop = _current_loop()
+
+        for i, lock in enumerate(self._locks):
+            with lock:
+                d, self._dicts[i] = self._dicts[i], {}
+                self._deadlines[i] = {}
+
+            for value in d.values():
+                yield self._unwrap(value, loop)
+
+    def has_item(self, key: int) -> bool:
+        # single dict lookup is atomic; a stale answer is settled by pop_first under lock
+        return key in self._dicts[hash(key) & self._mask]
+
+    def _track(self, key: int) -> None:
+        pass
+
+    def _untrack(self, key: int) -> None:
+        pass
+
+    def _untrack_all(self) -> None:
+        pass
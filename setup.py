@@ -13,7 +13,7 @@ setup(
     long_description_content_type="text/markdown",
     author="aWolver",
     url="https://github.com/awolverp/pyrostep",
-    packages=["pyrostep", "pyrostep.connection"],
+    packages=["pyrostep", "pyrostep.connection", "pyrostep.stores"],
     keywords=[
         "pyrostep",
         "pyrogram",